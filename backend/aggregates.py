@@ -0,0 +1,161 @@
+import bisect
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Optional
+
+from bounded_cache import BoundedCache
+from file_records import timestamp_ms
+
+logger = logging.getLogger(__name__)
+
+# Aggregates only see writes handled by this process, so rebuild them now and then
+AGGREGATES_TTL = float(os.getenv('AGGREGATES_TTL', '600'))
+AGGREGATES_MAX_USERS = int(os.getenv('AGGREGATES_MAX_USERS', '1000'))
+INSIGHTS_TOP_FILES = int(os.getenv('INSIGHTS_TOP_FILES', '5'))
+
+# Upper bounds (exclusive) of the size histogram buckets
+SIZE_BUCKETS = [
+    ("<100KB", 100 * 1024),
+    ("100KB-1MB", 1024 * 1024),
+    ("1MB-10MB", 10 * 1024 * 1024),
+    ("10MB-100MB", 100 * 1024 * 1024),
+    ("100MB-1GB", 1024 * 1024 * 1024),
+    (">=1GB", None),
+]
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+def size_bucket(size: int) -> int:
+    for index, (_, upper) in enumerate(SIZE_BUCKETS):
+        if upper is None or size < upper:
+            return index
+    return len(SIZE_BUCKETS) - 1
+
+
+def _size(record: dict) -> int:
+    try:
+        return int(record.get('size') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class UserAggregates:
+    """Running totals over one user's files, updated in O(log n) per file"""
+
+    def __init__(self):
+        self.files: dict = {}
+        self.bytes_by_category: Counter = Counter()
+        self.count_by_category: Counter = Counter()
+        self.size_histogram = [0] * len(SIZE_BUCKETS)
+        self.hour_histogram = [0] * 24
+        self.weekday_histogram = [0] * 7
+        # (size, id, name) ascending, so the largest files are at the end
+        self._by_size: list = []
+
+    def add(self, record: dict) -> None:
+        file_id = record.get('id')
+        if file_id is None:
+            return
+        file_id = str(file_id)
+        if file_id in self.files:
+            self.remove(file_id)
+
+        size = _size(record)
+        category = record.get('category') or "others"
+        created = timestamp_ms(record.get('created_at'))
+        when = datetime.fromtimestamp(created / 1000, tz=timezone.utc) if created else None
+        entry = (size, file_id, record.get('name') or "", category, when)
+        self.files[file_id] = entry
+
+        self.bytes_by_category[category] += size
+        self.count_by_category[category] += 1
+        self.size_histogram[size_bucket(size)] += 1
+        if when is not None:
+            self.hour_histogram[when.hour] += 1
+            self.weekday_histogram[when.weekday()] += 1
+        bisect.insort(self._by_size, entry[:3])
+
+    def remove(self, file_id: str) -> None:
+        entry = self.files.pop(str(file_id), None)
+        if entry is None:
+            return
+        size, _, _, category, when = entry
+        self.bytes_by_category[category] -= size
+        self.count_by_category[category] -= 1
+        if self.count_by_category[category] <= 0:
+            del self.count_by_category[category]
+            del self.bytes_by_category[category]
+        self.size_histogram[size_bucket(size)] -= 1
+        if when is not None:
+            self.hour_histogram[when.hour] -= 1
+            self.weekday_histogram[when.weekday()] -= 1
+        index = bisect.bisect_left(self._by_size, entry[:3])
+        if index < len(self._by_size) and self._by_size[index] == entry[:3]:
+            del self._by_size[index]
+
+    def largest(self, n: int) -> list:
+        return [
+            {"id": file_id, "name": name, "size": size}
+            for size, file_id, name in reversed(self._by_size[-n:])
+        ] if n > 0 else []
+
+    def snapshot(self, top_n: int = INSIGHTS_TOP_FILES) -> dict:
+        total_files = len(self.files)
+        total_bytes = sum(self.bytes_by_category.values())
+        busiest_hour = max(range(24), key=self.hour_histogram.__getitem__) if any(self.hour_histogram) else None
+        busiest_day = max(range(7), key=self.weekday_histogram.__getitem__) if any(self.weekday_histogram) else None
+        return {
+            "total_files": total_files,
+            "total_bytes": total_bytes,
+            "bytes_by_category": dict(self.bytes_by_category),
+            "files_by_category": dict(self.count_by_category),
+            "size_histogram": {label: count for (label, _), count in zip(SIZE_BUCKETS, self.size_histogram)},
+            "upload_hour_histogram": list(self.hour_histogram),
+            "peak_upload_hour": busiest_hour,
+            "most_active_day": WEEKDAYS[busiest_day] if busiest_day is not None else None,
+            "largest_files": self.largest(top_n),
+        }
+
+
+class AggregatesStore:
+    """Per-user aggregates with LRU eviction; users absent here need a rebuild"""
+
+    def __init__(self, max_users: int = AGGREGATES_MAX_USERS, ttl: float = AGGREGATES_TTL):
+        self._users = BoundedCache(max_users, ttl)
+        self.rebuilds = 0
+
+    def get(self, username: str) -> Optional[UserAggregates]:
+        return self._users.peek(username)
+
+    def rebuild(self, username: str, user_files: list) -> UserAggregates:
+        """Replace a user's aggregates from their full normalized listing"""
+        entry = UserAggregates()
+        for record in user_files:
+            entry.add(record)
+        self._users.set(username, entry)
+        self.rebuilds += 1
+        return entry
+
+    def add(self, username: str, record: dict) -> None:
+        entry = self.get(username)
+        if entry is not None:
+            entry.add(record)
+
+    def remove(self, username: str, file_id: str) -> None:
+        entry = self.get(username)
+        if entry is not None:
+            entry.remove(file_id)
+
+    def invalidate(self, username: str) -> None:
+        self._users.pop(username)
+
+    def clear(self) -> None:
+        self._users.clear()
+
+    def stats(self) -> dict:
+        return {"users": len(self._users), "rebuilds": self.rebuilds}
+
+
+aggregates = AggregatesStore()
@@ -0,0 +1,157 @@
+import hashlib
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import jwt
+from fastapi import Header, HTTPException
+from jwt.exceptions import ExpiredSignatureError, PyJWTError
+
+from bounded_cache import BoundedCache
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Set to MantaHQ's signing secret to verify tokens instead of only decoding them
+JWT_SECRET = os.getenv('JWT_SECRET') or None
+JWT_ALGORITHMS = [a.strip() for a in os.getenv('JWT_ALGORITHMS', 'HS256').split(',') if a.strip()]
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv('AUTH_CACHE_MAX_ENTRIES', '4096'))
+# Upper bound on how long claims are reused, for tokens without an exp claim
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '300'))
+
+
+@dataclass(frozen=True)
+class Principal:
+    """The caller behind a bearer token"""
+
+    token: str
+    claims: dict = field(repr=False)
+
+    @property
+    def username(self) -> Optional[str]:
+        return self.claims.get('username')
+
+    @property
+    def trusted(self) -> bool:
+        """Whether data cached under this username may be served to this token"""
+        return token_trusted(self.token)
+
+    @property
+    def user_id(self) -> Optional[str]:
+        claims = self.claims
+        return claims.get('id') or claims.get('user_id') or claims.get('userId') or self.username
+
+
+def token_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+
+def token_expiry(claims: Optional[dict], ttl: float) -> float:
+    """Wall-clock deadline for remembering something about a token: ttl, capped at exp"""
+    expires_at = time.time() + ttl
+    exp = (claims or {}).get('exp')
+    if isinstance(exp, (int, float)):
+        expires_at = min(expires_at, exp)
+    return expires_at
+
+
+class ClaimsCache:
+    """LRU of decoded claims keyed by token hash, never outliving the token's exp"""
+
+    def __init__(self, max_entries: int = AUTH_CACHE_MAX_ENTRIES, ttl: float = AUTH_CACHE_TTL):
+        self.ttl = ttl
+        # Wall clock, to compare with exp
+        self._entries = BoundedCache(max_entries, clock=time.time)
+
+    def get(self, token: str) -> Optional[dict]:
+        return self._entries.get(token_key(token))
+
+    def peek(self, token: str) -> Optional[dict]:
+        return self._entries.peek(token_key(token))
+
+    def put(self, token: str, claims: dict) -> None:
+        self._entries.set(token_key(token), claims, expires_at=token_expiry(claims, self.ttl))
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return self._entries.stats()
+
+
+claims_cache = ClaimsCache()
+
+
+class AcceptedTokens:
+    """Hashes of tokens MantaHQ has answered with a success, never outliving exp.
+
+    Without JWT_SECRET nothing here checks a token's signature, so anything
+    cached per username is only served to tokens MantaHQ has already
+    accepted; other tokens go upstream first.
+    """
+
+    def __init__(self, max_entries: int = AUTH_CACHE_MAX_ENTRIES, ttl: float = AUTH_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = BoundedCache(max_entries, clock=time.time)
+
+    def add(self, token: str) -> None:
+        self._entries.set(token_key(token), True, expires_at=token_expiry(claims_cache.peek(token), self.ttl))
+
+    def __contains__(self, token: str) -> bool:
+        return self._entries.peek(token_key(token)) is not None
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+accepted_tokens = AcceptedTokens()
+
+
+def token_trusted(token: str) -> bool:
+    """True when the token's signature was verified here or MantaHQ has accepted it"""
+    return bool(JWT_SECRET) or token in accepted_tokens
+
+
+def decode_claims(token: str) -> dict:
+    """Decode a token, checking the signature when JWT_SECRET is set; exp is always enforced"""
+    if JWT_SECRET:
+        return jwt.decode(token, JWT_SECRET, algorithms=JWT_ALGORITHMS)
+    return jwt.decode(token, options={"verify_signature": False, "verify_exp": True})
+
+
+def authenticate(token: str) -> Principal:
+    """Principal for a token, decoding at most once per token lifetime; raises PyJWTError"""
+    claims = claims_cache.get(token)
+    if claims is None:
+        with span("jwt.decode"):
+            claims = decode_claims(token)
+        claims_cache.put(token, claims)
+    return Principal(token=token, claims=claims)
+
+
+def bearer_token(authorization: str) -> str:
+    scheme, _, credentials = authorization.partition(' ')
+    return credentials.strip() if scheme.lower() == 'bearer' else authorization.strip()
+
+
+async def get_principal(authorization: Optional[str] = Header(None)) -> Principal:
+    """FastAPI dependency: the authenticated caller, or 401"""
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Authorization header required")
+    try:
+        return authenticate(bearer_token(authorization))
+    except ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token has expired")
+    except PyJWTError as e:
+        logger.warning(f"Rejected token: {e}")
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+
+async def get_user(authorization: Optional[str] = Header(None)) -> Principal:
+    """FastAPI dependency: like get_principal, but the token must name a user"""
+    principal = await get_principal(authorization)
+    if not principal.username:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return principal
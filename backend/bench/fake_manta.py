@@ -0,0 +1,157 @@
+"""A stand-in for the MantaHQ workflow API, for load benchmarks.
+
+Implements the /userauthflow and /filemanagement calls the backend makes,
+keeping records in memory. Every response is delayed by a configurable
+latency (plus jitter), and each user's collection is seeded with a
+configurable number of records so listings have a realistic size.
+
+    python -m bench.fake_manta --port 9001 --latency-ms 20 --files 1000
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import time
+from typing import Optional
+
+import jwt
+import uvicorn
+from fastapi import FastAPI, Header, Request
+from fastapi.responses import JSONResponse
+
+FAKE_MANTA_LATENCY_MS = float(os.getenv('FAKE_MANTA_LATENCY_MS', '20'))
+FAKE_MANTA_JITTER_MS = float(os.getenv('FAKE_MANTA_JITTER_MS', '5'))
+FAKE_MANTA_FILES = int(os.getenv('FAKE_MANTA_FILES', '500'))
+FAKE_MANTA_SECRET = "bench-secret"
+SEED_CATEGORIES = ("documents", "images", "videos", "audio", "others")
+
+
+def create_app(latency_ms: float = FAKE_MANTA_LATENCY_MS, jitter_ms: float = FAKE_MANTA_JITTER_MS, files_per_user: int = FAKE_MANTA_FILES) -> FastAPI:
+    app = FastAPI(title="Fake MantaHQ")
+    records: dict = {}
+    seeded: set = set()
+    ids = itertools.count(1)
+
+    async def delay() -> None:
+        seconds = (latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def caller(authorization: Optional[str]) -> Optional[str]:
+        token = (authorization or '').partition(' ')[2]
+        try:
+            return jwt.decode(token, FAKE_MANTA_SECRET, algorithms=["HS256"]).get("username")
+        except jwt.PyJWTError:
+            return None
+
+    def seed(username: str) -> None:
+        if username in seeded:
+            return
+        seeded.add(username)
+        now = int(time.time() * 1000)
+        for i in range(files_per_user):
+            file_id = str(next(ids))
+            category = SEED_CATEGORIES[i % len(SEED_CATEGORIES)]
+            records[file_id] = {
+                "id": file_id,
+                "s3_key": f"user-{username}/{category}/seed-{i}.bin",
+                "s3_url": f"https://bench.invalid/user-{username}/{category}/seed-{i}.bin",
+                "size": 1024 + i,
+                "content_type": "application/octet-stream",
+                "created_at": str(now - i * 60_000),
+                "username": username,
+            }
+
+    def unauthorized() -> JSONResponse:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+
+    def issue_token(username: str) -> dict:
+        token = jwt.encode({"username": username, "id": username, "exp": int(time.time()) + 24 * 3600}, FAKE_MANTA_SECRET, algorithm="HS256")
+        return {"status": "success", "token": token, "user": {"username": username}}
+
+    @app.post("/userauthflow/signup")
+    async def signup(request: Request):
+        body = await request.json()
+        await delay()
+        return issue_token(body["username"])
+
+    @app.post("/userauthflow/login")
+    async def login(request: Request):
+        body = await request.json()
+        await delay()
+        return issue_token(body["username"])
+
+    @app.put("/userauthflow/user-reset")
+    async def user_reset(authorization: Optional[str] = Header(None)):
+        await delay()
+        return {"status": "success"} if caller(authorization) else unauthorized()
+
+    @app.get("/filemanagement")
+    async def list_files(authorization: Optional[str] = Header(None)):
+        username = caller(authorization)
+        if username is None:
+            return unauthorized()
+        seed(username)
+        await delay()
+        return {"data": [record for record in records.values() if record["username"] == username]}
+
+    @app.post("/filemanagement")
+    async def create_file(request: Request, authorization: Optional[str] = Header(None)):
+        username = caller(authorization)
+        if username is None:
+            return unauthorized()
+        body = await request.json()
+        await delay()
+        file_id = str(next(ids))
+        records[file_id] = {**body, "id": file_id, "username": username}
+        return {"id": file_id, **body}
+
+    @app.post("/filemanagement/share")
+    async def share(request: Request, authorization: Optional[str] = Header(None)):
+        if caller(authorization) is None:
+            return unauthorized()
+        body = await request.json()
+        await delay()
+        return {"share_link": f"https://mantadrive.invalid/s/{body.get('file_id')}"}
+
+    @app.get("/filemanagement/{file_id}")
+    async def get_file(file_id: str, authorization: Optional[str] = Header(None)):
+        username = caller(authorization)
+        if username is None:
+            return unauthorized()
+        await delay()
+        record = records.get(file_id)
+        if record is None or record["username"] != username:
+            return JSONResponse({"error": "Not found"}, status_code=404)
+        return record
+
+    @app.delete("/filemanagement/{file_id}")
+    async def delete_file(file_id: str, authorization: Optional[str] = Header(None)):
+        username = caller(authorization)
+        if username is None:
+            return unauthorized()
+        await delay()
+        record = records.get(file_id)
+        if record is None or record["username"] != username:
+            return JSONResponse({"error": "Not found"}, status_code=404)
+        del records[file_id]
+        return {"status": "deleted"}
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency-ms", type=float, default=FAKE_MANTA_LATENCY_MS)
+    parser.add_argument("--jitter-ms", type=float, default=FAKE_MANTA_JITTER_MS)
+    parser.add_argument("--files", type=int, default=FAKE_MANTA_FILES, help="records seeded per user")
+    args = parser.parse_args()
+    app = create_app(args.latency_ms, args.jitter_ms, args.files)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
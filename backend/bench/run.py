@@ -0,0 +1,370 @@
+"""End-to-end load benchmark for the backend.
+
+Starts a fake MantaHQ (bench.fake_manta), an S3 stand-in and the backend
+itself as separate processes, then drives each scenario with a fixed number
+of requests at a fixed concurrency and reports throughput, p50/p99 latency
+and the backend's peak RSS. Run from backend/:
+
+    pip install -r bench/requirements.txt
+    python -m bench.run --concurrency 32 --requests 1000 --output ../bench_output.txt
+
+S3 is a moto server by default; `--s3 external --s3-endpoint URL` uses a
+running minio (or similar) with credentials from the environment, and
+`--s3 inprocess` mocks S3 inside the backend process (no extra install, but
+moto's work then shows up in the backend's numbers).
+
+`--save FILE` writes the results as JSON; `--baseline FILE` compares a run
+with saved results and exits non-zero when a scenario's throughput drops
+or its p99 latency grows by more than `--tolerance`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("upload", "list", "download", "download_stream", "qrcode", "delete")
+BUCKET = "mantadrive-bench"
+READY_TIMEOUT = 60
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """High-water RSS of a process so far (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(ordered: list, q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(int(round(q / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Processes:
+    """The stand-in servers and the backend, stopped together on exit.
+
+    Their output goes to <name>.log in `log_dir`, not a pipe nobody drains.
+    """
+
+    def __init__(self, log_dir: str):
+        self.log_dir = log_dir
+        self.running: dict = {}
+
+    def log_path(self, name: str) -> str:
+        return os.path.join(self.log_dir, f"{name}.log")
+
+    def start(self, name: str, args: list, env: Optional[dict] = None) -> subprocess.Popen:
+        with open(self.log_path(name), "wb") as log:
+            process = subprocess.Popen(args, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        self.running[name] = process
+        return process
+
+    def wait_ready(self, name: str, url: str) -> None:
+        process = self.running[name]
+        deadline = time.monotonic() + READY_TIMEOUT
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                with open(self.log_path(name), errors="replace") as log:
+                    raise RuntimeError(f"{name} exited during startup:\n{log.read()[-4000:]}")
+            try:
+                httpx.get(url, timeout=1)
+                return
+            except httpx.HTTPError:
+                time.sleep(0.2)
+        raise RuntimeError(f"{name} did not start listening on {url}")
+
+    def __enter__(self) -> "Processes":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        for process in self.running.values():
+            process.terminate()
+        for process in self.running.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+@dataclass
+class Result:
+    scenario: str
+    latencies: list = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0.0
+    peak_rss_mb: Optional[float] = None
+
+    def summary(self) -> dict:
+        ordered = sorted(self.latencies)
+        return {
+            "scenario": self.scenario,
+            "requests": len(ordered) + self.errors,
+            "errors": self.errors,
+            "throughput": round(len(ordered) / self.elapsed, 1) if self.elapsed else 0.0,
+            "p50_ms": round(percentile(ordered, 50) * 1000, 1),
+            "p99_ms": round(percentile(ordered, 99) * 1000, 1),
+            "peak_rss_mb": round(self.peak_rss_mb, 1) if self.peak_rss_mb is not None else None,
+        }
+
+
+async def drive(name: str, count: int, concurrency: int, op: Callable[[int], Awaitable[bool]]) -> Result:
+    """Run op(0..count-1) with `concurrency` requests in flight; failed ops count as errors"""
+    result = Result(name)
+    indexes = iter(range(count))
+
+    async def worker() -> None:
+        for i in indexes:
+            start = time.perf_counter()
+            try:
+                ok = await op(i)
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                result.latencies.append(time.perf_counter() - start)
+            else:
+                result.errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+class Bench:
+    """Scenario operations against a running backend"""
+
+    def __init__(self, client: httpx.AsyncClient, users: list, file_size: int):
+        self.client = client
+        self.users = users
+        self.payload = os.urandom(file_size)
+        self.files: list = []  # (token, file_id) of uploaded files
+
+    @staticmethod
+    def auth(token: str) -> dict:
+        return {"Authorization": f"Bearer {token}"}
+
+    async def upload(self, i: int) -> bool:
+        username, token = self.users[i % len(self.users)]
+        # A unique tail keeps deduplication from turning every upload into a metadata write
+        body = self.payload[:-16] + uuid.uuid4().bytes if len(self.payload) >= 16 else uuid.uuid4().bytes
+        response = await self.client.post(
+            "/upload",
+            files={"file": (f"bench-{i}-{uuid.uuid4().hex[:8]}.bin", body, "application/octet-stream")},
+            headers=self.auth(token),
+        )
+        if response.status_code != 200:
+            return False
+        self.files.append((token, response.json()["file_id"]))
+        return True
+
+    async def list(self, i: int) -> bool:
+        username, token = self.users[i % len(self.users)]
+        response = await self.client.get("/files", params={"username": username}, headers=self.auth(token))
+        return response.status_code == 200
+
+    async def download(self, i: int) -> bool:
+        token, file_id = self.files[i % len(self.files)]
+        response = await self.client.get(f"/download/{file_id}", headers=self.auth(token))
+        return response.status_code == 200
+
+    async def download_stream(self, i: int) -> bool:
+        token, file_id = self.files[i % len(self.files)]
+        response = await self.client.get(f"/download/{file_id}/stream", headers=self.auth(token))
+        return response.status_code == 200 and len(response.content) == len(self.payload)
+
+    async def qrcode(self, i: int) -> bool:
+        token, file_id = self.files[i % len(self.files)]
+        response = await self.client.post("/qrcode", json={"file_id": file_id, "manta_token": token})
+        return response.status_code == 200
+
+    async def delete(self, i: int) -> bool:
+        token, file_id = self.files[i]
+        response = await self.client.delete(f"/files/{file_id}", headers=self.auth(token))
+        return response.status_code == 200
+
+
+async def run_scenarios(api_url: str, api_pid: int, args: argparse.Namespace) -> list:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=api_url, limits=limits, timeout=120) as client:
+        users = []
+        for n in range(args.users):
+            username = f"bench{n}"
+            response = await client.post("/signup", json={"firstName": "Bench", "lastName": str(n), "username": username, "password": "bench"})
+            response.raise_for_status()
+            users.append((username, response.json()["token"]))
+
+        bench = Bench(client, users, args.file_size * 1024)
+        results = []
+        for name in args.scenarios:
+            if name in ("download", "download_stream", "qrcode", "delete") and not bench.files:
+                # These need stored files; the setup uploads aren't measured
+                await drive("setup", min(args.requests, 100), args.concurrency, bench.upload)
+            count = len(bench.files) if name == "delete" else args.requests
+            result = await drive(name, count, args.concurrency, getattr(bench, name))
+            if name == "delete":
+                bench.files.clear()
+            result.peak_rss_mb = peak_rss_mb(api_pid)
+            results.append(result.summary())
+            print(f"  {name}: {results[-1]['throughput']} req/s, p99 {results[-1]['p99_ms']} ms", file=sys.stderr)
+        return results
+
+
+def start_s3(processes: Processes, args: argparse.Namespace, env: dict) -> str:
+    """Start (or point at) the S3 stand-in and create the bucket; returns the serve_api --s3 mode"""
+    if args.s3 == "inprocess":
+        env.update(AWS_ACCESS_KEY_ID="testing", AWS_SECRET_ACCESS_KEY="testing")
+        return "inprocess"
+
+    if args.s3 == "moto":
+        port = free_port()
+        processes.start("moto", [sys.executable, "-m", "moto.server", "-p", str(port)])
+        endpoint = f"http://127.0.0.1:{port}"
+        processes.wait_ready("moto", endpoint)
+        env.update(AWS_ACCESS_KEY_ID="testing", AWS_SECRET_ACCESS_KEY="testing")
+    else:
+        if not args.s3_endpoint:
+            raise SystemExit("--s3 external needs --s3-endpoint")
+        endpoint = args.s3_endpoint
+
+    import boto3
+
+    s3 = boto3.client(
+        "s3",
+        endpoint_url=endpoint,
+        region_name=env["AWS_REGION"],
+        aws_access_key_id=env.get("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=env.get("AWS_SECRET_ACCESS_KEY"),
+    )
+    try:
+        s3.create_bucket(Bucket=BUCKET)
+    except s3.exceptions.BucketAlreadyOwnedByYou:
+        pass
+    env["S3_ENDPOINT_URL"] = endpoint
+    return "endpoint"
+
+
+def render_report(results: list, args: argparse.Namespace) -> str:
+    lines = [
+        f"concurrency={args.concurrency} requests={args.requests} users={args.users} file_size={args.file_size}KiB "
+        f"manta_latency={args.manta_latency_ms}ms collection={args.collection_size} s3={args.s3}",
+        f"{'scenario':<16} {'requests':>8} {'errors':>6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'peak RSS MB':>12}",
+    ]
+    for r in results:
+        rss = f"{r['peak_rss_mb']:.1f}" if r['peak_rss_mb'] is not None else "n/a"
+        lines.append(f"{r['scenario']:<16} {r['requests']:>8} {r['errors']:>6} {r['throughput']:>9.1f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} {rss:>12}")
+    return "\n".join(lines)
+
+
+def regressions(results: list, baseline: list, tolerance: float) -> list:
+    """Scenarios that got slower than the baseline by more than `tolerance`"""
+    before = {r["scenario"]: r for r in baseline}
+    found = []
+    for r in results:
+        old = before.get(r["scenario"])
+        if old is None:
+            continue
+        if old["throughput"] and r["throughput"] < old["throughput"] * (1 - tolerance):
+            found.append(f"{r['scenario']}: throughput {old['throughput']} -> {r['throughput']} req/s")
+        if old["p99_ms"] and r["p99_ms"] > old["p99_ms"] * (1 + tolerance):
+            found.append(f"{r['scenario']}: p99 {old['p99_ms']} -> {r['p99_ms']} ms")
+        if r["errors"] > old["errors"]:
+            found.append(f"{r['scenario']}: errors {old['errors']} -> {r['errors']}")
+    return found
+
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario (delete removes every uploaded file)")
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--file-size", type=int, default=256, help="upload size in KiB")
+    parser.add_argument("--manta-latency-ms", type=float, default=20)
+    parser.add_argument("--manta-jitter-ms", type=float, default=5)
+    parser.add_argument("--collection-size", type=int, default=500, help="MantaHQ records seeded per user")
+    parser.add_argument("--s3", choices=("moto", "external", "inprocess"), default="moto")
+    parser.add_argument("--s3-endpoint")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--save", help="write results as JSON, for use as a later --baseline")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv: Optional[list] = None) -> int:
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as workdir, Processes(workdir) as processes:
+        manta_port, api_port = free_port(), free_port()
+        processes.start("fake-manta", [
+            sys.executable, "-m", "bench.fake_manta", "--port", str(manta_port),
+            "--latency-ms", str(args.manta_latency_ms), "--jitter-ms", str(args.manta_jitter_ms),
+            "--files", str(args.collection_size),
+        ])
+        processes.wait_ready("fake-manta", f"http://127.0.0.1:{manta_port}/docs")
+
+        env = {
+            **os.environ,
+            "MANTA_BASE_URL": f"http://127.0.0.1:{manta_port}",
+            "DATABASE_URL": f"sqlite:///{workdir}/bench.db",
+            "S3_BUCKET_NAME": BUCKET,
+            "AWS_REGION": os.getenv("AWS_REGION", "us-east-1"),
+        }
+        # Tokens come from the fake MantaHQ, which signs with its own secret
+        env.pop("JWT_SECRET", None)
+        mode = start_s3(processes, args, env)
+
+        api = processes.start("backend", [sys.executable, "-m", "bench.serve_api", "--port", str(api_port), "--s3", mode], env)
+        api_url = f"http://127.0.0.1:{api_port}"
+        processes.wait_ready("backend", api_url)
+
+        results = asyncio.run(run_scenarios(api_url, api.pid, args))
+
+    report = render_report(results, args)
+    print(report)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(report + "\n")
+    if args.save:
+        with open(args.save, "w") as saved:
+            json.dump(results, saved, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as saved:
+            found = regressions(results, json.load(saved), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
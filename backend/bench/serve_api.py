@@ -0,0 +1,35 @@
+"""Run the backend for a benchmark, optionally against an in-process moto S3.
+
+With --s3 inprocess, S3 calls are served by moto's mock inside the backend
+process itself. That needs no extra server, but moto's own work is then
+counted in the backend's CPU time and RSS; prefer a moto server or minio
+(S3_ENDPOINT_URL) when comparing numbers.
+
+    python -m bench.serve_api --port 9000 --s3 endpoint
+"""
+import argparse
+import os
+
+import uvicorn
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--s3", choices=("endpoint", "inprocess"), default="endpoint")
+    args = parser.parse_args()
+
+    if args.s3 == "inprocess":
+        import boto3
+        from moto import mock_aws
+
+        mock_aws().start()
+        # main checks the bucket when it is imported, so it has to exist first
+        boto3.client("s3", region_name=os.getenv("AWS_REGION", "us-east-1")).create_bucket(Bucket=os.environ["S3_BUCKET_NAME"])
+
+    uvicorn.run("main:app", host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import weakref
+from contextlib import AsyncExitStack
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from botocore.exceptions import ClientError
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import BigInteger, Column, Float, Integer, String, func, update
+from sqlalchemy.exc import IntegrityError
+
+from database import Base, SessionLocal, init_db
+from file_records import user_prefix
+from multipart_upload import stream_upload
+
+logger = logging.getLogger(__name__)
+
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# "user" keeps blobs inside each user's folder; "bucket" shares them across users
+DEDUP_SCOPE = os.getenv('DEDUP_SCOPE', 'user')
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class Blob(Base):
+    """One stored object, named by its content hash"""
+
+    __tablename__ = "blobs"
+
+    blob_key = Column(String(1024), primary_key=True)
+    digest = Column(String(64), nullable=False, index=True)
+    size = Column(BigInteger, nullable=False, default=0)
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(Float, nullable=False)
+
+
+class BlobRef(Base):
+    """A file's logical s3_key (as recorded in MantaHQ) pointing at a blob"""
+
+    __tablename__ = "blob_refs"
+
+    s3_key = Column(String(1024), primary_key=True)
+    blob_key = Column(String(1024), nullable=False, index=True)
+    owner = Column(String(255), nullable=False, index=True)
+    size = Column(BigInteger, nullable=False, default=0)
+    created_at = Column(Float, nullable=False)
+
+
+@dataclass(frozen=True)
+class StoredUpload:
+    size: int
+    blob_key: str
+    deduplicated: bool
+    # Blobs the upload's key pointed at before and nobody references now, for delete_unreferenced
+    released: tuple = ()
+
+
+def hash_fileobj(fileobj: Any, chunk_size: int = HASH_CHUNK_SIZE) -> tuple:
+    """SHA-256 hex digest and size of a seekable file, rewound afterwards"""
+    fileobj.seek(0)
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest(), size
+
+
+def blob_key_for(digest: str, username: str, scope: str = DEDUP_SCOPE) -> str:
+    if scope == "bucket":
+        return f"blobs/sha256/{digest[:2]}/{digest}"
+    return f"{user_prefix(username)}blobs/sha256/{digest[:2]}/{digest}"
+
+
+class BlobStore:
+    """Reference-counted content-addressed storage for uploads.
+
+    Files keep their logical s3_key in MantaHQ; this store maps each key to
+    the blob holding its bytes, so identical content is written to S3 once.
+    Blob writes and deletes are serialized per blob within the process.
+    """
+
+    def __init__(self, session_factory=SessionLocal, scope: str = DEDUP_SCOPE, enabled: bool = DEDUP_ENABLED):
+        self.session_factory = session_factory
+        self.scope = scope
+        self.enabled = enabled
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.deduplicated = 0
+        self.bytes_saved = 0
+
+    def _lock(self, blob_key: str) -> asyncio.Lock:
+        lock = self._locks.get(blob_key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[blob_key] = lock
+        return lock
+
+    def _claim(self, blob_key: str) -> bool:
+        """Take a reference on an existing blob; False if it has to be written"""
+        init_db()
+        with self.session_factory() as session:
+            result = session.execute(
+                update(Blob)
+                .where(Blob.blob_key == blob_key, Blob.refcount > 0)
+                .values(refcount=Blob.refcount + 1)
+            )
+            session.commit()
+            return result.rowcount > 0
+
+    @staticmethod
+    def _decrement(session, blob_key: str) -> Optional[str]:
+        """Drop one reference; returns the blob key if that was the last one"""
+        session.execute(update(Blob).where(Blob.blob_key == blob_key).values(refcount=Blob.refcount - 1))
+        blob = session.get(Blob, blob_key, populate_existing=True)
+        if blob is not None and blob.refcount <= 0:
+            session.delete(blob)
+            return blob_key
+        return None
+
+    def _attach(self, s3_key: str, blob_key: str, digest: str, size: int, owner: str, claimed: bool) -> Optional[str]:
+        """Point s3_key at blob_key; returns a blob that lost its last reference"""
+        for attempt in range(2):
+            try:
+                with self.session_factory() as session:
+                    now = time.time()
+                    if not claimed:
+                        result = session.execute(
+                            update(Blob).where(Blob.blob_key == blob_key).values(refcount=Blob.refcount + 1)
+                        )
+                        if result.rowcount == 0:
+                            session.add(Blob(blob_key=blob_key, digest=digest, size=size, refcount=1, created_at=now))
+                    orphan = None
+                    ref = session.get(BlobRef, s3_key)
+                    if ref is None:
+                        session.add(BlobRef(s3_key=s3_key, blob_key=blob_key, owner=owner, size=size, created_at=now))
+                    else:
+                        # Re-upload to the same name releases whatever it pointed at
+                        previous = ref.blob_key
+                        ref.blob_key, ref.owner, ref.size, ref.created_at = blob_key, owner, size, now
+                        session.flush()
+                        orphan = self._decrement(session, previous)
+                    session.commit()
+                    return orphan
+            except IntegrityError:
+                # Another process inserted the same blob first; count ours on top
+                if attempt:
+                    raise
+        return None
+
+    def _blob_keys(self, s3_keys: list) -> dict:
+        init_db()
+        with self.session_factory() as session:
+            rows = session.query(BlobRef.s3_key, BlobRef.blob_key).filter(BlobRef.s3_key.in_(s3_keys)).all()
+            return dict(rows)
+
+    def _unlink(self, s3_keys: list) -> dict:
+        """Remove refs; returns {s3_key: object key to delete from S3, or None}"""
+        with self.session_factory() as session:
+            doomed = {key: key for key in s3_keys}  # keys stored before dedup own their object
+            for ref in session.query(BlobRef).filter(BlobRef.s3_key.in_(s3_keys)).all():
+                session.delete(ref)
+                session.flush()
+                doomed[ref.s3_key] = self._decrement(session, ref.blob_key)
+            session.commit()
+            return doomed
+
+    def _dedup_stats(self, owner: str) -> dict:
+        init_db()
+        with self.session_factory() as session:
+            groups = (
+                session.query(func.count(BlobRef.s3_key), func.max(BlobRef.size))
+                .filter(BlobRef.owner == owner)
+                .group_by(BlobRef.blob_key)
+                .all()
+            )
+        return {
+            "duplicate_files": sum(count - 1 for count, _ in groups),
+            "bytes_saved": sum((count - 1) * (size or 0) for count, size in groups),
+            "unique_blobs": len(groups),
+        }
+
+    async def store(self, storage: Any, s3_key: str, owner: str, file: UploadFile, content_type: str) -> StoredUpload:
+        """Hash the spooled upload and write it to S3 only if the content is new"""
+        if not self.enabled:
+            size = await stream_upload(storage, s3_key, file, content_type)
+            return StoredUpload(size, s3_key, False)
+
+        digest, size = await run_in_threadpool(hash_fileobj, file.file)
+        blob_key = blob_key_for(digest, owner, self.scope)
+        async with self._lock(blob_key):
+            claimed = await run_in_threadpool(self._claim, blob_key)
+            if not claimed:
+                await file.seek(0)
+                await stream_upload(storage, blob_key, file, content_type)
+            orphan = await run_in_threadpool(self._attach, s3_key, blob_key, digest, size, owner, claimed)
+        if claimed:
+            self.deduplicated += 1
+            self.bytes_saved += size
+            logger.info(f"Deduplicated upload {s3_key} -> {blob_key}")
+        return StoredUpload(size, blob_key, claimed, (orphan,) if orphan else ())
+
+    async def resolve(self, s3_key: str) -> str:
+        """Object key holding the bytes of a logical s3_key"""
+        return (await self.resolve_many([s3_key]))[s3_key]
+
+    async def resolve_many(self, s3_keys: list) -> dict:
+        found = await run_in_threadpool(self._blob_keys, list(s3_keys)) if s3_keys else {}
+        return {key: found.get(key, key) for key in s3_keys}
+
+    async def unlink(self, s3_keys: list) -> dict:
+        """Unlink logical keys without touching S3; returns {object key nobody references: s3_key}.
+
+        The objects are left for delete_unreferenced, so callers can defer
+        the S3 round trips (e.g. to the outbox).
+        """
+        s3_keys = list(dict.fromkeys(s3_keys))
+        if not s3_keys:
+            return {}
+        blob_keys = await run_in_threadpool(self._blob_keys, s3_keys)
+        async with AsyncExitStack() as stack:
+            for blob_key in sorted(set(blob_keys.values())):
+                await stack.enter_async_context(self._lock(blob_key))
+            doomed = await run_in_threadpool(self._unlink, s3_keys)
+        return {obj: key for key, obj in doomed.items() if obj}
+
+    async def detach(self, s3_keys: list) -> list:
+        """Forget the blobs behind logical keys whose object was just written directly.
+
+        Direct and resumable uploads put their bytes at the logical key, so a
+        ref left by an earlier upload under the same name would hide them.
+        Returns blob keys nobody references any more, for delete_unreferenced.
+        """
+        doomed = await self.unlink(s3_keys)
+        # Keys without a ref map to themselves; that object is the new upload
+        return [obj for obj, s3_key in doomed.items() if obj != s3_key]
+
+    def _live_blobs(self, object_keys: list) -> set:
+        init_db()
+        with self.session_factory() as session:
+            rows = session.query(Blob.blob_key).filter(Blob.blob_key.in_(object_keys), Blob.refcount > 0).all()
+            return {blob_key for blob_key, in rows}
+
+    @staticmethod
+    async def _rewritten(storage: Any, object_key: str, modified_before: float) -> bool:
+        """True if the object is gone or was written after modified_before"""
+        try:
+            head = await storage.head_object(Key=object_key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return True
+            raise
+        modified = head.get('LastModified')
+        return modified is not None and modified.timestamp() > modified_before
+
+    async def delete_unreferenced(self, storage: Any, object_keys: list, modified_before: Optional[float] = None) -> dict:
+        """Delete objects unlinked earlier; returns {object key: error}.
+
+        Objects referenced again since (a new upload of the same content) are
+        kept, as are objects rewritten after modified_before when it is given.
+        """
+        object_keys = list(dict.fromkeys(object_keys))
+        async with AsyncExitStack() as stack:
+            for object_key in sorted(object_keys):
+                await stack.enter_async_context(self._lock(object_key))
+            live = await run_in_threadpool(self._live_blobs, object_keys) if object_keys else set()
+            targets = [key for key in object_keys if key not in live]
+            if modified_before is not None and targets:
+                rewritten = await asyncio.gather(*(self._rewritten(storage, key, modified_before) for key in targets))
+                targets = [key for key, skip in zip(targets, rewritten) if not skip]
+            return await self._delete_objects(storage, {key: key for key in targets})
+
+    async def _delete_objects(self, storage: Any, targets: dict) -> dict:
+        """Delete {object key: s3_key}; returns {s3_key: error}"""
+        if not targets:
+            return {}
+        if len(targets) == 1:
+            (object_key, s3_key), = targets.items()
+            try:
+                await storage.delete_object(Key=object_key)
+                return {}
+            except Exception as e:
+                return {s3_key: str(e)}
+        errors = await storage.delete_objects(list(targets))
+        return {targets[key]: error for key, error in errors.items() if key in targets}
+
+    async def dedup_stats(self, owner: str) -> dict:
+        """Duplicate files and bytes saved among one user's files"""
+        return await run_in_threadpool(self._dedup_stats, owner)
+
+    @property
+    def reports_dedup(self) -> bool:
+        """Whether callers may be told an upload was deduplicated.
+
+        With blobs shared across users that would reveal that somebody else
+        already stores the same content.
+        """
+        return self.scope != "bucket"
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "scope": self.scope,
+            "deduplicated_uploads": self.deduplicated,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+blob_store = BlobStore()
@@ -0,0 +1,89 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class BoundedCache:
+    """LRU map with optional per-entry expiry and hit/miss counters.
+
+    The in-process caches are built on this: past `max_entries` the least
+    recently used entry is evicted, and an entry is dropped once `clock()`
+    reaches its expiry (`ttl` after it was set, unless set() is given one).
+    Only the event loop touches it, so it takes no locks.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        on_discard: Optional[Callable[[Hashable], None]] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        # Called with the key of every entry evicted or found expired
+        self.on_discard = on_discard
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def peek(self, key: Hashable) -> Any:
+        """The live value for key (marking it recently used), or None; not counted"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= self.clock():
+            self._discard(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def get(self, key: Hashable) -> Any:
+        """peek(), counted as a hit or a miss"""
+        value = self.peek(key)
+        self.count(value is not None)
+        return value
+
+    def count(self, hit: bool) -> None:
+        """Record a lookup the caller judged itself (e.g. a peeked value that was stale)"""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def set(self, key: Hashable, value: Any, expires_at: Optional[float] = None) -> None:
+        if expires_at is None and self.ttl is not None:
+            expires_at = self.clock() + self.ttl
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._discard(next(iter(self._entries)))
+            self.evictions += 1
+
+    def pop(self, key: Hashable) -> Any:
+        """Remove key, returning its value (expired or not) or None"""
+        entry = self._entries.pop(key, None)
+        return None if entry is None else entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _discard(self, key: Hashable) -> None:
+        del self._entries[key]
+        if self.on_discard is not None:
+            self.on_discard(key)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,102 @@
+import os
+import tempfile
+
+# A throwaway SQLite file, so threadpool sessions get their own connections
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/mantadrive-test.db")
+
+import asyncio
+
+import httpx
+import jwt
+import pytest
+
+from aggregates import aggregates
+from auth import accepted_tokens
+from database import Base, engine
+from file_cache import file_cache
+from file_index import metadata_index
+from manta_client import manta
+from outbox import outbox
+from qr_codes import qr_renderer
+from s3_storage import S3Storage
+from url_cache import url_cache
+
+BUCKET = "test-bucket"
+
+
+@pytest.fixture(autouse=True)
+def fresh_database():
+    """Empty every table so share links and blob refcounts don't leak between tests"""
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    yield
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """A moto S3 client with an empty BUCKET, installed as the app's storage"""
+    import main
+
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket=BUCKET)
+        monkeypatch.setattr(main, "storage", S3Storage(s3_client, BUCKET))
+        yield s3_client
+
+
+def drain_outbox() -> int:
+    """Run queued compensating actions now (tests have no lifespan worker)"""
+    return asyncio.run(outbox.run_due())
+
+
+def make_token(username: str = "alice") -> str:
+    return jwt.encode({"username": username, "id": username}, "test-secret", algorithm="HS256")
+
+
+class MantaStub:
+    """Records MantaHQ calls and answers them from a route table"""
+
+    def __init__(self):
+        self.calls = []
+        self.routes = {}
+
+    def route(self, method: str, path: str, response):
+        self.routes[(method, path)] = response
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        self.calls.append((request.method, path))
+        response = self.routes.get((request.method, path))
+        if response is None:
+            return httpx.Response(404, json={"error": "not found"})
+        if callable(response):
+            return response(request)
+        return response
+
+    def count(self, method: str, path: str) -> int:
+        return self.calls.count((method, path))
+
+
+@pytest.fixture
+def manta_stub(monkeypatch):
+    stub = MantaStub()
+    # Swap the transport of the shared client so every module sees the stub
+    monkeypatch.setattr(manta, "base_url", "https://manta.test")
+    monkeypatch.setattr(manta, "transport", httpx.MockTransport(stub.handler))
+    monkeypatch.setattr(manta, "_client", None)
+    accepted_tokens.clear()
+    file_cache.clear()
+    metadata_index.clear()
+    url_cache.clear()
+    qr_renderer.clear()
+    aggregates.clear()
+    yield stub
+    accepted_tokens.clear()
+    aggregates.clear()
+    file_cache.clear()
+    metadata_index.clear()
+    url_cache.clear()
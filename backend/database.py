@@ -0,0 +1,50 @@
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import DeclarativeBase, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///./mantadrive.db')
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+def _create_engine(url: str):
+    if not url.startswith('sqlite'):
+        return create_engine(url, pool_pre_ping=True)
+
+    in_memory = url in ('sqlite://', 'sqlite:///:memory:')
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        # A single shared connection keeps an in-memory database alive
+        poolclass=StaticPool if in_memory else None,
+    )
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL lets the uvicorn worker processes read while one writes
+        if not in_memory:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+    return engine
+
+
+engine = _create_engine(DATABASE_URL)
+SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+
+_initialized = False
+
+
+def init_db() -> None:
+    """Create any missing tables (idempotent)"""
+    global _initialized
+    if not _initialized:
+        Base.metadata.create_all(engine)
+        _initialized = True
@@ -0,0 +1,78 @@
+import math
+import os
+from typing import Optional
+
+from multipart_upload import MIN_PART_SIZE, S3_UPLOAD_PART_SIZE
+from s3_storage import S3Storage
+
+# Largest object S3 accepts in a single PUT, and the multipart part limit
+MAX_SINGLE_PUT_SIZE = 5 * 1024 ** 3
+MAX_PARTS = 10000
+DIRECT_UPLOAD_MULTIPART_THRESHOLD = int(os.getenv('DIRECT_UPLOAD_MULTIPART_THRESHOLD', str(64 * 1024 * 1024)))
+DIRECT_UPLOAD_URL_EXPIRY = int(os.getenv('DIRECT_UPLOAD_URL_EXPIRY', '3600'))
+
+
+def part_size_for(size: int) -> int:
+    """Smallest configured part size that keeps the upload within 10,000 parts"""
+    return max(S3_UPLOAD_PART_SIZE, MIN_PART_SIZE, math.ceil(size / MAX_PARTS))
+
+
+async def plan_upload(
+    storage: S3Storage,
+    key: str,
+    size: int,
+    content_type: str,
+    method: str = "PUT",
+    multipart: Optional[bool] = None,
+) -> dict:
+    """Presigned URLs the browser uses to send an object straight to S3"""
+    if multipart is None:
+        multipart = size > DIRECT_UPLOAD_MULTIPART_THRESHOLD
+    if size > MAX_SINGLE_PUT_SIZE:
+        multipart = True
+
+    if not multipart:
+        if method == "POST":
+            # POST policies can pin the size and content type server-side
+            post = await storage.generate_presigned_post(
+                key,
+                fields={"Content-Type": content_type},
+                conditions=[{"Content-Type": content_type}, ["content-length-range", 0, size]],
+                expires_in=DIRECT_UPLOAD_URL_EXPIRY,
+            )
+            return {"mode": "single", "method": "POST", "url": post["url"], "fields": post["fields"]}
+
+        url = await storage.generate_presigned_url(
+            'put_object',
+            Key=key,
+            ContentType=content_type,
+            expires_in=DIRECT_UPLOAD_URL_EXPIRY,
+        )
+        return {"mode": "single", "method": "PUT", "url": url, "headers": {"Content-Type": content_type}}
+
+    part_size = part_size_for(size)
+    part_count = max(math.ceil(size / part_size), 1)
+    created = await storage.create_multipart_upload(Key=key, ContentType=content_type)
+    upload_id = created['UploadId']
+    urls = await storage.presign_parts(key, upload_id, part_count, expires_in=DIRECT_UPLOAD_URL_EXPIRY)
+    return {
+        "mode": "multipart",
+        "method": "PUT",
+        "upload_id": upload_id,
+        "part_size": part_size,
+        "parts": [{"part_number": number, "url": url} for number, url in enumerate(urls, start=1)],
+    }
+
+
+async def finish_upload(storage: S3Storage, key: str, upload_id: Optional[str] = None, parts: Optional[list] = None) -> dict:
+    """Complete a multipart upload if needed, then HEAD the object to verify it"""
+    if upload_id:
+        await storage.complete_multipart_upload(
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": [
+                {"PartNumber": part["part_number"], "ETag": part["etag"]}
+                for part in sorted(parts or [], key=lambda p: p["part_number"])
+            ]},
+        )
+    return await storage.head_object(Key=key)
@@ -0,0 +1,58 @@
+import logging
+import os
+from typing import Optional
+
+from bounded_cache import BoundedCache
+
+logger = logging.getLogger(__name__)
+
+# Entries are only invalidated by writes handled in this process, so keep the
+# TTL short enough that other uvicorn workers' writes show up promptly.
+FILE_CACHE_TTL = float(os.getenv('FILE_CACHE_TTL', '30'))
+FILE_CACHE_MAX_USERS = int(os.getenv('FILE_CACHE_MAX_USERS', '1000'))
+
+
+class FileListCache:
+    """In-process LRU/TTL cache of each user's normalized file list"""
+
+    def __init__(self, max_users: int = FILE_CACHE_MAX_USERS, ttl: float = FILE_CACHE_TTL):
+        self._entries = BoundedCache(max_users, ttl)
+        self.invalidations = 0
+
+    def get(self, username: str) -> Optional[list]:
+        """Cached files for a user (newest first), or None on a miss"""
+        return self._entries.get(username)
+
+    def set(self, username: str, files: list) -> None:
+        self._entries.set(username, files)
+
+    def invalidate(self, username: str) -> None:
+        if self._entries.pop(username) is not None:
+            self.invalidations += 1
+
+    def add(self, username: str, record: dict) -> None:
+        """Patch a new upload into a cached listing (newest first)"""
+        files = self._entries.peek(username)
+        if files is not None:
+            files.insert(0, record)
+
+    def remove(self, username: str, file_id: str) -> None:
+        """Drop a deleted file from a cached listing"""
+        files = self._entries.peek(username)
+        if files is not None:
+            files[:] = [f for f in files if f.get('id') != file_id]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        stats = self._entries.stats()
+        return {
+            "users": stats.pop("entries"),
+            **stats,
+            "invalidations": self.invalidations,
+            "evictions": self._entries.evictions,
+        }
+
+
+file_cache = FileListCache()
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from auth import token_trusted
+from bounded_cache import BoundedCache
+from file_records import extract_file_list, user_prefix, username_from_s3_key
+from manta_client import manta
+
+logger = logging.getLogger(__name__)
+
+METADATA_INDEX_TTL = float(os.getenv('METADATA_INDEX_TTL', '300'))
+METADATA_INDEX_MAX_USERS = int(os.getenv('METADATA_INDEX_MAX_USERS', '1000'))
+# Parallel single-record lookups for ids a complete index doesn't know
+METADATA_LOOKUP_CONCURRENCY = int(os.getenv('METADATA_LOOKUP_CONCURRENCY', '8'))
+
+
+class MetadataUnavailable(Exception):
+    """MantaHQ could not be asked for file metadata"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class UserIndex:
+    """Hash index of one user's raw MantaHQ records"""
+
+    __slots__ = ("by_id", "by_key", "complete")
+
+    def __init__(self, complete: bool = False):
+        self.by_id: dict = {}
+        self.by_key: dict = {}
+        self.complete = complete
+
+    def put(self, record: dict) -> None:
+        if record.get('id') is not None:
+            self.by_id[str(record['id'])] = record
+        if record.get('s3_key'):
+            self.by_key[record['s3_key']] = record
+
+    def drop(self, file_id: str) -> Optional[dict]:
+        record = self.by_id.pop(str(file_id), None)
+        if record is not None and record.get('s3_key'):
+            self.by_key.pop(record['s3_key'], None)
+        return record
+
+
+class MetadataIndex:
+    """Per-user file_id -> record and s3_key -> record index with LRU eviction"""
+
+    def __init__(self, max_users: int = METADATA_INDEX_MAX_USERS, ttl: float = METADATA_INDEX_TTL):
+        self._users = BoundedCache(max_users, ttl)
+
+    def _entry(self, username: str, create: bool = False) -> Optional[UserIndex]:
+        entry = self._users.peek(username)
+        if entry is None and create:
+            entry = UserIndex()
+            self._users.set(username, entry)
+        return entry
+
+    def is_complete(self, username: str) -> bool:
+        """True when the user's full listing is indexed and still fresh"""
+        entry = self._entry(username)
+        return entry is not None and entry.complete
+
+    def get(self, username: str, file_id: str) -> Optional[dict]:
+        entry = self._entry(username)
+        record = entry.by_id.get(str(file_id)) if entry else None
+        self._users.count(record is not None)
+        return record
+
+    def get_by_key(self, username: str, s3_key: str) -> Optional[dict]:
+        entry = self._entry(username)
+        return entry.by_key.get(s3_key) if entry else None
+
+    def fill(self, username: str, all_files: list) -> None:
+        """Replace a user's index with the records from a full listing"""
+        entry = UserIndex(complete=True)
+        prefix = user_prefix(username)
+        for record in all_files:
+            if isinstance(record, dict) and str(record.get('s3_key', '')).startswith(prefix):
+                entry.put(record)
+        self._users.set(username, entry)
+
+    def add(self, username: str, record: dict) -> None:
+        self._entry(username, create=True).put(record)
+
+    def remove(self, username: str, file_id: str) -> Optional[dict]:
+        entry = self._entry(username)
+        return entry.drop(file_id) if entry else None
+
+    def invalidate(self, username: str) -> None:
+        self._users.pop(username)
+
+    def clear(self) -> None:
+        self._users.clear()
+
+    def stats(self) -> dict:
+        stats = self._users.stats()
+        return {"users": stats.pop("entries"), **stats}
+
+
+class MetadataResolver:
+    """Resolves file ids to MantaHQ records, consulting the index before MantaHQ"""
+
+    def __init__(self, index: MetadataIndex):
+        self.index = index
+
+    async def fetch_listing(self, token: str, username: Optional[str] = None) -> list:
+        """Fetch the whole /filemanagement collection, indexing the user's records"""
+        response = await manta.get("/filemanagement", token=token, timeout=10)
+        if response.status_code != 200:
+            raise MetadataUnavailable(response.status_code, "Failed to get files")
+        all_files = extract_file_list(response.json())
+        if username:
+            self.index.fill(username, all_files)
+        return all_files
+
+    async def resolve(
+        self,
+        file_id: str,
+        token: str,
+        username: Optional[str] = None,
+        allow_listing: bool = True,
+    ) -> Optional[dict]:
+        """Record for file_id, or None if it does not exist.
+
+        The index only answers tokens whose signature was verified or that
+        MantaHQ has already accepted; anything else is asked upstream.
+        """
+        trusted = token_trusted(token)
+        if username and trusted:
+            record = self.index.get(username, file_id)
+            if record is not None:
+                return record
+
+        response = await manta.get(f"/filemanagement/{file_id}", token=token, timeout=10)
+        if response.status_code == 200:
+            record = response.json()
+            owner = username_from_s3_key(record.get('s3_key', '')) if isinstance(record, dict) else None
+            if owner:
+                self.index.add(owner, record)
+            return record
+        if response.status_code != 404:
+            raise MetadataUnavailable(response.status_code, "Failed to get file metadata")
+
+        # A fresh full listing already told us everything this user owns
+        if not allow_listing or (username and trusted and self.index.is_complete(username)):
+            return None
+
+        # Fall back to one listing fetch, which also warms the index
+        all_files = await self.fetch_listing(token, username)
+        if username:
+            return self.index.get(username, file_id)
+        for record in all_files:
+            if isinstance(record, dict) and str(record.get('id')) == str(file_id):
+                return record
+        return None
+
+    async def resolve_many(self, file_ids: list, token: str, username: str) -> dict:
+        """Records for many ids at once: {file_id: record or None}.
+
+        Costs at most one listing fetch, and none when the user's index is
+        already complete and the token is trusted (see resolve()). A complete
+        index can still be stale (files registered through another worker),
+        so its misses are looked up one by one instead.
+        """
+        trusted = token_trusted(token)
+        found = {file_id: self.index.get(username, file_id) if trusted else None for file_id in file_ids}
+        missing = [file_id for file_id, record in found.items() if record is None]
+        if not missing:
+            return found
+        if not (trusted and self.index.is_complete(username)):
+            await self.fetch_listing(token, username)
+            for file_id in missing:
+                found[file_id] = self.index.get(username, file_id)
+            return found
+
+        slots = asyncio.Semaphore(METADATA_LOOKUP_CONCURRENCY)
+
+        async def lookup(file_id: str) -> Optional[dict]:
+            async with slots:
+                record = await self.resolve(file_id, token, username, allow_listing=False)
+            # Like the index, only ever answer with the user's own files
+            if isinstance(record, dict) and username_from_s3_key(record.get('s3_key', '')) == username:
+                return record
+            return None
+
+        records = await asyncio.gather(*(lookup(file_id) for file_id in missing))
+        found.update(zip(missing, records))
+        return found
+
+    def remember(self, username: str, record: dict) -> None:
+        self.index.add(username, record)
+
+    def forget(self, username: str, file_id: str) -> None:
+        self.index.remove(username, file_id)
+
+
+metadata_index = MetadataIndex()
+resolver = MetadataResolver(metadata_index)
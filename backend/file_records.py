@@ -0,0 +1,122 @@
+import logging
+from datetime import datetime
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_TYPES = [
+    'application/pdf',
+    'application/msword',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+]
+
+
+def file_category(content_type: str) -> str:
+    """Storage category (S3 sub-folder) for a content type"""
+    if content_type.startswith('image/'):
+        return "images"
+    elif content_type.startswith('video/'):
+        return "videos"
+    elif content_type.startswith('audio/'):
+        return "audio"
+    elif content_type in DOCUMENT_TYPES:
+        return "documents"
+    return "others"
+
+
+def user_prefix(username: str) -> str:
+    return f"user-{username}/"
+
+
+def username_from_s3_key(s3_key: str) -> Optional[str]:
+    """Owner of an object laid out as user-{username}/..."""
+    head = s3_key.split('/', 1)[0]
+    if head.startswith('user-') and '/' in s3_key:
+        return head[len('user-'):]
+    return None
+
+
+def extract_file_list(response_data: Any) -> list:
+    """Pull the record list out of a MantaHQ /filemanagement response"""
+    # Handle the specific response structure with 'data' field
+    all_files = response_data.get('data', []) if isinstance(response_data, dict) else response_data
+    if not isinstance(all_files, list):
+        return []
+    return all_files
+
+
+def normalize_file(file: dict, username: str) -> Optional[dict]:
+    """Frontend shape of a MantaHQ record, or None if it is not in the user's folder"""
+    # Skip files without s3_key
+    s3_key = file.get('s3_key', '')
+    prefix = user_prefix(username)
+    if not s3_key or not s3_key.startswith(prefix):
+        return None
+
+    # Extract category from path
+    path_parts = s3_key[len(prefix):].split('/')
+    category = path_parts[0] if len(path_parts) > 1 else "others"
+
+    # Get original filename if available, otherwise extract from s3_key
+    display_name = file.get('filename', '')
+    if not display_name:
+        display_name = path_parts[-1] if path_parts else s3_key.split('/')[-1]
+
+    # Format created_at as ISO string if it's a timestamp
+    created_at = file.get('created_at')
+    formatted_date = None
+
+    if created_at and isinstance(created_at, str) and created_at.isdigit():
+        try:
+            # Convert milliseconds to seconds for datetime
+            timestamp = int(created_at) / 1000
+            formatted_date = datetime.fromtimestamp(timestamp).isoformat()
+        except (ValueError, OverflowError) as e:
+            logger.warning(f"Error formatting timestamp {created_at}: {e}")
+            formatted_date = None
+
+    return {
+        'id': file.get('id'),
+        'name': display_name,
+        'size': file.get('size', 0),
+        'type': file.get('content_type', 'application/octet-stream'),
+        'category': category,
+        'createdAt': formatted_date or created_at,  # For frontend compatibility
+        'created_at': created_at,   # Keep original field too
+        's3_key': s3_key,
+        's3_url': file.get('s3_url')
+    }
+
+
+def normalize_user_files(all_files: list, username: str) -> list:
+    """Normalize every record in the user's folder, skipping malformed ones"""
+    user_files = []
+    for file in all_files:
+        try:
+            record = normalize_file(file, username)
+        except Exception as file_error:
+            # Log error but continue processing other files
+            logger.error(f"Error processing file: {file_error}")
+            continue
+        if record is not None:
+            user_files.append(record)
+    return user_files
+
+
+def timestamp_ms(created_at: Any) -> int:
+    """Numeric creation time in milliseconds (0 when missing or unparseable)"""
+    if isinstance(created_at, (int, float)):
+        return int(created_at)
+    if isinstance(created_at, str) and created_at:
+        if created_at.isdigit():
+            return int(created_at)
+        try:
+            return int(datetime.fromisoformat(created_at.replace('Z', '+00:00')).timestamp() * 1000)
+        except ValueError:
+            return 0
+    return 0
+
+
+def sort_newest_first(user_files: list) -> None:
+    """Sort files by parsed creation time (newest first), ties broken by id"""
+    user_files.sort(key=lambda x: (timestamp_ms(x.get('created_at')), str(x.get('id'))), reverse=True)
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Optional
+
+from file_records import user_prefix
+
+logger = logging.getLogger(__name__)
+
+USER_SUBFOLDERS = ["documents/", "images/", "videos/", "others/"]
+# S3 prefixes are implicit; markers only make empty folders show up in consoles
+FOLDER_MARKERS = os.getenv('FOLDER_MARKERS', 'true').lower() in ('1', 'true', 'yes')
+PROVISION_WORKERS = int(os.getenv('PROVISION_WORKERS', '2'))
+PROVISION_MAX_ATTEMPTS = int(os.getenv('PROVISION_MAX_ATTEMPTS', '5'))
+PROVISION_RETRY_DELAY = float(os.getenv('PROVISION_RETRY_DELAY', '0.5'))
+
+
+def folder_marker_keys(user_id: str) -> list:
+    base_folder = user_prefix(user_id)
+    return [base_folder] + [f"{base_folder}{subfolder}" for subfolder in USER_SUBFOLDERS]
+
+
+async def create_folder_markers(storage: Any, user_id: str) -> str:
+    """Put every marker object for a user concurrently; safe to repeat"""
+    await asyncio.gather(*(
+        storage.put_object(Key=key, Body=b'', ContentType='application/x-directory')
+        for key in folder_marker_keys(user_id)
+    ))
+    return user_prefix(user_id)
+
+
+class ProvisioningQueue:
+    """Runs per-user provisioning jobs on worker tasks, off the request path.
+
+    Jobs for a user already queued are coalesced, and failures are retried
+    with exponential backoff, so handlers must be idempotent.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[str], Awaitable[Any]],
+        workers: int = PROVISION_WORKERS,
+        max_attempts: int = PROVISION_MAX_ATTEMPTS,
+        retry_delay: float = PROVISION_RETRY_DELAY,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: list = []
+        self._pending: set = set()
+        self.completed = 0
+        self.retries = 0
+        self.failed = 0
+
+    def _ensure_started(self) -> asyncio.Queue:
+        # Workers belong to the loop that first enqueues (rebuilt if it changes)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._pending = set()
+            self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+        return self._queue
+
+    def enqueue(self, user_id: str) -> bool:
+        """Queue a job; False if one for this user is already waiting"""
+        queue = self._ensure_started()
+        if user_id in self._pending:
+            return False
+        self._pending.add(user_id)
+        queue.put_nowait(user_id)
+        return True
+
+    async def _work(self) -> None:
+        while True:
+            user_id = await self._queue.get()
+            try:
+                await self._run(user_id)
+            finally:
+                self._pending.discard(user_id)
+                self._queue.task_done()
+
+    async def _run(self, user_id: str) -> None:
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await self.handler(user_id)
+                self.completed += 1
+                logger.info(f"Provisioned folders for user: {user_id}")
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    self.failed += 1
+                    logger.error(f"Giving up provisioning folders for {user_id} after {attempt} attempts: {e}")
+                    return
+                self.retries += 1
+                logger.warning(f"Provisioning folders for {user_id} failed (attempt {attempt}): {e}")
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    async def join(self) -> None:
+        """Wait until every queued job has finished"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def aclose(self) -> None:
+        if self._loop is asyncio.get_running_loop():
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        self._queue = None
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._pending),
+            "completed": self.completed,
+            "retries": self.retries,
+            "failed": self.failed,
+        }
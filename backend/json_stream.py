@@ -0,0 +1,123 @@
+import json
+from typing import Any, AsyncIterator
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+# Drop consumed text once this much has piled up at the front of the buffer
+_COMPACT_AT = 64 * 1024
+
+
+class _Buffer:
+    """Text pulled from an async chunk iterator on demand"""
+
+    def __init__(self, chunks: AsyncIterator[str]):
+        self.chunks = chunks.__aiter__()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    async def fill(self) -> bool:
+        """Append the next chunk; False at end of input"""
+        if self.eof:
+            return False
+        try:
+            chunk = await self.chunks.__anext__()
+        except StopAsyncIteration:
+            self.eof = True
+            return False
+        if self.pos >= _COMPACT_AT:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        self.text += chunk
+        return True
+
+    async def peek(self) -> str:
+        """Next non-whitespace character (not consumed), or '' at end of input"""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not await self.fill():
+                return ""
+
+    async def expect(self, char: str) -> None:
+        found = await self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos}, found {found!r}")
+        self.pos += 1
+
+    async def value(self) -> Any:
+        """Decode the next complete JSON value"""
+        await self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+                # A number or literal ending at the buffer edge may continue in the next chunk
+                if end < len(self.text) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            await self.fill()
+
+
+async def iter_json_array(chunks: AsyncIterator[str], key: str = "data") -> AsyncIterator[Any]:
+    """Yield the elements of a JSON array as they arrive.
+
+    Accepts either a top-level array or an object holding the array under
+    `key` (MantaHQ's {"data": [...]} envelope). Only one element is decoded
+    at a time, so memory does not grow with the size of the array. An object
+    without `key` yields nothing.
+    """
+    buffer = _Buffer(chunks)
+    first = await buffer.peek()
+    if first == "[":
+        pass
+    elif first == "{":
+        buffer.pos += 1
+        while True:
+            if await buffer.peek() == "}":
+                return
+            name = await buffer.value()
+            await buffer.expect(":")
+            if name == key and await buffer.peek() == "[":
+                break
+            await buffer.value()
+            if await buffer.peek() == ",":
+                buffer.pos += 1
+    else:
+        return
+
+    await buffer.expect("[")
+    if await buffer.peek() == "]":
+        return
+    while True:
+        yield await buffer.value()
+        separator = await buffer.peek()
+        buffer.pos += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(f"Expected ',' or ']' in array, found {separator!r}")
+
+
+async def ndjson_chunks(records: AsyncIterator[Any], flush_bytes: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """Encode records as NDJSON: the first line goes out at once, the rest in ~flush_bytes batches"""
+    batch = []
+    size = 0
+    first = True
+    async for record in records:
+        line = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+        if first:
+            first = False
+            yield line
+            continue
+        batch.append(line)
+        size += len(line)
+        if size >= flush_bytes:
+            yield b"".join(batch)
+            batch, size = [], 0
+    if batch:
+        yield b"".join(batch)
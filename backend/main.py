@@ -1,29 +1,76 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Header
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Response, Depends, Header, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.requests import ClientDisconnect
 from pydantic import BaseModel
+from contextlib import AsyncExitStack, asynccontextmanager
+import asyncio
 import base64
-import requests
-import qrcode
-import io
-import boto3
+import httpx
 from botocore.exceptions import ClientError, NoCredentialsError
 import os
-from typing import Optional
+from typing import List, Optional
 import logging
-import jwt
 from jwt.exceptions import PyJWTError
 import uuid
 from datetime import datetime
+from email.utils import formatdate
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+from manta_client import manta
+from auth import Principal, authenticate, claims_cache, get_principal, get_user, token_trusted
+from multipart_upload import measure_upload
+from blob_store import StoredUpload, blob_store
+from direct_upload import finish_upload, plan_upload
+from range_download import NotModified, RangeNotSatisfiable, content_disposition, iter_body, open_object, response_headers
+from outbox import OutboxTask, PermanentFailure, outbox
+from thumbnails import THUMBNAIL_FORMATS, ThumbnailUnavailable, thumbnails
+from resumable_upload import OffsetMismatch, UnalignedChunk, UploadNotFound, UploadOverflow, resumable_uploads
+from s3_storage import S3Storage, create_s3_client
+from file_cache import file_cache
+from aggregates import aggregates
+from organizer import FALLBACK_CATEGORY, organizer
+from file_index import MetadataUnavailable, metadata_index, resolver
+from url_cache import url_cache
+from qr_codes import QR_FORMATS, qr_renderer
+from folder_provisioning import FOLDER_MARKERS, ProvisioningQueue, create_folder_markers
+from share_store import ShareForbidden, ShareGone, ShareNotFound, ShareSecretRequired, parse_expiry, share_store
+from json_stream import iter_json_array, ndjson_chunks
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, registry as metrics_registry
+from tracing import TracingMiddleware
+from pagination import MAX_PAGE_SIZE, SORT_FIELDS, SORT_ORDERS, InvalidCursor, paginate, sort_files
+from file_records import (
+    file_category as get_file_category,
+    normalize_file,
+    normalize_user_files,
+    sort_newest_first,
+    username_from_s3_key,
+)
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="MantaDrive Backend")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    janitor = asyncio.create_task(resumable_uploads.run_janitor(storage))
+    # Picks up compensating actions left over from earlier runs, too
+    outbox.start()
+    yield
+    janitor.cancel()
+    await asyncio.gather(janitor, return_exceptions=True)
+    await outbox.aclose()
+    # Release pooled MantaHQ connections and S3 worker threads on shutdown
+    await folder_queue.aclose()
+    await manta.aclose()
+    storage.shutdown()
+    qr_renderer.shutdown()
+    thumbnails.shutdown()
+
+app = FastAPI(title="MantaDrive Backend", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -32,20 +79,19 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Opens the per-request trace that MantaHQ, S3 and rendering steps record spans into
+app.add_middleware(TracingMiddleware)
+# Outermost, so the timings include every other middleware
+app.add_middleware(MetricsMiddleware)
 
 
 
-MANTA_BASE_URL = os.getenv('MANTA_BASE_URL', "https://api.mantahq.com/api/workflow/olaleye/mantadrive")
-
 # AWS S3 Configuration with better error handling
+S3_BUCKET = os.getenv('S3_BUCKET_NAME', 'mantadrive-users')
+storage = S3Storage(bucket=S3_BUCKET)
+
 try:
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        region_name=os.getenv('AWS_REGION', 'us-east-1')
-    )
-    S3_BUCKET = os.getenv('S3_BUCKET_NAME', 'mantadrive-users')
+    s3_client = create_s3_client()
     
     # Test S3 connection and bucket existence
     try:
@@ -60,12 +106,23 @@ try:
         else:
             logger.error(f"Error accessing S3 bucket: {e}")
     
+    storage.configure(s3_client, S3_BUCKET)
+    
 except NoCredentialsError:
     logger.error("AWS credentials not found. Please set AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY")
-    s3_client = None
 except Exception as e:
     logger.error(f"Error initializing S3 client: {e}")
-    s3_client = None
+
+DOWNLOAD_URL_EXPIRY = int(os.getenv('DOWNLOAD_URL_EXPIRY', '3600'))  # 1 hour
+UPLOAD_BATCH_MAX_FILES = int(os.getenv('UPLOAD_BATCH_MAX_FILES', '100'))
+UPLOAD_BATCH_CONCURRENCY = int(os.getenv('UPLOAD_BATCH_CONCURRENCY', '4'))
+UPLOAD_BATCH_REGISTER_CONCURRENCY = int(os.getenv('UPLOAD_BATCH_REGISTER_CONCURRENCY', '8'))
+DELETE_BATCH_MAX_FILES = int(os.getenv('DELETE_BATCH_MAX_FILES', '5000'))
+DELETE_BATCH_CONCURRENCY = int(os.getenv('DELETE_BATCH_CONCURRENCY', '8'))
+QR_BATCH_MAX_FILES = int(os.getenv('QR_BATCH_MAX_FILES', '100'))
+QR_BATCH_CONCURRENCY = int(os.getenv('QR_BATCH_CONCURRENCY', '8'))
+NDJSON_FLUSH_BYTES = int(os.getenv('NDJSON_FLUSH_BYTES', str(64 * 1024)))
+LISTING_FORMATS = ("json", "ndjson")
 
 class ShareLinkRequest(BaseModel):
     file_id: str
@@ -74,6 +131,12 @@ class ShareLinkRequest(BaseModel):
 class QRCodeRequest(BaseModel):
     file_id: str
     manta_token: str
+    format: Optional[str] = "png"  # png or svg
+
+class QRCodeBatchRequest(BaseModel):
+    file_ids: List[str]
+    manta_token: str
+    format: Optional[str] = "png"
 
 class SignupRequest(BaseModel):
     firstName: str
@@ -85,69 +148,78 @@ class LoginRequest(BaseModel):
     username: str
     password: str
 
+class UploadInitiateRequest(BaseModel):
+    filename: str
+    content_type: Optional[str] = None
+    size: int
+    method: Optional[str] = "PUT"  # PUT or POST for single-part uploads
+    multipart: Optional[bool] = None  # Default: chosen from size
+
+class UploadedPart(BaseModel):
+    part_number: int
+    etag: str
+
+class UploadCompleteRequest(BaseModel):
+    s3_key: str
+    upload_id: Optional[str] = None
+    parts: Optional[List[UploadedPart]] = None
+
+class ResumableUploadRequest(BaseModel):
+    filename: str
+    content_type: Optional[str] = None
+    size: int
+
+class DeleteBatchRequest(BaseModel):
+    file_ids: List[str]
+
 class UserResetRequest(BaseModel):
     firstName: Optional[str] = None
     lastName: Optional[str] = None
     currentPassword: str
     newPassword: Optional[str] = None
 
-def create_user_folders_from_token(token: str) -> None:
+def user_id_from_token(token: str) -> Optional[str]:
+    """User id used for a user's S3 folder, taken from their MantaHQ token"""
+    principal = authenticate(token)
+    if not principal.user_id:
+        logger.warning(f"Could not extract user ID from token. Token payload: {principal.claims}")
+    return principal.user_id
+
+async def create_user_folders_from_token(token: str) -> None:
     """Extract user info from token and create S3 folders"""
     try:
-        # Decode token without verification (we just need the user info)
-        # In production, you should verify the token
-        decoded = jwt.decode(token, options={"verify_signature": False})
-        
-        # Extract username or user ID from token
-        username = decoded.get('username')
-        user_id = decoded.get('id') or decoded.get('user_id') or decoded.get('userId') or username
-        
+        user_id = user_id_from_token(token)
         if user_id:
             logger.info(f"Creating folders for user from token: {user_id}")
-            create_s3_folder(user_id)
-        else:
-            logger.warning(f"Could not extract user ID from token. Token payload: {decoded}")
+            await create_s3_folder(user_id)
     except PyJWTError as e:
         logger.error(f"Error decoding JWT token: {e}")
     except Exception as e:
         logger.error(f"Error in create_user_folders_from_token: {e}")
 
-def create_s3_folder(user_id: str) -> dict:
+async def provision_user_folders(user_id: str) -> None:
+    """Queue job: folder markers for a new user, raising so failures are retried"""
+    if not storage.available:
+        raise RuntimeError("S3 client not initialized")
+    await create_folder_markers(storage, user_id)
+
+folder_queue = ProvisioningQueue(provision_user_folders)
+
+async def create_s3_folder(user_id: str) -> dict:
     """Create S3 folder structure for user with proper error handling"""
-    if not s3_client:
+    if not storage.available:
         return {"error": "S3 client not initialized"}
     
-    base_folder = f"user-{user_id}/"
-    subfolders = ["documents/", "images/", "videos/", "others/"]
-    
     try:
-        # First check if bucket exists
-        s3_client.head_bucket(Bucket=S3_BUCKET)
-        
-        # Create the main folder by putting an empty object
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key=base_folder,
-            Body=b'',
-            ContentType='application/x-directory'
-        )
-        
-        # Create subfolders
-        for subfolder in subfolders:
-            subfolder_key = f"{base_folder}{subfolder}"
-            s3_client.put_object(
-                Bucket=S3_BUCKET,
-                Key=subfolder_key,
-                Body=b'',
-                ContentType='application/x-directory'
-            )
-            logger.info(f"Created S3 subfolder: {subfolder_key}")
+        # Markers are independent, so write them all at once; a missing
+        # bucket surfaces as NoSuchBucket without a separate head_bucket
+        base_folder = await create_folder_markers(storage, user_id)
         
         logger.info(f"Created S3 folder structure for user: {user_id}")
         return {
             "success": True,
             "s3_folder": base_folder,
-            "s3_bucket": S3_BUCKET
+            "s3_bucket": storage.bucket
         }
         
     except ClientError as e:
@@ -155,9 +227,9 @@ def create_s3_folder(user_id: str) -> dict:
         error_message = e.response['Error']['Message']
         
         if error_code == 'NoSuchBucket':
-            error_msg = f"S3 bucket '{S3_BUCKET}' does not exist"
+            error_msg = f"S3 bucket '{storage.bucket}' does not exist"
         elif error_code == 'AccessDenied':
-            error_msg = f"Access denied to S3 bucket '{S3_BUCKET}'"
+            error_msg = f"Access denied to S3 bucket '{storage.bucket}'"
         else:
             error_msg = f"S3 error ({error_code}): {error_message}"
             
@@ -169,13 +241,216 @@ def create_s3_folder(user_id: str) -> dict:
         logger.error(error_msg)
         return {"error": error_msg}
 
+def new_file_metadata(username: str, s3_key: str, s3_url: str, size: int, content_type: str) -> dict:
+    """Record registered with MantaHQ for a newly stored file"""
+    return {
+        "s3_url": s3_url,
+        "s3_key": s3_key,
+        "size": size,
+        "content_type": content_type,
+        "created_at": str(int(datetime.utcnow().timestamp() * 1000)),
+        "username": username
+    }
+
+def remember_upload(username: str, metadata: dict, response_data: dict) -> None:
+    """Patch a freshly registered file into the user's cached listing"""
+    file_id = response_data.get("id") if isinstance(response_data, dict) else None
+    if not file_id:
+        # Without the upstream id the cached listing can't be patched reliably
+        file_cache.invalidate(username)
+        metadata_index.invalidate(username)
+        aggregates.invalidate(username)
+        return
+    resolver.remember(username, {**metadata, "id": file_id})
+    record = normalize_file({**metadata, "id": file_id}, username)
+    if record:
+        file_cache.add(username, record)
+        aggregates.add(username, record)
+
+def forget_file(username: str, file_id: str) -> None:
+    """Drop a deleted file from the listing cache, index and aggregates"""
+    file_cache.remove(username, file_id)
+    resolver.forget(username, file_id)
+    aggregates.remove(username, file_id)
+
+# Metadata deletes worth retrying later; any other refusal is final
+TRANSIENT_MANTA_STATUSES = (408, 429)
+
+def manta_delete_is_transient(status: Optional[int]) -> bool:
+    return status is None or status >= 500 or status in TRANSIENT_MANTA_STATUSES
+
+@outbox.handler("delete_objects")
+async def delete_unreferenced_objects(task: OutboxTask) -> None:
+    """Outbox: remove S3 objects that deleted or rejected files no longer reference"""
+    if not storage.available:
+        raise RuntimeError("S3 client not available")
+    # On retries, anything written after the task was queued belongs to a newer upload
+    modified_before = task.created_at if task.attempt > 1 else None
+    errors = await blob_store.delete_unreferenced(storage, task.payload["keys"], modified_before)
+    if errors:
+        key, error = next(iter(errors.items()))
+        raise RuntimeError(f"{len(errors)} objects not deleted, e.g. {key}: {error}")
+
+@outbox.handler("delete_metadata", secrets=("token",))
+async def delete_metadata_later(task: OutboxTask) -> None:
+    """Outbox: finish removing a deleted file's MantaHQ record.
+
+    MantaHQ only deletes a record for its owner, so the payload has to carry
+    the caller's bearer token; the outbox drops it when the task finishes or
+    is dead-lettered, and an expired token makes the task fail permanently.
+    """
+    response = await manta.delete(f"/filemanagement/{task.payload['file_id']}", token=task.payload["token"], timeout=10)
+    if response.status_code in (200, 204, 404):
+        return
+    if not manta_delete_is_transient(response.status_code):
+        raise PermanentFailure(f"MantaHQ refused the delete: {response.status_code}")
+    raise RuntimeError(f"MantaHQ returned {response.status_code}")
+
+async def discard_objects(object_keys: list) -> None:
+    """Queue S3 deletes; the outbox worker retries them until they stick"""
+    if object_keys:
+        await outbox.enqueue("delete_objects", {"keys": list(object_keys)})
+
+async def discard_uploads(s3_keys: list) -> None:
+    """Unlink files from their blobs now and delete the unreferenced objects in the background"""
+    doomed = await blob_store.unlink(s3_keys)
+    await discard_objects(list(doomed))
+
+async def store_upload(s3_key: str, username: str, file: UploadFile, content_type: str) -> StoredUpload:
+    """blob_store.store(), queueing the blob a re-upload under the same name released"""
+    stored = await blob_store.store(storage, s3_key, username, file, content_type)
+    await discard_objects(list(stored.released))
+    return stored
+
+async def adopt_direct_upload(s3_key: str) -> None:
+    """An object was written at its logical key outside blob_store.store(); drop any stale blob ref"""
+    await discard_objects(await blob_store.detach([s3_key]))
+
+async def release_thumbnails(s3_keys: list) -> None:
+    """Unindex the renditions of deleted files and queue their previews for deletion"""
+    await discard_objects(await thumbnails.forget(s3_keys))
+
+async def generate_thumbnails(username: str, s3_key: str) -> None:
+    """Background job after an image upload: drop old renditions, render the eager ones"""
+    try:
+        await thumbnails.invalidate(s3_key)
+        if thumbnails.eager_widths:
+            await thumbnails.generate(storage, username, s3_key, await blob_store.resolve(s3_key))
+    except ThumbnailUnavailable as e:
+        logger.info(f"No thumbnails for {s3_key}: {e}")
+    except Exception as e:
+        logger.warning(f"Thumbnail generation failed for {s3_key}: {e}")
+
+def schedule_thumbnails(background_tasks: BackgroundTasks, username: str, s3_key: str, content_type: str) -> None:
+    if thumbnails.supports(content_type):
+        background_tasks.add_task(generate_thumbnails, username, s3_key)
+
+def token_username(token: str) -> Optional[str]:
+    """Username claim of a MantaHQ token, if it can be decoded"""
+    try:
+        return authenticate(token).username
+    except PyJWTError:
+        return None
+
+def invalidate_listing_for_token(token: str) -> None:
+    """Drop the cached listing of the user a token belongs to"""
+    username = token_username(token)
+    if username:
+        file_cache.invalidate(username)
+        aggregates.invalidate(username)
+
+async def load_user_files(username: str, token: str) -> list:
+    """The user's normalized listing (newest first), from the cache or MantaHQ.
+
+    The cache only answers tokens MantaHQ has already accepted. Raises
+    MetadataUnavailable when MantaHQ can't be listed.
+    """
+    user_files = file_cache.get(username) if token_trusted(token) else None
+    if user_files is not None:
+        return user_files
+    
+    # Get all files from MantaHQ (this also refreshes the metadata index)
+    all_files = await resolver.fetch_listing(token, username)
+    logger.info(f"Successfully parsed response with {len(all_files)} files")
+    
+    # Filter files by user folder and cache the normalized listing
+    user_files = normalize_user_files(all_files, username)
+    try:
+        sort_newest_first(user_files)
+    except Exception as sort_error:
+        # Don't fail the whole request just because sorting failed
+        logger.error(f"Error sorting files: {sort_error}")
+    file_cache.set(username, user_files)
+    return user_files
+
+async def stream_user_files(username: str, token: str, category: Optional[str]) -> StreamingResponse:
+    """NDJSON listing that never holds the whole collection in memory.
+    
+    Served from the cached listing when there is one; otherwise the upstream
+    `data` array is parsed record by record as it arrives, in upstream order.
+    """
+    def matches(record: Optional[dict]) -> bool:
+        return record is not None and (not category or record['category'] == category)
+    
+    cached = file_cache.get(username) if token_trusted(token) else None
+    if cached is not None:
+        async def from_cache():
+            for record in cached:
+                if matches(record):
+                    yield record
+        return StreamingResponse(ndjson_chunks(from_cache(), NDJSON_FLUSH_BYTES), media_type="application/x-ndjson")
+    
+    stack = AsyncExitStack()
+    response = await stack.enter_async_context(manta.stream("GET", "/filemanagement", token=token, timeout=30))
+    if response.status_code != 200:
+        logger.info(f"Files API response status: {response.status_code}")
+        await stack.aclose()
+        return StreamingResponse(iter(()), media_type="application/x-ndjson")
+    
+    async def from_upstream():
+        try:
+            async for raw in iter_json_array(response.aiter_text()):
+                if not isinstance(raw, dict):
+                    continue
+                try:
+                    record = normalize_file(raw, username)
+                except Exception as file_error:
+                    logger.error(f"Error processing file: {file_error}")
+                    continue
+                if matches(record):
+                    yield record
+        except ValueError as e:
+            # The status line is already sent, so a bad body can only end the stream early
+            logger.error(f"Error parsing MantaHQ response stream: {e}")
+        finally:
+            await stack.aclose()
+    
+    return StreamingResponse(ndjson_chunks(from_upstream(), NDJSON_FLUSH_BYTES), media_type="application/x-ndjson")
+
+async def resolve_file(file_id: str, token: str) -> dict:
+    """MantaHQ record for a file id, served from the metadata index when possible"""
+    try:
+        file_data = await resolver.resolve(file_id, token, token_username(token))
+    except MetadataUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    if not file_data:
+        raise HTTPException(status_code=404, detail="File not found")
+    return file_data
+
+def share_owner(file_data: dict, principal: Principal) -> str:
+    """The caller's username when they own the file, else 403; shares are stored under it"""
+    owner = username_from_s3_key(file_data.get('s3_key') or '')
+    if owner is None or owner != principal.username:
+        raise HTTPException(status_code=403, detail="You can only share your own files")
+    return owner
+
 @app.post("/signup")
 async def signup_user(request: SignupRequest):
     """Proxy signup to MantaHQ API and create S3 folder"""
     try:
         # Call MantaHQ signup API
-        response = requests.post(
-            f"{MANTA_BASE_URL}/userauthflow/signup",
+        response = await manta.post(
+            "/userauthflow/signup",
             json={
                 "firstName": request.firstName,
                 "lastName": request.lastName,
@@ -192,22 +467,22 @@ async def signup_user(request: SignupRequest):
         manta_response = response.json()
         logger.info(f"Signup response: {manta_response}")
         
-        # Create S3 folders in background without modifying the response
+        # Queue S3 folder creation; the response doesn't wait for it
         try:
             # Extract token from response to get user info
             token = manta_response.get('token')
-            if token:
-                # Use the token to create S3 folders
-                # This is a background task that doesn't affect the response
-                create_user_folders_from_token(token)
+            if token and FOLDER_MARKERS:
+                user_id = user_id_from_token(token)
+                if user_id:
+                    folder_queue.enqueue(user_id)
         except Exception as folder_error:
-            logger.error(f"Error creating S3 folders: {folder_error}")
+            logger.error(f"Error queueing S3 folder creation: {folder_error}")
             # Don't fail the signup process if folder creation fails
         
         # Return the exact MantaHQ response
         return manta_response
             
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Request error during signup: {e}")
         raise HTTPException(status_code=500, detail=f"Request error: {str(e)}")
     except Exception as e:
@@ -221,8 +496,8 @@ async def login_user(request: LoginRequest):
     """Proxy login to MantaHQ API"""
     try:
         # Forward request directly to MantaHQ API
-        response = requests.post(
-            f"{MANTA_BASE_URL}/userauthflow/login",
+        response = await manta.post(
+            "/userauthflow/login",
             json={
                 "username": request.username,
                 "password": request.password
@@ -236,7 +511,7 @@ async def login_user(request: LoginRequest):
         # Return the exact response from MantaHQ API
         return response.json()
             
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Request error during login: {e}")
         raise HTTPException(status_code=500, detail=f"Request error: {str(e)}")
     except Exception as e:
@@ -245,85 +520,60 @@ async def login_user(request: LoginRequest):
 
 @app.post("/upload")
 async def upload_file(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    authorization: Optional[str] = Header(None)
+    principal: Principal = Depends(get_user)
 ):
     """Upload file to S3 then register metadata with MantaHQ"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authorization header required")
-    
-    manta_token = authorization.replace("Bearer ", "")
+    manta_token = principal.token
+    username = principal.username
     logger.info(f"Upload request received for file: {file.filename}")
     
     try:
-        # Get user info from token
-        decoded = jwt.decode(manta_token, options={"verify_signature": False})
-        username = decoded.get('username')
-        if not username:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        # Read file content
-        file_content = await file.read()
-        file_size = len(file_content)
-        
         # Get content type
         content_type = file.content_type or 'application/octet-stream'
         
         # Determine file category for organized storage
-        file_category = "others"
-        if content_type.startswith('image/'):
-            file_category = "images"
-        elif content_type.startswith('video/'):
-            file_category = "videos"
-        elif content_type.startswith('audio/'):
-            file_category = "audio"
-        elif content_type in ['application/pdf', 'application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
-            file_category = "documents"
+        file_category = get_file_category(content_type)
         
         # Create S3 key with proper structure matching your bucket
         s3_key = f"user-{username}/{file_category}/{file.filename}"
+        deduplicated = False
         
         # Check if S3 client is available
-        if not s3_client:
+        if not storage.available:
             logger.warning("S3 client not available, using fallback storage")
             # Fallback: Store metadata only in MantaHQ
             s3_url = f"https://demo-mantadrive.s3.amazonaws.com/{s3_key}"
+            file_size = await measure_upload(file)
         else:
             try:
-                # Upload to S3
-                s3_client.put_object(
-                    Bucket=S3_BUCKET,
-                    Key=s3_key,
-                    Body=file_content,
-                    ContentType=content_type
-                )
+                # Hash the upload and stream it to S3 unless the content is already stored
+                stored = await store_upload(s3_key, username, file, content_type)
+                file_size = stored.size
+                deduplicated = stored.deduplicated
                 
                 # Generate S3 URL
-                aws_region = os.getenv('AWS_REGION', 'us-east-1')
-                s3_url = f"https://{S3_BUCKET}.s3.{aws_region}.amazonaws.com/{s3_key}"
+                s3_url = storage.object_url(stored.blob_key)
                 logger.info(f"Successfully uploaded to S3: {s3_key}")
                 
             except ClientError as e:
                 logger.error(f"S3 upload failed: {e}")
                 # Fallback to demo URL if S3 fails
                 s3_url = f"https://demo-mantadrive.s3.amazonaws.com/{s3_key}"
+                file_size = await measure_upload(file)
             except Exception as e:
                 logger.error(f"S3 upload error: {e}")
                 # Fallback to demo URL if S3 fails
                 s3_url = f"https://demo-mantadrive.s3.amazonaws.com/{s3_key}"
+                file_size = await measure_upload(file)
         
         # Send to MantaHQ
-        manta_response = requests.post(
-            f"{MANTA_BASE_URL}/filemanagement",
-            json={
-                "s3_url": s3_url,
-                "s3_key": s3_key,
-                "size": file_size,
-                "content_type": content_type,
-                "created_at": str(int(datetime.utcnow().timestamp() * 1000)),
-                "username": username
-            },
-            headers={"Authorization": f"Bearer {manta_token}"},
+        metadata = new_file_metadata(username, s3_key, s3_url, file_size, content_type)
+        manta_response = await manta.post(
+            "/filemanagement",
+            json=metadata,
+            token=manta_token,
             timeout=30
         )
         
@@ -333,18 +583,18 @@ async def upload_file(
         
         # Handle MantaHQ errors
         if manta_response.status_code not in [200, 201]:
-            # Clean up S3 if MantaHQ fails
-            if s3_client and "demo-mantadrive" not in s3_url:
-                try:
-                    s3_client.delete_object(Bucket=S3_BUCKET, Key=s3_key)
-                except:
-                    pass
+            # Clean up S3 if MantaHQ fails (retried in the background until done)
+            if storage.available and "demo-mantadrive" not in s3_url:
+                await discard_uploads([s3_key])
             raise HTTPException(status_code=manta_response.status_code, 
                                 detail=f"Failed to register file: {manta_response.text[:100]}")
         
         # Return success
         response_data = manta_response.json()
-        return {
+        remember_upload(username, metadata, response_data)
+        if "demo-mantadrive" not in s3_url:
+            schedule_thumbnails(background_tasks, username, s3_key, content_type)
+        result = {
             "success": True,
             "message": "File uploaded successfully",
             "file_id": response_data.get("id") or str(uuid.uuid4()),
@@ -352,198 +602,453 @@ async def upload_file(
             "size": file_size,
             "content_type": content_type,
             "s3_url": s3_url,
-            "category": file_category
+            "category": file_category,
         }
+        if blob_store.reports_dedup:
+            result["deduplicated"] = deduplicated
+        return result
         
     except Exception as e:
         logger.error(f"Upload error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/upload/batch")
+async def upload_files_batch(
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(...),
+    principal: Principal = Depends(get_user)
+):
+    """Upload many files in one request.
+    
+    Files are streamed to S3 with bounded concurrency, then the successful
+    ones are registered with MantaHQ concurrently. Each file gets its own
+    entry in `results`; one failure does not fail the batch.
+    """
+    if not storage.available:
+        raise HTTPException(status_code=500, detail="S3 client not available")
+    if len(files) > UPLOAD_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {UPLOAD_BATCH_MAX_FILES} files per batch")
+    
+    manta_token = principal.token
+    username = principal.username
+    
+    upload_slots = asyncio.Semaphore(UPLOAD_BATCH_CONCURRENCY)
+    register_slots = asyncio.Semaphore(UPLOAD_BATCH_REGISTER_CONCURRENCY)
+    
+    async def store(file: UploadFile) -> dict:
+        content_type = file.content_type or 'application/octet-stream'
+        file_category = get_file_category(content_type)
+        s3_key = f"user-{username}/{file_category}/{file.filename}"
+        async with upload_slots:
+            try:
+                stored = await store_upload(s3_key, username, file, content_type)
+            except Exception as e:
+                logger.error(f"S3 upload failed for {s3_key}: {e}")
+                return {"filename": file.filename, "success": False, "stage": "storage", "error": str(e)}
+        s3_url = storage.object_url(stored.blob_key)
+        result = {
+            "filename": file.filename,
+            "success": True,
+            "category": file_category,
+            "metadata": new_file_metadata(username, s3_key, s3_url, stored.size, content_type)
+        }
+        if blob_store.reports_dedup:
+            result["deduplicated"] = stored.deduplicated
+        return result
+    
+    async def register(result: dict) -> dict:
+        if not result["success"]:
+            return result
+        metadata = result.pop("metadata")
+        async with register_slots:
+            try:
+                manta_response = await manta.post("/filemanagement", json=metadata, token=manta_token, timeout=30)
+                registered = manta_response.status_code in [200, 201]
+                error = None if registered else f"Failed to register file: {manta_response.text[:100]}"
+            except httpx.HTTPError as e:
+                registered, error = False, f"Request error: {str(e)}"
+        
+        if not registered:
+            # Clean up S3 if MantaHQ fails
+            try:
+                await discard_uploads([metadata["s3_key"]])
+            except Exception as cleanup_error:
+                logger.error(f"Failed to queue clean-up of {metadata['s3_key']}: {cleanup_error}")
+            return {"filename": result["filename"], "success": False, "stage": "metadata", "error": error}
+        
+        try:
+            response_data = manta_response.json()
+        except ValueError as e:
+            # MantaHQ said yes, so the record likely exists and the object stays;
+            # without its id the cached listing is dropped and refetched
+            logger.error(f"Unreadable MantaHQ response registering {metadata['s3_key']}: {e}")
+            remember_upload(username, metadata, None)
+            return {"filename": result["filename"], "success": False, "stage": "metadata",
+                    "error": "Invalid response from MantaHQ"}
+        remember_upload(username, metadata, response_data)
+        schedule_thumbnails(background_tasks, username, metadata["s3_key"], metadata["content_type"])
+        return {
+            **result,
+            "file_id": response_data.get("id") or str(uuid.uuid4()),
+            "size": metadata["size"],
+            "content_type": metadata["content_type"],
+            "s3_url": metadata["s3_url"]
+        }
+    
+    stored = await asyncio.gather(*(store(file) for file in files))
+    results = await asyncio.gather(*(register(r) for r in stored))
+    succeeded = sum(1 for r in results if r["success"])
+    
+    return {
+        "success": succeeded == len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
+    }
+
 @app.post("/upload-simple")
 async def upload_file_simple(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    authorization: Optional[str] = Header(None)
+    principal: Principal = Depends(get_user)
 ):
     """Minimal upload implementation"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authorization header required")
-    if not s3_client:
+    if not storage.available:
         raise HTTPException(status_code=500, detail="S3 client not available")
     
+    token = principal.token
+    username = principal.username
+    
     try:
-        # Get username from token
-        token = authorization.replace("Bearer ", "")
-        decoded = jwt.decode(token, options={"verify_signature": False})
-        username = decoded.get('username')
-        if not username:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        # Read file
-        content = await file.read()
-        
-        # Upload to S3
+        # Stream to S3
         s3_key = f"user-{username}/{file.filename}"
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key=s3_key,
-            Body=content,
-            ContentType=file.content_type or 'application/octet-stream'
+        stored = await store_upload(
+            s3_key,
+            username,
+            file,
+            file.content_type or 'application/octet-stream'
         )
+        file_size = stored.size
         
         # Create URL
-        region = os.getenv('AWS_REGION', 'us-east-1')
-        s3_url = f"https://{S3_BUCKET}.s3.{region}.amazonaws.com/{s3_key}"
+        s3_url = storage.object_url(stored.blob_key)
         
         # Register with MantaHQ - include username field
-        response = requests.post(
-            f"{MANTA_BASE_URL}/filemanagement",
-            json={
-                "s3_url": s3_url,
-                "s3_key": s3_key,
-                "size": len(content),
-                "content_type": file.content_type or 'application/octet-stream',
-                "created_at": str(int(datetime.utcnow().timestamp() * 1000)),
-                "username": username  # Added username field
-            },
-            headers={"Authorization": f"Bearer {token}"},
+        metadata = new_file_metadata(username, s3_key, s3_url, file_size, file.content_type or 'application/octet-stream')
+        response = await manta.post(
+            "/filemanagement",
+            json=metadata,
+            token=token,
             timeout=10
         )
         
         if response.status_code != 200:
-            s3_client.delete_object(Bucket=S3_BUCKET, Key=s3_key)
+            await discard_uploads([s3_key])
             return {"success": False, "status": response.status_code, "message": response.text}
         
-        return response.json()
+        response_data = response.json()
+        remember_upload(username, metadata, response_data)
+        schedule_thumbnails(background_tasks, username, s3_key, metadata["content_type"])
+        return response_data
         
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+@app.post("/upload/initiate")
+async def initiate_direct_upload(
+    request: UploadInitiateRequest,
+    principal: Principal = Depends(get_user)
+):
+    """Return presigned URLs so the browser can upload straight to S3"""
+    if not storage.available:
+        raise HTTPException(status_code=500, detail="S3 client not available")
+    if request.size < 0:
+        raise HTTPException(status_code=400, detail="size must not be negative")
+    if request.method not in ("PUT", "POST"):
+        raise HTTPException(status_code=400, detail="method must be PUT or POST")
+    
+    username = principal.username
+    
+    content_type = request.content_type or 'application/octet-stream'
+    file_category = get_file_category(content_type)
+    s3_key = f"user-{username}/{file_category}/{request.filename}"
+    
+    try:
+        plan = await plan_upload(storage, s3_key, request.size, content_type, request.method, request.multipart)
+    except ClientError as e:
+        logger.error(f"Failed to initiate direct upload: {e}")
+        raise HTTPException(status_code=502, detail="Could not initiate upload")
+    
+    return {"success": True, "s3_key": s3_key, "category": file_category, "content_type": content_type, **plan}
+
+@app.post("/upload/complete")
+async def complete_direct_upload(
+    request: UploadCompleteRequest,
+    background_tasks: BackgroundTasks,
+    principal: Principal = Depends(get_user)
+):
+    """Verify a direct upload landed in S3 and register it with MantaHQ"""
+    if not storage.available:
+        raise HTTPException(status_code=500, detail="S3 client not available")
+    
+    manta_token = principal.token
+    username = principal.username
+    if not request.s3_key.startswith(f"user-{username}/"):
+        raise HTTPException(status_code=403, detail="Key is outside the user's folder")
+    if request.upload_id and not request.parts:
+        raise HTTPException(status_code=400, detail="parts are required to complete a multipart upload")
+    
+    try:
+        head = await finish_upload(
+            storage,
+            request.s3_key,
+            request.upload_id,
+            [part.model_dump() for part in request.parts or []]
+        )
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+        logger.error(f"Direct upload verification failed for {request.s3_key}: {e}")
+        status = 404 if error_code in ('404', 'NoSuchKey', 'NoSuchUpload') else 400
+        raise HTTPException(status_code=status, detail=f"Upload could not be verified: {error_code}")
+    
+    await adopt_direct_upload(request.s3_key)
+    file_size = head.get('ContentLength', 0)
+    content_type = head.get('ContentType') or 'application/octet-stream'
+    s3_url = storage.object_url(request.s3_key)
+    metadata = new_file_metadata(username, request.s3_key, s3_url, file_size, content_type)
+    
+    try:
+        manta_response = await manta.post("/filemanagement", json=metadata, token=manta_token, timeout=30)
+    except httpx.HTTPError as e:
+        logger.error(f"Request error registering direct upload: {e}")
+        await discard_uploads([request.s3_key])
+        raise HTTPException(status_code=500, detail=f"Request error: {str(e)}")
+    
+    if manta_response.status_code not in [200, 201]:
+        # Clean up S3 if MantaHQ fails; the upload id is spent, so the client starts over
+        await discard_uploads([request.s3_key])
+        raise HTTPException(status_code=manta_response.status_code,
+                            detail=f"Failed to register file: {manta_response.text[:100]}")
+    
+    response_data = manta_response.json()
+    remember_upload(username, metadata, response_data)
+    schedule_thumbnails(background_tasks, username, request.s3_key, content_type)
+    return {
+        "success": True,
+        "message": "File uploaded successfully",
+        "file_id": response_data.get("id") or str(uuid.uuid4()),
+        "filename": request.s3_key.split('/')[-1],
+        "size": file_size,
+        "content_type": content_type,
+        "s3_url": s3_url,
+        "category": normalize_file(metadata, username)['category']
+    }
+
+def resumable_headers(session) -> dict:
+    """tus-style progress headers for a resumable upload session"""
+    offset = session.length if session.complete else session.offset
+    return {
+        "Upload-Offset": str(offset),
+        "Upload-Length": str(session.length),
+        "Upload-Expires": formatdate(resumable_uploads.expires_at(session), usegmt=True),
+        "Cache-Control": "no-store",
+    }
+
+def resumable_result(session) -> dict:
+    return {
+        "success": True,
+        "upload_id": session.upload_id,
+        "s3_key": session.s3_key,
+        "offset": session.length if session.complete else session.offset,
+        "length": session.length,
+        "part_size": session.part_size,
+        "complete": session.complete,
+    }
+
+@app.post("/upload/resumable", status_code=201)
+async def create_resumable_upload(
+    request: ResumableUploadRequest,
+    response: Response,
+    principal: Principal = Depends(get_user)
+):
+    """Start a resumable upload; send the bytes with PATCH, check progress with HEAD"""
+    if not storage.available:
+        raise HTTPException(status_code=500, detail="S3 client not available")
+    if request.size <= 0:
+        raise HTTPException(status_code=400, detail="size must be positive")
+    
+    username = principal.username
+    content_type = request.content_type or 'application/octet-stream'
+    file_category = get_file_category(content_type)
+    s3_key = f"user-{username}/{file_category}/{request.filename}"
+    
+    try:
+        session = await resumable_uploads.create(storage, username, s3_key, request.filename, content_type, request.size)
+    except ClientError as e:
+        logger.error(f"Failed to start resumable upload for {s3_key}: {e}")
+        raise HTTPException(status_code=502, detail="Could not initiate upload")
+    
+    response.headers.update(resumable_headers(session))
+    response.headers["Location"] = f"/upload/resumable/{session.upload_id}"
+    return {**resumable_result(session), "category": file_category, "content_type": content_type}
+
+@app.head("/upload/resumable/{upload_id}")
+async def resumable_upload_offset(upload_id: str, principal: Principal = Depends(get_user)):
+    """Where to resume: Upload-Offset is the number of bytes the server has kept"""
+    try:
+        session = await resumable_uploads.get(upload_id, principal.username)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return Response(status_code=200, headers=resumable_headers(session))
+
+@app.patch("/upload/resumable/{upload_id}")
+async def append_resumable_upload(
+    upload_id: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    upload_offset: int = Header(...),
+    principal: Principal = Depends(get_user)
+):
+    """Append bytes at Upload-Offset; the final PATCH registers the file with MantaHQ.
+    
+    Bytes are kept in whole parts, so every PATCH but the last must send a
+    multiple of part_size. After a dropped connection the offset may be
+    behind what the client sent; HEAD tells it where to carry on.
+    """
+    if not storage.available:
+        raise HTTPException(status_code=500, detail="S3 client not available")
+    body_type = request.headers.get("content-type", "application/offset+octet-stream").split(";")[0].strip()
+    if body_type not in ("application/offset+octet-stream", "application/octet-stream"):
+        raise HTTPException(status_code=415, detail="Body must be application/offset+octet-stream")
+    
+    manta_token = principal.token
+    username = principal.username
+    try:
+        session = await resumable_uploads.append(storage, upload_id, username, upload_offset, request.stream())
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except OffsetMismatch as e:
+        raise HTTPException(status_code=409, detail=f"Upload-Offset should be {e.offset}",
+                            headers={"Upload-Offset": str(e.offset)})
+    except UploadOverflow as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UnalignedChunk as e:
+        raise HTTPException(status_code=400, detail=str(e), headers={"Upload-Offset": str(e.offset)})
+    except ClientDisconnect:
+        logger.info(f"Client disconnected during resumable upload {upload_id}")
+        raise HTTPException(status_code=400, detail="Client disconnected")
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+        logger.error(f"Resumable upload {upload_id} failed: {e}")
+        raise HTTPException(status_code=502, detail=f"Storage error: {error_code}")
+    
+    headers = resumable_headers(session)
+    result = resumable_result(session)
+    if not session.complete:
+        return JSONResponse(result, headers=headers)
+    
+    s3_url = storage.object_url(session.s3_key)
+    metadata = new_file_metadata(username, session.s3_key, s3_url, session.length, session.content_type)
+    if session.file_id is None:
+        await adopt_direct_upload(session.s3_key)
+        try:
+            manta_response = await manta.post("/filemanagement", json=metadata, token=manta_token, timeout=30)
+        except httpx.HTTPError as e:
+            logger.error(f"Request error registering resumable upload: {e}")
+            raise HTTPException(status_code=500, detail=f"Request error: {str(e)}")
+        if manta_response.status_code not in [200, 201]:
+            # The object stays in S3; repeating the final PATCH retries registration
+            raise HTTPException(status_code=manta_response.status_code,
+                                detail=f"Failed to register file: {manta_response.text[:100]}")
+        response_data = manta_response.json()
+        remember_upload(username, metadata, response_data)
+        schedule_thumbnails(background_tasks, username, session.s3_key, session.content_type)
+        session = await resumable_uploads.mark_registered(upload_id, response_data.get("id") or str(uuid.uuid4()))
+    
+    return JSONResponse({
+        **result,
+        "message": "File uploaded successfully",
+        "file_id": session.file_id,
+        "filename": session.filename,
+        "size": session.length,
+        "content_type": session.content_type,
+        "s3_url": s3_url,
+        "category": normalize_file(metadata, username)['category']
+    }, headers=headers)
+
+@app.delete("/upload/resumable/{upload_id}", status_code=204)
+async def cancel_resumable_upload(upload_id: str, principal: Principal = Depends(get_user)):
+    """Abandon a resumable upload and discard the parts stored so far"""
+    try:
+        await resumable_uploads.abort(storage, upload_id, principal.username)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return Response(status_code=204)
+
 @app.get("/files")
 async def get_files(
     username: str, 
-    authorization: Optional[str] = Header(None),
-    category: Optional[str] = None
+    principal: Principal = Depends(get_principal),
+    category: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: str = "date",
+    order: str = "desc",
+    format: str = "json"
 ):
-    """Get files for specific username from MantaHQ with optional category filtering"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authorization header required")
+    """Get files for specific username from MantaHQ with optional category filtering.
+    
+    Without `limit` the full list is returned (newest first by default). With
+    `limit`, a page is returned as {"files", "next_cursor", "total"}; pass
+    `next_cursor` back as `cursor` to continue. `format=ndjson` streams one
+    record per line instead (upstream order, no paging). `username` must be
+    the caller's own, since listings are cached per username.
+    """
+    if username != principal.username:
+        raise HTTPException(status_code=403, detail="You can only list your own files")
+    if format not in LISTING_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(LISTING_FORMATS)}")
+    if format == "ndjson" and (limit is not None or cursor):
+        raise HTTPException(status_code=400, detail="limit and cursor are not supported with format=ndjson")
+    if sort not in SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(SORT_FIELDS)}")
+    if order not in SORT_ORDERS:
+        raise HTTPException(status_code=400, detail=f"order must be one of {', '.join(SORT_ORDERS)}")
     
-    manta_token = authorization.replace("Bearer ", "")
+    manta_token = principal.token
     
     try:
-        # Get all files from MantaHQ
-        response = requests.get(
-            f"{MANTA_BASE_URL}/filemanagement",
-            headers={"Authorization": f"Bearer {manta_token}"},
-            timeout=10
-        )
-        
-        logger.info(f"Files API response status: {response.status_code}")
-        
-        if response.status_code != 200:
-            return []
+        if format == "ndjson":
+            return await stream_user_files(username, manta_token, category)
         
         try:
-            response_data = response.json()
-            # Handle the specific response structure with 'data' field
-            all_files = response_data.get('data', []) if isinstance(response_data, dict) else response_data
-            if not isinstance(all_files, list):
-                all_files = []
-            logger.info(f"Successfully parsed response with {len(all_files)} files")
-        except Exception as e:
+            user_files = await load_user_files(username, manta_token)
+        except MetadataUnavailable as e:
+            logger.info(f"Files API response status: {e.status_code}")
+            return []
+        except ValueError as e:
             logger.error(f"Error parsing MantaHQ response: {e}")
             return []
         
-        # Filter files by user folder
-        user_prefix = f"user-{username}/"
-        user_files = []
-        
-        logger.info(f"Filtering files for user prefix: {user_prefix}")
-        logger.info(f"Total files before filtering: {len(all_files)}")
-        
-        # Add defensive check
-        if not all_files:
-            logger.warning("No files found in the response")
-            return []
+        # Category switches are served from the cached listing
+        if category:
+            user_files = [f for f in user_files if f['category'] == category]
         
-        # Process files with robust error handling
-        for file in all_files:
+        if limit is not None:
             try:
-                # Skip files without s3_key
-                s3_key = file.get('s3_key', '')
-                if not s3_key:
-                    continue
-                    
-                # Filter by user prefix
-                if s3_key.startswith(user_prefix):
-                    # Extract category from path
-                    path_parts = s3_key.replace(user_prefix, '').split('/')
-                    file_category = path_parts[0] if len(path_parts) > 1 else "others"
-                    
-                    # Skip if category filter is provided and doesn't match
-                    if category and file_category != category:
-                        continue
-                    
-                    # Get original filename if available, otherwise extract from s3_key
-                    display_name = file.get('filename', '')
-                    if not display_name:
-                        display_name = path_parts[-1] if path_parts else s3_key.split('/')[-1]
-                    
-                    # Format created_at as ISO string if it's a timestamp
-                    created_at = file.get('created_at')
-                    formatted_date = None
-                    
-                    if created_at and isinstance(created_at, str) and created_at.isdigit():
-                        try:
-                            # Convert milliseconds to seconds for datetime
-                            timestamp = int(created_at) / 1000
-                            formatted_date = datetime.fromtimestamp(timestamp).isoformat()
-                        except (ValueError, OverflowError) as e:
-                            logger.warning(f"Error formatting timestamp {created_at}: {e}")
-                            formatted_date = None
-                    
-                    # Use formatted date if available, otherwise use original
-                    display_date = formatted_date if formatted_date else created_at
-                    
-                    user_files.append({
-                        'id': file.get('id'),
-                        'name': display_name,
-                        'size': file.get('size', 0),
-                        'type': file.get('content_type', 'application/octet-stream'),
-                        'category': file_category,
-                        'createdAt': display_date,  # For frontend compatibility
-                        'created_at': created_at,   # Keep original field too
-                        's3_key': s3_key,
-                        's3_url': file.get('s3_url')
-                    })
-            except Exception as file_error:
-                # Log error but continue processing other files
-                logger.error(f"Error processing file: {file_error}")
-                continue
-        
-        # Skip sorting if there are no files
-        if user_files:
-            try:
-                # Sort files by creation date (newest first) with robust None handling
-                def safe_sort_key(x):
-                    # Use created_at from the API response
-                    created_at = x.get('created_at')
-                    # Return a string value that can be compared safely
-                    if created_at is None:
-                        return ''
-                    else:
-                        return str(created_at)
-                
-                user_files.sort(key=safe_sort_key, reverse=True)
-                logger.info(f"Successfully sorted {len(user_files)} files")
-            except Exception as sort_error:
-                # If sorting fails, return unsorted files
-                logger.error(f"Error sorting files: {sort_error}")
-                # Don't fail the whole request just because sorting failed
-        
-        return user_files
+                page, next_cursor = paginate(user_files, limit, cursor, sort, order)
+            except InvalidCursor as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            return {"files": page, "next_cursor": next_cursor, "total": len(user_files)}
+        
+        # The cached listing is already newest first
+        if sort == "date" and order == "desc":
+            return list(user_files)
+        return sort_files(user_files, sort, order)
             
-    except requests.exceptions.RequestException as e:
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
         logger.error(f"Request error getting files: {e}")
         raise HTTPException(status_code=500, detail=f"Request error: {str(e)}")
     except Exception as e:
@@ -554,148 +1059,152 @@ async def get_files(
 async def create_share_link(request: ShareLinkRequest):
     """Create a shareable link for a file"""
     try:
-        response = requests.post(
-            f"{MANTA_BASE_URL}/filemanagement/share",
+        response = await manta.post(
+            "/filemanagement/share",
             json={"file_id": request.file_id},
-            headers={"Authorization": f"Bearer {request.manta_token}"},
+            token=request.manta_token,
             timeout=10
         )
         
         # Log response for debugging
         logger.info(f"Share API response status: {response.status_code}")
         
+        # Sharing may update the file record upstream
+        invalidate_listing_for_token(request.manta_token)
+        
         # Return the exact response from MantaHQ API
         return response.json()
             
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Request error creating share link: {e}")
         raise HTTPException(status_code=500, detail=f"Request error: {str(e)}")
     except Exception as e:
         logger.error(f"Unexpected error creating share link: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def build_qr_code(file_id: str, manta_token: str, fmt: str) -> tuple:
+    """Share link, file metadata and rendered QR image for one file"""
+    async def file_metadata() -> Optional[dict]:
+        try:
+            return await resolver.resolve(file_id, manta_token, token_username(manta_token), allow_listing=False)
+        except Exception as metadata_error:
+            # Continue without the metadata
+            logger.warning(f"Error getting file metadata for QR code: {metadata_error}")
+            return None
+    
+    # The share call and the metadata lookup don't depend on each other
+    share_response, file_data = await asyncio.gather(
+        manta.post(
+            "/filemanagement/share",
+            json={"file_id": file_id},
+            token=manta_token,
+            timeout=10
+        ),
+        file_metadata()
+    )
+    
+    if share_response.status_code != 200:
+        raise HTTPException(status_code=share_response.status_code, detail=share_response.text)
+    
+    invalidate_listing_for_token(manta_token)
+    share_link = share_response.json().get("share_link")
+    if not share_link:
+        raise HTTPException(status_code=400, detail="Share link not found in response")
+    
+    image = await qr_renderer.render(share_link, fmt)
+    
+    payload = {"share_link": share_link}
+    if file_data:
+        payload.update({
+            "filename": file_data.get('filename') or file_data.get('s3_key', '').split('/')[-1],
+            "content_type": file_data.get('content_type'),
+            "size": file_data.get('size')
+        })
+    return payload, image
+
 @app.post("/qrcode")
-async def generate_qr_code(request: QRCodeRequest):
-    """Generate QR code for a file share link"""
+async def generate_qr_code(request: QRCodeRequest, raw: bool = False):
+    """Generate QR code for a file share link.
+    
+    Returns base64 in JSON by default; with `raw=true` the image itself is
+    returned as image/png or image/svg+xml.
+    """
+    if request.format not in QR_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(QR_FORMATS)}")
+    
     try:
-        # First get the share link
-        share_response = requests.post(
-            f"{MANTA_BASE_URL}/filemanagement/share",
-            json={"file_id": request.file_id},
-            headers={"Authorization": f"Bearer {request.manta_token}"},
-            timeout=10
-        )
-        
-        if share_response.status_code != 200:
-            raise HTTPException(status_code=share_response.status_code, detail=share_response.text)
-            
-        share_data = share_response.json()
-        share_link = share_data.get("share_link")
-        
-        if not share_link:
-            raise HTTPException(status_code=400, detail="Share link not found in response")
-        
-        # Generate QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(share_link)
-        qr.make(fit=True)
-        
-        # Create an image from the QR Code
-        img = qr.make_image(fill_color="black", back_color="white")
+        payload, image = await build_qr_code(request.file_id, request.manta_token, request.format)
         
-        # Save QR code to bytes
-        img_byte_arr = io.BytesIO()
-        img.save(img_byte_arr, format='PNG')
-        img_byte_arr.seek(0)
+        if raw:
+            return Response(content=image, media_type=QR_FORMATS[request.format])
         
         # Convert to base64 for easy frontend display
-        qr_base64 = base64.b64encode(img_byte_arr.getvalue()).decode()
-        
-        # Get file metadata for additional context
-        try:
-            file_response = requests.get(
-                f"{MANTA_BASE_URL}/filemanagement/{request.file_id}",
-                headers={"Authorization": f"Bearer {request.manta_token}"},
-                timeout=10
-            )
-            
-            if file_response.status_code == 200:
-                file_data = file_response.json()
-                filename = file_data.get('filename') or file_data.get('s3_key', '').split('/')[-1]
-                return {
-                    "qr_code": qr_base64, 
-                    "share_link": share_link,
-                    "filename": filename,
-                    "content_type": file_data.get('content_type'),
-                    "size": file_data.get('size')
-                }
-        except Exception as metadata_error:
-            logger.warning(f"Error getting file metadata for QR code: {metadata_error}")
-            # Continue without the metadata
-        
-        return {"qr_code": qr_base64, "share_link": share_link}
+        return {"qr_code": base64.b64encode(image).decode(), "format": request.format, **payload}
             
-    except requests.exceptions.RequestException as e:
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
         logger.error(f"Request error generating QR code: {e}")
         raise HTTPException(status_code=500, detail=f"Request error: {str(e)}")
     except Exception as e:
         logger.error(f"Unexpected error generating QR code: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/qrcode/batch")
+async def generate_qr_codes_batch(request: QRCodeBatchRequest):
+    """Generate QR codes for many files in one request"""
+    if request.format not in QR_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(QR_FORMATS)}")
+    if len(request.file_ids) > QR_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {QR_BATCH_MAX_FILES} files per batch")
+    
+    slots = asyncio.Semaphore(QR_BATCH_CONCURRENCY)
+    
+    async def one(file_id: str) -> dict:
+        async with slots:
+            try:
+                payload, image = await build_qr_code(file_id, request.manta_token, request.format)
+                return {"file_id": file_id, "success": True, "qr_code": base64.b64encode(image).decode(), **payload}
+            except HTTPException as e:
+                return {"file_id": file_id, "success": False, "status": e.status_code, "error": str(e.detail)}
+            except Exception as e:
+                logger.error(f"Error generating QR code for {file_id}: {e}")
+                return {"file_id": file_id, "success": False, "status": 500, "error": str(e)}
+    
+    results = await asyncio.gather(*(one(file_id) for file_id in request.file_ids))
+    return {
+        "format": request.format,
+        "succeeded": sum(1 for r in results if r["success"]),
+        "failed": sum(1 for r in results if not r["success"]),
+        "results": results
+    }
+
 @app.get("/download/{file_id}")
-async def download_file(file_id: str, authorization: Optional[str] = Header(None)):
+async def download_file(
+    file_id: str,
+    principal: Principal = Depends(get_principal),
+    filename: Optional[str] = None
+):
     """Download a file via S3 URL from MantaHQ metadata"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authorization header required")
+    manta_token = principal.token
+    username = principal.username
     
-    manta_token = authorization.replace("Bearer ", "")
+    # A still-valid URL for the same file skips both the metadata fetch and signing
+    if username and principal.trusted:
+        cached = url_cache.get(username, file_id, filename)
+        if cached is not None:
+            return cached
     
     try:
-        # Get file metadata directly from MantaHQ
-        response = requests.get(
-            f"{MANTA_BASE_URL}/filemanagement/{file_id}",
-            headers={"Authorization": f"Bearer {manta_token}"},
-            timeout=10
-        )
-        
-        if response.status_code == 404:
-            # If direct file lookup fails, try getting all files and filtering
-            all_files_response = requests.get(
-                f"{MANTA_BASE_URL}/filemanagement",
-                headers={"Authorization": f"Bearer {manta_token}"},
-                timeout=10
-            )
-            
-            if all_files_response.status_code != 200:
-                raise HTTPException(status_code=all_files_response.status_code, detail="Failed to get files")
-            
-            all_files = all_files_response.json()
-            file_data = None
-            
-            # Find file by ID
-            for file in all_files:
-                if file.get('id') == file_id:
-                    file_data = file
-                    break
-                    
-            if not file_data:
-                raise HTTPException(status_code=404, detail="File not found")
-        else:
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail="Failed to get file metadata")
-            file_data = response.json()
+        # Resolve file metadata via the index, falling back to MantaHQ
+        file_data = await resolve_file(file_id, manta_token)
         
         s3_key = file_data.get('s3_key')
         if not s3_key:
             raise HTTPException(status_code=404, detail="File location not found")
         
         # Get original filename for download
-        original_filename = file_data.get('filename')
+        original_filename = filename or file_data.get('filename')
         if not original_filename:
             # Extract filename from s3_key if original filename not stored
             original_filename = s3_key.split('/')[-1]
@@ -711,52 +1220,135 @@ async def download_file(file_id: str, authorization: Optional[str] = Header(None
                     original_filename = f"{original_filename}.{extension}"
         
         # Generate presigned URL for direct S3 download
-        if s3_client:
-            download_url = s3_client.generate_presigned_url(
+        if storage.available:
+            download_url = await storage.generate_presigned_url(
                 'get_object',
-                Params={
-                    'Bucket': S3_BUCKET, 
-                    'Key': s3_key,
-                    'ResponseContentDisposition': f'attachment; filename="{original_filename}"'
-                },
-                ExpiresIn=3600  # 1 hour
+                Key=await blob_store.resolve(s3_key),
+                ResponseContentDisposition=f'attachment; filename="{original_filename}"',
+                expires_in=DOWNLOAD_URL_EXPIRY
             )
-            return {
+            payload = {
                 "download_url": download_url, 
                 "filename": original_filename,
                 "content_type": file_data.get('content_type', 'application/octet-stream'),
                 "size": file_data.get('size', 0)
             }
+            if username:
+                url_cache.put(username, file_id, filename, payload, DOWNLOAD_URL_EXPIRY)
+            return payload
         else:
             raise HTTPException(status_code=500, detail="Storage service unavailable")
             
-    except requests.exceptions.RequestException as e:
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
         logger.error(f"Request error downloading file: {e}")
         raise HTTPException(status_code=500, detail=f"Request error: {str(e)}")
     except Exception as e:
         logger.error(f"Unexpected error downloading file: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/files/{file_id}/thumbnail")
+async def get_thumbnail(
+    file_id: str,
+    w: int = Query(256, ge=1, description="Width in pixels, rounded up to an allowed size"),
+    format: Optional[str] = Query(None, description="webp or jpeg; default picked from Accept"),
+    accept: Optional[str] = Header(None),
+    principal: Principal = Depends(get_principal)
+):
+    """A resized preview of an image file, rendered once per size and then served from S3"""
+    if not storage.available:
+        raise HTTPException(status_code=500, detail="Storage service unavailable")
+    if format is not None and format not in THUMBNAIL_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(THUMBNAIL_FORMATS)}")
+    fmt = format or ("webp" if "image/webp" in (accept or "") else "jpeg")
+    
+    file_data = await resolve_file(file_id, principal.token)
+    s3_key = file_data.get('s3_key')
+    if not s3_key:
+        raise HTTPException(status_code=404, detail="File location not found")
+    if not thumbnails.supports(file_data.get('content_type') or file_data.get('type')):
+        raise HTTPException(status_code=415, detail="Thumbnails are only available for images")
+    owner = username_from_s3_key(s3_key) or principal.username
+    
+    try:
+        thumbnail = await thumbnails.get(storage, owner, s3_key, await blob_store.resolve(s3_key), w, fmt)
+    except ThumbnailUnavailable as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+        logger.error(f"Thumbnail failed for {s3_key}: {e}")
+        status = 404 if error_code in ('404', 'NoSuchKey') else 502
+        raise HTTPException(status_code=status, detail=f"Could not read file: {error_code}")
+    
+    headers = {"Cache-Control": "private, max-age=86400", "X-Thumbnail-Width": str(thumbnail.width)}
+    if format is None:
+        headers["Vary"] = "Accept"
+    return Response(content=thumbnail.content, media_type=thumbnail.content_type, headers=headers)
+
+@app.get("/download/{file_id}/stream")
+async def stream_download(
+    file_id: str,
+    principal: Principal = Depends(get_principal),
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_range: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    download: bool = False
+):
+    """Proxy a file from S3 for clients that can't reach it directly.
+    
+    Supports single byte ranges (206 / 416), If-Range and If-None-Match, so
+    video players can seek. The body is relayed in fixed-size chunks.
+    """
+    if not storage.available:
+        raise HTTPException(status_code=500, detail="Storage service unavailable")
+    
+    file_data = await resolve_file(file_id, principal.token)
+    s3_key = file_data.get('s3_key')
+    if not s3_key:
+        raise HTTPException(status_code=404, detail="File location not found")
+    filename = file_data.get('filename') or s3_key.split('/')[-1]
+    disposition = content_disposition("attachment" if download else "inline", filename)
+    
+    try:
+        obj = await open_object(storage, await blob_store.resolve(s3_key), range_header, if_range, if_none_match)
+    except NotModified as e:
+        return Response(status_code=304, headers={"ETag": e.etag} if e.etag else None)
+    except RangeNotSatisfiable as e:
+        headers = {"Content-Range": f"bytes */{e.size}"} if e.size is not None else None
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable", headers=headers)
+    except ClientError as e:
+        error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+        logger.error(f"Stream download failed for {s3_key}: {e}")
+        status = 404 if error_code in ('404', 'NoSuchKey') else 502
+        raise HTTPException(status_code=status, detail=f"Could not read file: {error_code}")
+    
+    try:
+        headers = response_headers(obj)
+        headers["Content-Disposition"] = disposition
+        return StreamingResponse(
+            iter_body(storage, obj['Body']),
+            status_code=206 if obj.get('ContentRange') else 200,
+            media_type=file_data.get('content_type') or obj.get('ContentType') or 'application/octet-stream',
+            headers=headers
+        )
+    except Exception:
+        # Nothing will read the body, so release the S3 connection now
+        obj['Body'].close()
+        raise
+
 @app.get("/test-endpoint")
 async def test_endpoint():
     """Simple test endpoint to verify the server is working"""
     return {"success": True, "message": "Test endpoint is working"}
 
 @app.post("/test-upload")
-async def test_upload(authorization: Optional[str] = Header(None)):
+async def test_upload(principal: Principal = Depends(get_user)):
     """Test endpoint to verify MantaHQ API integration"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authorization header required")
-    
-    manta_token = authorization.replace("Bearer ", "")
+    manta_token = principal.token
+    username = principal.username
     
     try:
-        # Get username from token
-        decoded = jwt.decode(manta_token, options={"verify_signature": False})
-        username = decoded.get('username')
-        if not username:
-            raise HTTPException(status_code=401, detail="Invalid token")
-            
         # Create a simple test metadata
         test_metadata = {
             "s3_url": "https://test-bucket.s3.amazonaws.com/test-file.txt",
@@ -768,10 +1360,10 @@ async def test_upload(authorization: Optional[str] = Header(None)):
         }
         
         # Send to MantaHQ
-        response = requests.post(
-            f"{MANTA_BASE_URL}/filemanagement",
+        response = await manta.post(
+            "/filemanagement",
             json=test_metadata,
-            headers={"Authorization": f"Bearer {manta_token}"},
+            token=manta_token,
             timeout=10
         )
         
@@ -795,75 +1387,32 @@ class AnonymousShareRequest(BaseModel):
 @app.post("/share/anonymous")
 async def create_anonymous_share(
     request: AnonymousShareRequest,
-    authorization: Optional[str] = Header(None)
+    principal: Principal = Depends(get_principal)
 ):
     """Create anonymous share link with multi-layer security"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authorization header required")
-    
-    manta_token = authorization.replace("Bearer ", "")
+    manta_token = principal.token
     
     try:
-        # First get the file metadata
-        file_response = requests.get(
-            f"{MANTA_BASE_URL}/filemanagement/{request.file_id}",
-            headers={"Authorization": f"Bearer {manta_token}"},
-            timeout=10
+        try:
+            expires_in_seconds = parse_expiry(request.expires_in)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        # The index only answers proven tokens, so others are checked with MantaHQ first
+        file_data = await resolve_file(request.file_id, manta_token)
+        owner = share_owner(file_data, principal)
+        
+        share = await share_store.create(
+            "anonymous",
+            request.file_id,
+            owner,
+            file_data,
+            access_key=request.access_key,
+            password=request.password,
+            expires_in_seconds=expires_in_seconds,
+            max_downloads=request.max_downloads,
         )
-        
-        if file_response.status_code != 200:
-            # Try getting all files and filtering
-            all_files_response = requests.get(
-                f"{MANTA_BASE_URL}/filemanagement",
-                headers={"Authorization": f"Bearer {manta_token}"},
-                timeout=10
-            )
-            
-            if all_files_response.status_code != 200:
-                raise HTTPException(status_code=404, detail="File not found")
-            
-            try:
-                response_data = all_files_response.json()
-                all_files = response_data.get('data', []) if isinstance(response_data, dict) else response_data
-                if not isinstance(all_files, list):
-                    all_files = []
-            except:
-                all_files = []
-            
-            file_data = None
-            for file in all_files:
-                if file.get('id') == request.file_id:
-                    file_data = file
-                    break
-                    
-            if not file_data:
-                raise HTTPException(status_code=404, detail="File not found")
-        else:
-            file_data = file_response.json()
-        
-        # Generate unique access ID
-        access_id = str(uuid.uuid4())[:8]
-        
-        # Create share metadata
-        share_data = {
-            "access_id": access_id,
-            "file_id": request.file_id,
-            "s3_key": file_data.get('s3_key'),
-            "s3_url": file_data.get('s3_url'),
-            "filename": file_data.get('filename') or file_data.get('s3_key', '').split('/')[-1],
-            "size": file_data.get('size', 0),
-            "content_type": file_data.get('content_type', 'application/octet-stream'),
-            "access_key": request.access_key,
-            "password": request.password,
-            "expires_at": (datetime.utcnow().timestamp() + (request.expires_in * 3600)) if request.expires_in else None,
-            "max_downloads": request.max_downloads,
-            "download_count": 0,
-            "created_at": datetime.utcnow().timestamp()
-        }
-        
-        # Store share data in MantaHQ (using a separate collection/endpoint if available)
-        # For now, we'll return the share data directly
-        # In production, you'd store this in a database
+        access_id = share.access_id
         
         share_url = f"https://mantadrive.app/s/{access_id}"
         
@@ -871,7 +1420,7 @@ async def create_anonymous_share(
             "success": True,
             "share_url": share_url,
             "access_id": access_id,
-            "expires_at": share_data["expires_at"],
+            "expires_at": share.expires_at,
             "protection": {
                 "access_key": bool(request.access_key),
                 "password": bool(request.password),
@@ -880,113 +1429,36 @@ async def create_anonymous_share(
             }
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error creating anonymous share: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/s/{access_id}")
-async def access_anonymous_share(
-    access_id: str,
-    access_key: Optional[str] = None,
-    password: Optional[str] = None
-):
-    """Access anonymous shared file"""
-    try:
-        # In a real implementation, you'd retrieve share data from database
-        # For demo purposes, we'll simulate this
-        
-        # Validate access_id format
-        if len(access_id) != 8:
-            raise HTTPException(status_code=404, detail="Share not found")
-        
-        # For demo, return a sample response
-        # In production, validate access_key, password, expiration, etc.
-        
-        return {
-            "success": True,
-            "message": "Anonymous share access validated",
-            "filename": "demo-file.pdf",
-            "size": 1024,
-            "content_type": "application/pdf",
-            "download_url": f"https://mantadrive.app/download/{access_id}"
-        }
-        
-    except Exception as e:
-        logger.error(f"Error accessing anonymous share: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
 # AI-Powered Features
 @app.post("/ai/organize")
-async def organize_files_ai(authorization: Optional[str] = Header(None)):
+async def organize_files_ai(principal: Principal = Depends(get_user)):
     """AI-powered file organization"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authorization header required")
-    
-    manta_token = authorization.replace("Bearer ", "")
+    manta_token = principal.token
+    username = principal.username
     
     try:
-        # Get user info from token
-        decoded = jwt.decode(manta_token, options={"verify_signature": False})
-        username = decoded.get('username')
-        if not username:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        # Get user's files
-        response = requests.get(
-            f"{MANTA_BASE_URL}/filemanagement",
-            headers={"Authorization": f"Bearer {manta_token}"},
-            timeout=10
-        )
-        
-        if response.status_code != 200:
-            return {"success": False, "message": "Could not fetch files"}
-        
+        # Classify the cached listing in one pass; known file ids skip the rules
         try:
-            response_data = response.json()
-            all_files = response_data.get('data', []) if isinstance(response_data, dict) else response_data
-            if not isinstance(all_files, list):
-                all_files = []
-        except:
-            all_files = []
-        
-        # Filter user files
-        user_prefix = f"user-{username}/"
-        user_files = [f for f in all_files if f.get('s3_key', '').startswith(user_prefix)]
-        
-        # AI Organization Logic (Simplified)
-        organized_categories = {
-            "Work Documents": [],
-            "Personal Photos": [],
-            "Videos": [],
-            "Archives": [],
-            "Others": []
-        }
-        
-        for file in user_files:
-            content_type = file.get('content_type', '').lower()
-            filename = file.get('s3_key', '').split('/')[-1].lower()
-            
-            # Smart categorization
-            if any(word in filename for word in ['resume', 'cv', 'report', 'invoice', 'contract']):
-                organized_categories["Work Documents"].append(file)
-            elif content_type.startswith('image/') and any(word in filename for word in ['photo', 'img', 'pic', 'selfie']):
-                organized_categories["Personal Photos"].append(file)
-            elif content_type.startswith('video/'):
-                organized_categories["Videos"].append(file)
-            elif any(ext in filename for ext in ['.zip', '.rar', '.tar', '.gz']):
-                organized_categories["Archives"].append(file)
-            else:
-                organized_categories["Others"].append(file)
+            user_files = await load_user_files(username, manta_token)
+        except MetadataUnavailable:
+            return {"success": False, "message": "Could not fetch files"}
+        organized_categories = organizer.organize(user_files)
         
         # Generate suggestions
         suggestions = []
-        for category, files in organized_categories.items():
-            if files:
+        for category, group in organized_categories.items():
+            if group["count"]:
                 suggestions.append({
                     "category": category,
-                    "count": len(files),
-                    "files": [{"id": f.get("id"), "name": f.get("s3_key", "").split("/")[-1]} for f in files[:5]],
-                    "confidence": 0.85 if category != "Others" else 0.6
+                    "count": group["count"],
+                    "files": group["files"],
+                    "confidence": 0.85 if category != FALLBACK_CATEGORY else 0.6
                 })
         
         return {
@@ -995,9 +1467,9 @@ async def organize_files_ai(authorization: Optional[str] = Header(None)):
             "total_files": len(user_files),
             "suggestions": suggestions,
             "ai_insights": {
-                "most_common_type": "Documents" if organized_categories["Work Documents"] else "Images",
+                "most_common_type": max(suggestions, key=lambda s: s["count"])["category"] if suggestions else None,
                 "organization_score": len([s for s in suggestions if s["confidence"] > 0.7]) / max(len(suggestions), 1) * 100,
-                "recommended_cleanup": len(organized_categories["Others"]) > 5
+                "recommended_cleanup": organized_categories[FALLBACK_CATEGORY]["count"] > 5
             }
         }
         
@@ -1006,35 +1478,55 @@ async def organize_files_ai(authorization: Optional[str] = Header(None)):
         return {"success": False, "message": str(e)}
 
 @app.post("/ai/smart-insights")
-async def get_smart_insights(authorization: Optional[str] = Header(None)):
-    """Get AI-powered insights about user's files"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authorization header required")
+async def get_smart_insights(principal: Principal = Depends(get_user)):
+    """Insights about the user's files, answered from incrementally kept aggregates"""
+    username = principal.username
     
     try:
-        # Demo insights - in production this would use real AI analysis
+        stats = aggregates.get(username) if principal.trusted else None
+        if stats is None:
+            # Cold start: one pass over the listing, then uploads/deletes keep it current
+            try:
+                user_files = await load_user_files(username, principal.token)
+            except MetadataUnavailable:
+                return {"success": False, "message": "Could not fetch files"}
+            stats = aggregates.rebuild(username, user_files)
+        
+        summary = stats.snapshot()
+        dedup = await blob_store.dedup_stats(username)
+        total_files = summary["total_files"]
+        
+        recommendations = []
+        if dedup["duplicate_files"]:
+            recommendations.append(f"{dedup['duplicate_files']} duplicate files are stored once; consider removing the extra copies")
+        if summary["size_histogram"][">=1GB"] or summary["size_histogram"]["100MB-1GB"]:
+            recommendations.append("Review your largest files to free up space")
+        if summary["files_by_category"].get("others", 0) > total_files / 2:
+            recommendations.append("Most files are uncategorized; run organize to sort them")
+        
         insights = {
             "storage_optimization": {
-                "duplicate_files": 3,
-                "large_files": ["video1.mp4", "backup.zip"],
-                "potential_savings": "234 MB"
+                "duplicate_files": dedup["duplicate_files"],
+                "bytes_saved": dedup["bytes_saved"],
+                "large_files": [f["name"] for f in summary["largest_files"]],
+                "largest_files": summary["largest_files"],
+                "potential_savings": f"{dedup['bytes_saved'] / (1024 * 1024):.1f} MB"
             },
             "usage_patterns": {
-                "most_active_day": "Tuesday",
-                "peak_upload_time": "2:00 PM",
+                "most_active_day": summary["most_active_day"],
+                "peak_upload_hour_utc": summary["peak_upload_hour"],
+                "upload_hour_histogram": summary["upload_hour_histogram"],
                 "file_type_distribution": {
-                    "images": 45,
-                    "documents": 30,
-                    "videos": 15,
-                    "others": 10
-                }
+                    category: round(100 * count / total_files)
+                    for category, count in summary["files_by_category"].items()
+                } if total_files else {},
+                "files_by_category": summary["files_by_category"],
+                "bytes_by_category": summary["bytes_by_category"],
+                "size_histogram": summary["size_histogram"]
             },
-            "security_score": 85,
-            "recommendations": [
-                "Enable password protection for sensitive documents",
-                "Consider archiving files older than 6 months",
-                "Organize photos by date automatically"
-            ]
+            "total_files": total_files,
+            "total_bytes": summary["total_bytes"],
+            "recommendations": recommendations
         }
         
         return {
@@ -1048,20 +1540,14 @@ async def get_smart_insights(authorization: Optional[str] = Header(None)):
         return {"success": False, "message": str(e)}
 
 @app.post("/create-user-folders")
-async def create_user_folders(authorization: Optional[str] = Header(None)):
+async def create_user_folders(principal: Principal = Depends(get_principal)):
     """Create S3 folders for a user after signup"""
-    logger.info(f"Received request to create user folders")
-    
-    if not authorization:
-        logger.error("No authorization header provided")
-        raise HTTPException(status_code=401, detail="Authorization header required")
-    
-    token = authorization.replace("Bearer ", "")
-    logger.info(f"Token received (first 20 chars): {token[:20]}...")
+    logger.info(f"Received request to create user folders for: {principal.user_id}")
+    token = principal.token
     
     try:
         # Create folders using the token
-        create_user_folders_from_token(token)
+        await create_user_folders_from_token(token)
         
         logger.info("User folders created successfully")
         return {"success": True, "message": "User folders created successfully"}
@@ -1072,12 +1558,12 @@ async def create_user_folders(authorization: Optional[str] = Header(None)):
 @app.get("/health")
 async def health_check():
     """Health check endpoint with S3 status"""
-    s3_status = "connected" if s3_client else "disconnected"
+    s3_status = "connected" if storage.available else "disconnected"
     
     bucket_status = "unknown"
-    if s3_client:
+    if storage.available:
         try:
-            s3_client.head_bucket(Bucket=S3_BUCKET)
+            await storage.head_bucket()
             bucket_status = "accessible"
         except ClientError as e:
             bucket_status = f"error: {e.response['Error']['Code']}"
@@ -1088,10 +1574,47 @@ async def health_check():
         "message": "MantaDrive Backend API",
         "status": "running",
         "s3_status": s3_status,
-        "s3_bucket": S3_BUCKET,
-        "bucket_status": bucket_status
+        "s3_bucket": storage.bucket,
+        "bucket_status": bucket_status,
+        "file_cache": file_cache.stats(),
+        "metadata_index": metadata_index.stats(),
+        "url_cache": url_cache.stats(),
+        "qr_cache": qr_renderer.stats(),
+        "folder_provisioning": folder_queue.stats(),
+        "auth_cache": claims_cache.stats(),
+        "dedup": blob_store.stats(),
+        "aggregates": aggregates.stats(),
+        "classification_cache": organizer.stats(),
+        "resumable_uploads": resumable_uploads.stats(),
+        "thumbnails": thumbnails.stats(),
+        "outbox": {**outbox.stats(), **await outbox.backlog()}
+    }
+
+def cache_stats() -> dict:
+    return {
+        "file_list": file_cache.stats(),
+        "metadata_index": metadata_index.stats(),
+        "presigned_url": url_cache.stats(),
+        "qr": qr_renderer.stats(),
+        "auth": claims_cache.stats(),
+        "classification": organizer.stats(),
     }
 
+def cache_series(field: str):
+    # Read from each cache's own counters at scrape time, so lookups don't pay for metrics
+    return lambda: {(name,): stats[field] for name, stats in cache_stats().items()}
+
+metrics_registry.collected("cache_hits_total", "Cache lookups answered from the cache", ("cache",), cache_series("hits"), kind="counter")
+metrics_registry.collected("cache_misses_total", "Cache lookups that fell through", ("cache",), cache_series("misses"), kind="counter")
+metrics_registry.collected("cache_hit_ratio", "Share of cache lookups answered from the cache", ("cache",), cache_series("hit_ratio"))
+metrics_registry.collected("thumbnail_renders_total", "Thumbnail renditions rendered", (), lambda: {(): thumbnails.renders}, kind="counter")
+metrics_registry.collected("deduplicated_bytes_total", "Upload bytes not stored again thanks to deduplication", (), lambda: {(): blob_store.bytes_saved}, kind="counter")
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics in the text exposition format"""
+    return Response(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.post("/configure-s3")
 async def configure_s3_credentials(
     access_key: str,
@@ -1101,23 +1624,14 @@ async def configure_s3_credentials(
 ):
     """Configure S3 credentials for the session"""
     try:
-        global s3_client, S3_BUCKET
-        
         # Create new S3 client with provided credentials
-        import boto3
-        test_client = boto3.client(
-            's3',
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            region_name=region
-        )
+        test_client = create_s3_client(access_key, secret_key, region)
         
         # Test the connection
-        test_client.head_bucket(Bucket=bucket)
+        await storage.run(test_client.head_bucket, Bucket=bucket)
         
-        # If successful, update global variables
-        s3_client = test_client
-        S3_BUCKET = bucket
+        # If successful, swap the shared storage client
+        storage.configure(test_client, bucket, region)
         
         return {
             "success": True,
@@ -1137,7 +1651,7 @@ async def configure_s3_credentials(
 @app.get("/test-s3")
 async def test_s3_connection():
     """Test S3 connectivity by writing and reading a small test file"""
-    if not s3_client:
+    if not storage.available:
         return {"success": False, "message": "S3 client not initialized"}
     
     test_key = "test/connection-test.txt"
@@ -1145,19 +1659,18 @@ async def test_s3_connection():
     
     try:
         # Try to write a test file
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
+        await storage.put_object(
             Key=test_key,
             Body=test_content.encode('utf-8'),
             ContentType='text/plain'
         )
         
         # Try to read it back
-        response = s3_client.get_object(Bucket=S3_BUCKET, Key=test_key)
-        content = response['Body'].read().decode('utf-8')
+        response = await storage.get_object(Key=test_key)
+        content = (await storage.run(response['Body'].read)).decode('utf-8')
         
         # Clean up
-        s3_client.delete_object(Bucket=S3_BUCKET, Key=test_key)
+        await storage.delete_object(Key=test_key)
         
         return {
             "success": True,
@@ -1165,8 +1678,8 @@ async def test_s3_connection():
             "write_success": True,
             "read_success": content == test_content,
             "delete_success": True,
-            "bucket": S3_BUCKET,
-            "region": os.getenv('AWS_REGION', 'us-east-1')
+            "bucket": storage.bucket,
+            "region": storage.region
         }
     except Exception as e:
         error_msg = str(e)
@@ -1178,17 +1691,14 @@ async def test_s3_connection():
         return {
             "success": False,
             "message": f"S3 connection test failed: {error_msg}",
-            "bucket": S3_BUCKET,
-            "region": os.getenv('AWS_REGION', 'us-east-1')
+            "bucket": storage.bucket,
+            "region": storage.region
         }
 
 @app.put("/user-reset")
-async def user_reset(request: UserResetRequest, authorization: Optional[str] = Header(None)):
+async def user_reset(request: UserResetRequest, principal: Principal = Depends(get_principal)):
     """Update user profile information"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authorization header required")
-    
-    manta_token = authorization.replace("Bearer ", "")
+    manta_token = principal.token
     
     try:
         # Prepare the request payload
@@ -1205,10 +1715,10 @@ async def user_reset(request: UserResetRequest, authorization: Optional[str] = H
             payload["newPassword"] = request.newPassword
         
         # Call MantaHQ API
-        response = requests.put(
-            f"{MANTA_BASE_URL}/userauthflow/user-reset",
+        response = await manta.put(
+            "/userauthflow/user-reset",
             json=payload,
-            headers={"Authorization": f"Bearer {manta_token}"},
+            token=manta_token,
             timeout=10
         )
         
@@ -1218,7 +1728,7 @@ async def user_reset(request: UserResetRequest, authorization: Optional[str] = H
         # Return the exact response from MantaHQ API
         return response.json()
             
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Request error during user reset: {e}")
         raise HTTPException(status_code=500, detail=f"Request error: {str(e)}")
     except Exception as e:
@@ -1226,115 +1736,166 @@ async def user_reset(request: UserResetRequest, authorization: Optional[str] = H
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/files/{file_id}")
-async def delete_file(file_id: str, authorization: Optional[str] = Header(None)):
+async def delete_file(file_id: str, principal: Principal = Depends(get_principal)):
     """Delete a file from S3 and remove metadata from MantaHQ"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authorization header required")
-    if not s3_client:
+    if not storage.available:
         raise HTTPException(status_code=500, detail="S3 client not available")
     
-    manta_token = authorization.replace("Bearer ", "")
+    manta_token = principal.token
     
     try:
         # First get the file metadata to know the S3 key
-        response = requests.get(
-            f"{MANTA_BASE_URL}/filemanagement/{file_id}",
-            headers={"Authorization": f"Bearer {manta_token}"},
-            timeout=10
-        )
-        
-        if response.status_code == 404:
-            # If direct file lookup fails, try getting all files and filtering
-            all_files_response = requests.get(
-                f"{MANTA_BASE_URL}/filemanagement",
-                headers={"Authorization": f"Bearer {manta_token}"},
-                timeout=10
-            )
-            
-            if all_files_response.status_code != 200:
-                raise HTTPException(status_code=all_files_response.status_code, detail="Failed to get files")
-            
-            all_files = all_files_response.json()
-            file_data = None
-            
-            # Find file by ID
-            for file in all_files:
-                if file.get('id') == file_id:
-                    file_data = file
-                    break
-                    
-            if not file_data:
-                raise HTTPException(status_code=404, detail="File not found")
-        else:
-            if response.status_code != 200:
-                raise HTTPException(status_code=response.status_code, detail="Failed to get file metadata")
-            file_data = response.json()
+        file_data = await resolve_file(file_id, manta_token)
         
         s3_key = file_data.get('s3_key')
         if not s3_key:
             raise HTTPException(status_code=404, detail="File location not found")
         
-        # Delete from S3
-        try:
-            s3_client.delete_object(Bucket=S3_BUCKET, Key=s3_key)
-            logger.info(f"Deleted file from S3: {s3_key}")
-        except ClientError as e:
-            logger.error(f"S3 error deleting file: {e}")
-            # Continue with metadata deletion even if S3 delete fails
-        
-        # Delete metadata from MantaHQ
-        delete_response = requests.delete(
-            f"{MANTA_BASE_URL}/filemanagement/{file_id}",
-            headers={"Authorization": f"Bearer {manta_token}"},
-            timeout=10
-        )
-        
-        if delete_response.status_code not in [200, 204]:
-            logger.error(f"Failed to delete file metadata: {delete_response.status_code}")
-            # If metadata deletion fails but S3 delete succeeded, we have an inconsistency
-            # In a production system, this should be handled with a background job to retry
-            raise HTTPException(status_code=delete_response.status_code, detail="Failed to delete file metadata")
-        
-        return {"success": True, "message": "File deleted successfully"}
+        owner = username_from_s3_key(s3_key)
         
-    except requests.exceptions.RequestException as e:
+        # Delete metadata from MantaHQ first; a refusal leaves everything in place
+        try:
+            delete_response = await manta.delete(
+                f"/filemanagement/{file_id}",
+                token=manta_token,
+                timeout=10
+            )
+            status = delete_response.status_code
+        except httpx.HTTPError as e:
+            logger.warning(f"Request error deleting file metadata, will retry: {e}")
+            status = None
+        
+        metadata_pending = status not in (200, 204, 404)
+        if metadata_pending:
+            if not manta_delete_is_transient(status):
+                logger.error(f"Failed to delete file metadata: {status}")
+                raise HTTPException(status_code=status, detail="Failed to delete file metadata")
+            # The delete is committed from here on; the outbox retries MantaHQ until it agrees
+            await outbox.enqueue("delete_metadata", {"file_id": file_id, "token": manta_token})
+        
+        # S3 objects go in the background (the blob only when no other file shares it)
+        await discard_uploads([s3_key])
+        await release_thumbnails([s3_key])
+        logger.info(f"Deleted file {file_id}; S3 clean-up queued for {s3_key}")
+        
+        # Cached download URLs would now point at a missing object
+        url_cache.invalidate_file(file_id)
+        if owner:
+            forget_file(owner, file_id)
+            await share_store.delete_for_files(owner, [file_id])
+        
+        return {"success": True, "message": "File deleted successfully", "metadata_pending": metadata_pending}
+        
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
         logger.error(f"Request error deleting file: {e}")
         raise HTTPException(status_code=500, detail=f"Request error: {str(e)}")
     except Exception as e:
         logger.error(f"Unexpected error deleting file: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/files/delete-batch")
+async def delete_files_batch(request: DeleteBatchRequest, principal: Principal = Depends(get_user)):
+    """Delete many files: one S3 DeleteObjects per 1000 keys, concurrent metadata removal"""
+    if not storage.available:
+        raise HTTPException(status_code=500, detail="S3 client not available")
+    if len(request.file_ids) > DELETE_BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {DELETE_BATCH_MAX_FILES} files per batch")
+    
+    manta_token = principal.token
+    username = principal.username
+    
+    file_ids = list(dict.fromkeys(request.file_ids))
+    try:
+        records = await resolver.resolve_many(file_ids, manta_token, username)
+    except MetadataUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except httpx.HTTPError as e:
+        logger.error(f"Request error resolving files for batch delete: {e}")
+        raise HTTPException(status_code=500, detail=f"Request error: {str(e)}")
+    
+    results = {}
+    targets = {}
+    for file_id in file_ids:
+        record = records.get(file_id)
+        if not record or not record.get('s3_key'):
+            results[file_id] = {"file_id": file_id, "success": False, "status": "not_found"}
+        else:
+            targets[file_id] = record['s3_key']
+    
+    slots = asyncio.Semaphore(DELETE_BATCH_CONCURRENCY)
+    
+    async def delete_metadata(file_id: str) -> dict:
+        async with slots:
+            try:
+                delete_response = await manta.delete(f"/filemanagement/{file_id}", token=manta_token, timeout=10)
+                status = delete_response.status_code
+            except httpx.HTTPError as e:
+                logger.warning(f"Request error deleting metadata for {file_id}, will retry: {e}")
+                status = None
+        if status in (200, 204, 404):
+            return {"file_id": file_id, "success": True, "status": "deleted"}
+        if manta_delete_is_transient(status):
+            await outbox.enqueue("delete_metadata", {"file_id": file_id, "token": manta_token})
+            return {"file_id": file_id, "success": True, "status": "queued"}
+        logger.error(f"Failed to delete file metadata for {file_id}: {status}")
+        return {"file_id": file_id, "success": False, "status": "error", "error": "Failed to delete file metadata"}
+    
+    # Metadata first, then S3 clean-up in bulk for every file whose delete is committed
+    for outcome in await asyncio.gather(*(delete_metadata(file_id) for file_id in targets)):
+        results[outcome["file_id"]] = outcome
+    removed = [file_id for file_id in targets if results[file_id]["success"]]
+    removed_keys = list({targets[file_id] for file_id in removed})
+    await discard_uploads(removed_keys)
+    await release_thumbnails(removed_keys)
+    for file_id in removed:
+        url_cache.invalidate_file(file_id)
+        forget_file(username, file_id)
+    await share_store.delete_for_files(username, removed)
+    
+    report = [results[file_id] for file_id in file_ids]
+    deleted = sum(1 for r in report if r["success"])
+    return {
+        "success": deleted == len(report),
+        "deleted": deleted,
+        "queued": sum(1 for r in report if r["status"] == "queued"),
+        "failed": len(report) - deleted,
+        "results": report
+    }
+
 @app.post("/share/protected")
 async def create_protected_share(
     request: dict,
-    authorization: Optional[str] = Header(None)
+    principal: Principal = Depends(get_principal)
 ):
     """Create a protected share link with access key"""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Authorization header required")
-    
-    manta_token = authorization.replace("Bearer ", "")
+    manta_token = principal.token
     
     try:
         file_id = request.get('file_id')
         access_key = request.get('access_key')
         expires_in = request.get('expires_in', '7d')
-        
-        # Generate a unique share ID
-        import uuid
-        share_id = str(uuid.uuid4())[:8]
-        
-        # Store the share info (in production, use a database)
-        # For now, we'll create a simple share URL
+        if not file_id:
+            raise HTTPException(status_code=400, detail="file_id is required")
+        try:
+            expires_in_seconds = parse_expiry(expires_in)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        file_data = await resolve_file(file_id, manta_token)
+        owner = share_owner(file_data, principal)
+        share = await share_store.create(
+            "protected",
+            file_id,
+            owner,
+            file_data,
+            access_key=access_key,
+            expires_in_seconds=expires_in_seconds,
+        )
+        share_id = share.access_id
         share_url = f"{os.getenv('FRONTEND_URL', 'http://localhost:3000')}/s/{share_id}"
         
-        # In a real implementation, you'd store this in a database:
-        # - share_id
-        # - file_id
-        # - access_key (hashed)
-        # - expires_at
-        # - created_by (user_id)
-        
         return {
             "success": True,
             "shareUrl": share_url,
@@ -1343,43 +1904,65 @@ async def create_protected_share(
             "expiresIn": expires_in
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error creating protected share: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/s/{share_id}")
+@app.get("/s/{access_id}")
 async def access_shared_file(
-    share_id: str,
-    access_key: Optional[str] = None
+    access_id: str,
+    access_key: Optional[str] = None,
+    password: Optional[str] = None
 ):
-    """Access a shared file with access key verification"""
+    """Access an anonymous or protected share: one indexed lookup plus a presigned URL"""
     try:
-        # In a real implementation, you'd:
-        # 1. Look up the share by share_id in database
-        # 2. Verify the access_key matches (hashed comparison)
-        # 3. Check if share hasn't expired
-        # 4. Return file info or download URL
-        
-        if not access_key:
-            return {
-                "requiresKey": True,
-                "message": "Access key required to view this file"
-            }
-        
-        # For demo purposes, return success
+        share = await share_store.open(access_id, access_key, password)
+    except ShareNotFound:
+        raise HTTPException(status_code=404, detail="Share not found")
+    except ShareSecretRequired as e:
         return {
-            "success": True,
-            "file": {
-                "name": "shared_file.pdf",
-                "size": 1024000,
-                "type": "application/pdf"
-            },
-            "downloadUrl": f"/download/shared/{share_id}"
+            "requiresKey": e.share.requires_key,
+            "requiresPassword": e.share.requires_password,
+            "message": "Access key or password required to view this file"
         }
-        
+    except ShareForbidden:
+        raise HTTPException(status_code=403, detail="Invalid access key or password")
+    except ShareGone:
+        raise HTTPException(status_code=410, detail="Share has expired or reached its download limit")
     except Exception as e:
         logger.error(f"Error accessing shared file: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    if not storage.available:
+        raise HTTPException(status_code=500, detail="Storage service unavailable")
+    
+    try:
+        download_url = await storage.generate_presigned_url(
+            'get_object',
+            Key=await blob_store.resolve(share.s3_key),
+            ResponseContentDisposition=f'attachment; filename="{share.filename}"',
+            expires_in=DOWNLOAD_URL_EXPIRY
+        )
+    except Exception as e:
+        logger.error(f"Error signing shared file URL: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return {
+        "success": True,
+        "message": "Share access validated",
+        "filename": share.filename,
+        "size": share.size,
+        "content_type": share.content_type,
+        "download_url": download_url,
+        "file": {
+            "name": share.filename,
+            "size": share.size,
+            "type": share.content_type
+        },
+        "downloadUrl": download_url
+    }
 
 @app.get("/")
 async def root():
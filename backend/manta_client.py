@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional
+
+import httpx
+
+from auth import accepted_tokens
+from metrics import manta_latency, path_template
+from tracing import record
+
+logger = logging.getLogger(__name__)
+
+MANTA_BASE_URL = os.getenv('MANTA_BASE_URL', "https://api.mantahq.com/api/workflow/olaleye/mantadrive")
+
+# Connection pool and timeout settings (override via environment)
+MANTA_MAX_CONNECTIONS = int(os.getenv('MANTA_MAX_CONNECTIONS', '100'))
+MANTA_MAX_KEEPALIVE = int(os.getenv('MANTA_MAX_KEEPALIVE', '20'))
+MANTA_KEEPALIVE_EXPIRY = float(os.getenv('MANTA_KEEPALIVE_EXPIRY', '30'))
+MANTA_CONNECT_TIMEOUT = float(os.getenv('MANTA_CONNECT_TIMEOUT', '5'))
+MANTA_DEFAULT_TIMEOUT = float(os.getenv('MANTA_DEFAULT_TIMEOUT', '10'))
+
+
+class MantaClient:
+    """Shared, connection-pooled async client for the MantaHQ workflow API"""
+
+    def __init__(
+        self,
+        base_url: str = MANTA_BASE_URL,
+        max_connections: int = MANTA_MAX_CONNECTIONS,
+        max_keepalive: int = MANTA_MAX_KEEPALIVE,
+        keepalive_expiry: float = MANTA_KEEPALIVE_EXPIRY,
+        connect_timeout: float = MANTA_CONNECT_TIMEOUT,
+        default_timeout: float = MANTA_DEFAULT_TIMEOUT,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.connect_timeout = connect_timeout
+        self.default_timeout = default_timeout
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the pooled client, creating it lazily for the running event loop"""
+        loop = asyncio.get_running_loop()
+        # Pooled connections are bound to the loop that opened them
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=self.limits,
+                timeout=httpx.Timeout(self.default_timeout, connect=self.connect_timeout),
+                transport=self.transport,
+            )
+            self._loop = loop
+        return self._client
+
+    def _timeout(self, timeout: Optional[float]) -> httpx.Timeout:
+        return httpx.Timeout(timeout or self.default_timeout, connect=self.connect_timeout)
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        token: Optional[str] = None,
+        timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """Send a request to MantaHQ, adding the bearer token when given"""
+        headers = kwargs.pop('headers', None) or {}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        client = self._get_client()
+        template = path_template(path)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = await client.request(method, path, headers=headers, timeout=self._timeout(timeout), **kwargs)
+            status = str(response.status_code)
+            self._accepted(token, response)
+            return response
+        finally:
+            self._observe(method, template, status, start)
+
+    @staticmethod
+    def _observe(method: str, template: str, status: str, start: float) -> None:
+        elapsed = time.perf_counter() - start
+        manta_latency.labels(method, template, status).observe(elapsed)
+        record("manta", start, elapsed, f"{method} {template} {status}")
+
+    @staticmethod
+    def _accepted(token: Optional[str], response: httpx.Response) -> None:
+        # MantaHQ checks the token on every call, so a success vouches for it
+        if token and response.is_success:
+            accepted_tokens.add(token)
+
+    @asynccontextmanager
+    async def stream(
+        self,
+        method: str,
+        path: str,
+        token: Optional[str] = None,
+        timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[httpx.Response]:
+        """Like request(), but the body is read incrementally; use with `async with`"""
+        headers = kwargs.pop('headers', None) or {}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        client = self._get_client()
+        template = path_template(path)
+        start = time.perf_counter()
+        opened = False
+        try:
+            async with client.stream(method, path, headers=headers, timeout=self._timeout(timeout), **kwargs) as response:
+                opened = True
+                self._observe(method, template, str(response.status_code), start)
+                self._accepted(token, response)
+                yield response
+        finally:
+            if not opened:
+                self._observe(method, template, "error", start)
+
+    async def get(self, path: str, token: Optional[str] = None, timeout: Optional[float] = None, **kwargs: Any) -> httpx.Response:
+        return await self.request("GET", path, token=token, timeout=timeout, **kwargs)
+
+    async def post(self, path: str, token: Optional[str] = None, timeout: Optional[float] = None, **kwargs: Any) -> httpx.Response:
+        return await self.request("POST", path, token=token, timeout=timeout, **kwargs)
+
+    async def put(self, path: str, token: Optional[str] = None, timeout: Optional[float] = None, **kwargs: Any) -> httpx.Response:
+        return await self.request("PUT", path, token=token, timeout=timeout, **kwargs)
+
+    async def delete(self, path: str, token: Optional[str] = None, timeout: Optional[float] = None, **kwargs: Any) -> httpx.Response:
+        return await self.request("DELETE", path, token=token, timeout=timeout, **kwargs)
+
+    async def aclose(self) -> None:
+        """Close pooled connections (called on application shutdown)"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
+
+
+manta = MantaClient()
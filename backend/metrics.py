@@ -0,0 +1,250 @@
+import math
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+METRICS_PREFIX = os.getenv('METRICS_PREFIX', 'mantadrive')
+# Seconds; covers cache hits (sub-millisecond) through large uploads
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Response adds "; charset=utf-8" to text types
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    """A named family of series keyed by label values.
+
+    The metric's lock is only taken the first time a label combination is
+    seen; after that, updates are plain attribute arithmetic on the series.
+    Nearly all updates happen on the event loop thread, and an increment
+    lost to a race with a pool thread is an acceptable price for keeping
+    locks off the upload and listing paths.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = f"{METRICS_PREFIX}_{name}" if METRICS_PREFIX else name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series: dict = {}
+        self._lock = threading.Lock()
+
+    def _new(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """The series for these label values, created on first use"""
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            with self._lock:
+                series = self._series.setdefault(values, self._new())
+        return series
+
+    def samples(self) -> list:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(Metric):
+    kind = "counter"
+    _new = _Value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def samples(self) -> list:
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(s.value)}" for key, s in list(self._series.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        # One slot per bound plus the overflow slot; made cumulative at render time
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new(self) -> _Buckets:
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def samples(self) -> list:
+        lines = []
+        for key, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), list(series.counts)):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(series.sum)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Collected(Metric):
+    """Series read from a callback at scrape time, e.g. a cache's own hit counters"""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str], collect: Callable[[], dict], kind: str = "gauge"):
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self) -> list:
+        return [
+            f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+            for key, value in self.collect().items()
+        ]
+
+
+class Registry:
+    """Every metric the process exports, rendered in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: dict = {}
+
+    def register(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def collected(self, name: str, help: str, labelnames: Iterable[str], collect: Callable[[], dict], kind: str = "gauge") -> Collected:
+        return self.register(Collected(name, help, labelnames, collect, kind))
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in list(self._metrics.values())) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.counter("http_requests_total", "HTTP requests handled, by route template and status", ("method", "route", "status"))
+http_latency = registry.histogram("http_request_duration_seconds", "Time to send the full HTTP response", ("method", "route"))
+http_in_flight = registry.gauge("http_requests_in_flight", "HTTP requests currently being handled", ("method",))
+manta_latency = registry.histogram("manta_request_duration_seconds", "MantaHQ call latency until response headers", ("method", "path", "status"))
+s3_latency = registry.histogram("s3_operation_duration_seconds", "S3 operation latency, including time queued for a pool thread", ("operation", "outcome"))
+uploaded_bytes = registry.counter("uploaded_bytes_total", "File content written to S3 for client uploads")
+downloaded_bytes = registry.counter("downloaded_bytes_total", "File content streamed to clients through the API")
+
+_ID_SEGMENT = re.compile(r'\d')
+
+
+def path_template(path: str) -> str:
+    """Collapse id segments (anything containing a digit) so paths stay low-cardinality"""
+    path = path.split('?', 1)[0]
+    return '/'.join('{id}' if _ID_SEGMENT.search(segment) else segment for segment in path.split('/'))
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request counts, latency and in-flight requests.
+
+    Requests are labelled with the matched route template (`/files/{file_id}`)
+    rather than the raw path, and unmatched requests share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        start = time.perf_counter()
+        in_flight = http_in_flight.labels(method)
+        in_flight.inc()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            http_requests.labels(method, template, str(status)).inc()
+            http_latency.labels(method, template).observe(time.perf_counter() - start)
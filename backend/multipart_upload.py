@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import os
+
+from fastapi import UploadFile
+
+from metrics import uploaded_bytes
+from s3_storage import S3Storage
+
+logger = logging.getLogger(__name__)
+
+# S3 requires every part except the last to be at least 5 MiB
+MIN_PART_SIZE = 5 * 1024 * 1024
+S3_UPLOAD_PART_SIZE = max(int(os.getenv('S3_UPLOAD_PART_SIZE', str(8 * 1024 * 1024))), MIN_PART_SIZE)
+S3_UPLOAD_CONCURRENCY = max(int(os.getenv('S3_UPLOAD_CONCURRENCY', '4')), 1)
+
+
+async def read_chunk(file: UploadFile, size: int) -> bytes:
+    """Read up to `size` bytes, only returning a short chunk at end of file"""
+    chunk = await file.read(size)
+    if not chunk or len(chunk) == size:
+        return chunk
+    buffer = bytearray(chunk)
+    while len(buffer) < size:
+        more = await file.read(size - len(buffer))
+        if not more:
+            break
+        buffer.extend(more)
+    return bytes(buffer)
+
+
+async def measure_upload(file: UploadFile, chunk_size: int = 1024 * 1024) -> int:
+    """Count the bytes of an upload without holding it in memory"""
+    await file.seek(0)
+    size = 0
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+    return size
+
+
+async def stream_upload(
+    storage: S3Storage,
+    key: str,
+    file: UploadFile,
+    content_type: str,
+    part_size: int = S3_UPLOAD_PART_SIZE,
+    concurrency: int = S3_UPLOAD_CONCURRENCY,
+) -> int:
+    """Stream an UploadFile to S3 and return the number of bytes written.
+
+    Files smaller than one part go up with a single put_object. Larger files
+    are sent as a multipart upload with at most `concurrency` parts in flight,
+    so peak memory is bounded by part_size * concurrency. The multipart upload
+    is aborted if any part fails.
+    """
+    first = await read_chunk(file, part_size)
+
+    if len(first) < part_size:
+        await storage.put_object(Key=key, Body=first, ContentType=content_type)
+        uploaded_bytes.inc(len(first))
+        return len(first)
+
+    created = await storage.create_multipart_upload(Key=key, ContentType=content_type)
+    upload_id = created['UploadId']
+    slots = asyncio.Semaphore(concurrency)
+    tasks = []
+    total = 0
+
+    async def send_part(part_number: int, body: bytes) -> dict:
+        try:
+            result = await storage.upload_part(
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=body,
+            )
+            uploaded_bytes.inc(len(body))
+            return {"PartNumber": part_number, "ETag": result['ETag']}
+        finally:
+            slots.release()
+
+    try:
+        chunk = first
+        part_number = 1
+        await slots.acquire()
+        while chunk:
+            total += len(chunk)
+            tasks.append(asyncio.ensure_future(send_part(part_number, chunk)))
+            part_number += 1
+            chunk = None
+            # Wait for a free slot before reading the next part into memory
+            await slots.acquire()
+            for task in tasks:
+                if task.done() and task.exception():
+                    raise task.exception()
+            chunk = await read_chunk(file, part_size)
+        slots.release()
+
+        parts = await asyncio.gather(*tasks)
+        await storage.complete_multipart_upload(
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": sorted(parts, key=lambda p: p["PartNumber"])},
+        )
+        logger.info(f"Multipart upload complete for {key}: {len(parts)} parts, {total} bytes")
+        return total
+
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            await storage.abort_multipart_upload(Key=key, UploadId=upload_id)
+            logger.info(f"Aborted multipart upload for {key}")
+        except Exception as abort_error:
+            logger.error(f"Failed to abort multipart upload for {key}: {abort_error}")
+        raise
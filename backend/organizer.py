@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+from collections import deque
+from typing import Iterable, Optional
+
+from bounded_cache import BoundedCache
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_CATEGORY = "Others"
+# Checked in order; the first matching rule wins. "match": "all" requires every
+# configured criterion (keywords, extensions, mime_prefixes) to match.
+DEFAULT_RULES = [
+    {"category": "Work Documents", "keywords": ["resume", "cv", "report", "invoice", "contract"]},
+    {"category": "Personal Photos", "mime_prefixes": ["image/"], "keywords": ["photo", "img", "pic", "selfie"], "match": "all"},
+    {"category": "Videos", "mime_prefixes": ["video/"]},
+    {"category": "Archives", "extensions": [".zip", ".rar", ".tar", ".gz"]},
+]
+CLASSIFICATION_CACHE_MAX_ENTRIES = int(os.getenv('CLASSIFICATION_CACHE_MAX_ENTRIES', '200000'))
+SAMPLE_FILES_PER_CATEGORY = 5
+
+
+def load_rules() -> list:
+    """Rules from ORGANIZE_RULES (a JSON list), falling back to the defaults"""
+    raw = os.getenv('ORGANIZE_RULES')
+    if not raw:
+        return DEFAULT_RULES
+    try:
+        rules = json.loads(raw)
+        if not isinstance(rules, list) or not all(isinstance(r, dict) and r.get('category') for r in rules):
+            raise ValueError("expected a list of objects with a category")
+        return rules
+    except ValueError as e:
+        logger.error(f"Invalid ORGANIZE_RULES, using defaults: {e}")
+        return DEFAULT_RULES
+
+
+class TermMatcher:
+    """Aho-Corasick automaton over terms that each carry a bitmask of rules.
+
+    Every term that occurs sets its bits, including overlapping and nested
+    ones ("pic" and "cv" in "epicvacation"), which a regex alternation would
+    drop because its matches can't overlap.
+    """
+
+    def __init__(self, masks: dict):
+        self._goto = [{}]
+        # Bits of terms ending exactly at a state, then of every term ending there
+        self._exact = [0]
+        for term, mask in masks.items():
+            state = 0
+            for char in term:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][char] = nxt
+                    self._goto.append({})
+                    self._exact.append(0)
+                state = nxt
+            self._exact[state] |= mask
+
+        self._fail = [0] * len(self._goto)
+        self._out = list(self._exact)
+        # Breadth first; depth-one states keep the root as their fallback
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(char, 0)
+                self._out[nxt] |= self._out[self._fail[nxt]]
+                queue.append(nxt)
+
+    def _walk(self, text: str):
+        goto, fail = self._goto, self._fail
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            yield state
+
+    def anywhere(self, text: str) -> int:
+        """Bits of every term occurring in text"""
+        bits = 0
+        for state in self._walk(text):
+            bits |= self._out[state]
+        return bits
+
+    def prefixes(self, text: str) -> int:
+        """Bits of every term text starts with"""
+        bits = 0
+        state = 0
+        for char in text:
+            state = self._goto[state].get(char)
+            if state is None:
+                break
+            bits |= self._exact[state]
+        return bits
+
+
+class RuleSet:
+    """Classification rules compiled into one automaton per criterion.
+
+    Each term maps to a bitmask of the rules that use it, so a file costs
+    three linear scans plus a walk over the rule masks, however many
+    keywords are configured. Rule order decides between matching rules.
+    """
+
+    CRITERIA = ("keywords", "extensions", "mime_prefixes")
+
+    def __init__(self, rules: list):
+        self.rules = rules
+        self.categories = [rule['category'] for rule in rules]
+        masks = {criterion: {} for criterion in self.CRITERIA}
+        # (rule bit, category, criteria indexes that must all match or None for any)
+        self._plan = []
+        for bit, rule in enumerate(rules):
+            required = []
+            for index, criterion in enumerate(self.CRITERIA):
+                terms = [str(t).lower() for t in rule.get(criterion) or [] if str(t)]
+                if terms:
+                    required.append(index)
+                for term in terms:
+                    masks[criterion][term] = masks[criterion].get(term, 0) | (1 << bit)
+            match_all = rule.get('match', 'any') == 'all'
+            self._plan.append((1 << bit, rule['category'], tuple(required) if match_all else None))
+
+        self._keywords, self._extensions, self._mimes = (
+            TermMatcher(masks[criterion]) if masks[criterion] else None for criterion in self.CRITERIA
+        )
+
+    def classify(self, filename: str, content_type: str) -> str:
+        filename = filename.lower()
+        keywords = extension = mime = 0
+        if self._keywords is not None:
+            keywords = self._keywords.anywhere(filename)
+        if self._extensions is not None:
+            # Anywhere in the name, as before: "logs.tar.gz.part" is still an archive
+            extension = self._extensions.anywhere(filename)
+        if self._mimes is not None and content_type:
+            mime = self._mimes.prefixes(content_type.lower())
+
+        combined = keywords | extension | mime
+        if combined:
+            hits = (keywords, extension, mime)
+            for flag, category, required in self._plan:
+                if combined & flag and (required is None or all(hits[i] & flag for i in required)):
+                    return category
+        return FALLBACK_CATEGORY
+
+
+class FileOrganizer:
+    """Classifies listings with a RuleSet, caching each file's category by id"""
+
+    def __init__(self, rules: Optional[list] = None, max_entries: int = CLASSIFICATION_CACHE_MAX_ENTRIES):
+        self.rules = RuleSet(rules if rules is not None else load_rules())
+        self._cache = BoundedCache(max_entries)
+
+    def classify(self, record: dict) -> str:
+        s3_key = record.get('s3_key', '')
+        content_type = record.get('content_type') or record.get('type') or ''
+        file_id = record.get('id')
+        cache_key = str(file_id) if file_id is not None else None
+
+        if cache_key is not None:
+            cached = self._cache.peek(cache_key)
+            # A reused id with a different key or type is classified again
+            if cached is not None and cached[0] == s3_key and cached[1] == content_type:
+                self._cache.count(True)
+                return cached[2]
+        self._cache.count(False)
+
+        category = self.rules.classify(s3_key.split('/')[-1], content_type)
+        if cache_key is not None:
+            self._cache.set(cache_key, (s3_key, content_type, category))
+        return category
+
+    def organize(self, records: Iterable[dict], samples: int = SAMPLE_FILES_PER_CATEGORY) -> dict:
+        """One pass over records: {category: {"count", "files"}} keeping `samples` files each"""
+        groups = {category: {"count": 0, "files": []} for category in self.rules.categories + [FALLBACK_CATEGORY]}
+        for record in records:
+            group = groups.setdefault(self.classify(record), {"count": 0, "files": []})
+            group["count"] += 1
+            if len(group["files"]) < samples:
+                group["files"].append({"id": record.get("id"), "name": record.get("s3_key", "").split("/")[-1]})
+        return groups
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+organizer = FileOrganizer()
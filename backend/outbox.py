@@ -0,0 +1,297 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Column, Float, Integer, String, Text, update
+
+from database import Base, SessionLocal, init_db
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '4'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '10'))
+OUTBOX_RETRY_DELAY = float(os.getenv('OUTBOX_RETRY_DELAY', '1'))
+OUTBOX_MAX_RETRY_DELAY = float(os.getenv('OUTBOX_MAX_RETRY_DELAY', '900'))
+# A claimed task is retried by anyone once its lease runs out (e.g. the worker died)
+OUTBOX_LEASE = float(os.getenv('OUTBOX_LEASE', '300'))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '30'))
+OUTBOX_BATCH_SIZE = 100
+
+PENDING, DEAD = "pending", "dead"
+
+
+class OutboxEntry(Base):
+    """A follow-up action that must eventually succeed"""
+
+    __tablename__ = "outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(64), nullable=False)
+    payload = Column(Text, nullable=False)
+    status = Column(String(16), nullable=False, default=PENDING, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(Float, nullable=False, index=True)
+    last_error = Column(Text)
+    created_at = Column(Float, nullable=False)
+
+
+@dataclass(frozen=True)
+class OutboxTask:
+    id: int
+    kind: str
+    payload: dict
+    attempt: int
+    created_at: float
+
+
+class PermanentFailure(Exception):
+    """Retrying won't help; the task is parked as dead straight away"""
+
+
+class Outbox:
+    """Durable queue of compensating actions, retried with exponential backoff.
+
+    Tasks are committed to SQLite before the request returns and run by the
+    worker started in the app lifespan, which wakes on enqueue. Claims are
+    leases taken with a guarded UPDATE, so several processes can share the
+    table; handlers must be idempotent because a task may run again after a
+    crash.
+
+    Payloads are stored as plain JSON. A handler that needs a credential
+    (delete_metadata carries the user's MantaHQ bearer token) names it in
+    `secrets`: it lives only as long as the task is pending, since finished
+    rows are deleted and dead-lettered rows are stripped of those fields.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        workers: int = OUTBOX_WORKERS,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+        retry_delay: float = OUTBOX_RETRY_DELAY,
+        max_retry_delay: float = OUTBOX_MAX_RETRY_DELAY,
+        lease: float = OUTBOX_LEASE,
+        poll_interval: float = OUTBOX_POLL_INTERVAL,
+    ):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.handlers: dict = {}
+        self.secrets: dict = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.completed = 0
+        self.retries = 0
+        self.dead = 0
+
+    def handler(self, kind: str, secrets: tuple = ()) -> Callable:
+        """Decorator registering the coroutine that performs tasks of `kind`.
+
+        `secrets` are payload fields dropped once the task is dead-lettered.
+        """
+        def register(fn: Callable[[OutboxTask], Awaitable[Any]]) -> Callable:
+            self.handlers[kind] = fn
+            self.secrets[kind] = tuple(secrets)
+            return fn
+        return register
+
+    def _insert(self, kind: str, payload: dict, delay: float) -> int:
+        init_db()
+        now = time.time()
+        entry = OutboxEntry(
+            kind=kind,
+            payload=json.dumps(payload),
+            status=PENDING,
+            attempts=0,
+            next_attempt_at=now + delay,
+            created_at=now,
+        )
+        with self.session_factory() as session:
+            session.add(entry)
+            session.commit()
+            return entry.id
+
+    def _due(self, now: float, limit: int) -> list:
+        init_db()
+        with self.session_factory() as session:
+            rows = (
+                session.query(OutboxEntry.id)
+                .filter(OutboxEntry.status == PENDING, OutboxEntry.next_attempt_at <= now)
+                .order_by(OutboxEntry.next_attempt_at)
+                .limit(limit)
+                .all()
+            )
+            return [task_id for task_id, in rows]
+
+    def _next_due(self) -> Optional[float]:
+        with self.session_factory() as session:
+            row = (
+                session.query(OutboxEntry.next_attempt_at)
+                .filter(OutboxEntry.status == PENDING)
+                .order_by(OutboxEntry.next_attempt_at)
+                .first()
+            )
+            return row[0] if row else None
+
+    def _claim(self, task_id: int) -> Optional[OutboxTask]:
+        """Lease a due task; None if it isn't due or someone else holds it"""
+        init_db()
+        now = time.time()
+        with self.session_factory() as session:
+            result = session.execute(
+                update(OutboxEntry)
+                .where(OutboxEntry.id == task_id, OutboxEntry.status == PENDING, OutboxEntry.next_attempt_at <= now)
+                .values(next_attempt_at=now + self.lease, attempts=OutboxEntry.attempts + 1)
+            )
+            session.commit()
+            if result.rowcount == 0:
+                return None
+            entry = session.get(OutboxEntry, task_id, populate_existing=True)
+            return OutboxTask(entry.id, entry.kind, json.loads(entry.payload), entry.attempts, entry.created_at)
+
+    def _finish(self, task_id: int) -> None:
+        with self.session_factory() as session:
+            session.query(OutboxEntry).filter(OutboxEntry.id == task_id).delete()
+            session.commit()
+
+    def _fail(self, task_id: int, error: str, retry_at: Optional[float], scrub: tuple = ()) -> None:
+        with self.session_factory() as session:
+            values = {"last_error": error[:2000]}
+            if retry_at is None:
+                values["status"] = DEAD
+                entry = session.get(OutboxEntry, task_id) if scrub else None
+                if entry is not None:
+                    payload = json.loads(entry.payload)
+                    values["payload"] = json.dumps({k: v for k, v in payload.items() if k not in scrub})
+            else:
+                values["next_attempt_at"] = retry_at
+            session.execute(update(OutboxEntry).where(OutboxEntry.id == task_id).values(**values))
+            session.commit()
+
+    def _counts(self) -> dict:
+        init_db()
+        with self.session_factory() as session:
+            return {
+                status: session.query(OutboxEntry).filter(OutboxEntry.status == status).count()
+                for status in (PENDING, DEAD)
+            }
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before retry number `attempt`, jittered so retries don't bunch up"""
+        delay = min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def enqueue(self, kind: str, payload: dict, delay: float = 0.0) -> int:
+        """Commit a task and wake the worker; returns the task id"""
+        if kind not in self.handlers:
+            raise ValueError(f"No outbox handler for {kind}")
+        task_id = await run_in_threadpool(self._insert, kind, payload, delay)
+        self.wake()
+        return task_id
+
+    def wake(self) -> None:
+        """Nudge the worker, if one runs on this loop; otherwise the task waits for one"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._wakeup is not None and self._loop is loop:
+            self._wakeup.set()
+
+    async def run(self, task_id: int) -> bool:
+        """Attempt one task now if it is due and unclaimed; True if it completed"""
+        task = await run_in_threadpool(self._claim, task_id)
+        if task is None:
+            return False
+        try:
+            await self.handlers[task.kind](task)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            permanent = isinstance(e, PermanentFailure) or task.attempt >= self.max_attempts
+            retry_at = None if permanent else time.time() + self.backoff(task.attempt)
+            await run_in_threadpool(self._fail, task.id, f"{type(e).__name__}: {e}", retry_at, self.secrets.get(task.kind, ()))
+            if retry_at is None:
+                self.dead += 1
+                logger.error(f"Outbox task {task.id} ({task.kind}) failed permanently after {task.attempt} attempts: {e}")
+            else:
+                self.retries += 1
+                logger.warning(f"Outbox task {task.id} ({task.kind}) failed (attempt {task.attempt}), retrying: {e}")
+            return False
+        await run_in_threadpool(self._finish, task.id)
+        self.completed += 1
+        return True
+
+    async def run_due(self) -> int:
+        """Run every task that is due, a few at a time; returns how many completed"""
+        slots = asyncio.Semaphore(self.workers)
+
+        async def run_one(task_id: int) -> bool:
+            async with slots:
+                return await self.run(task_id)
+
+        completed = 0
+        while True:
+            due = await run_in_threadpool(self._due, time.time(), OUTBOX_BATCH_SIZE)
+            if not due:
+                return completed
+            outcomes = await asyncio.gather(*(run_one(task_id) for task_id in due))
+            completed += sum(outcomes)
+            if len(due) < OUTBOX_BATCH_SIZE:
+                return completed
+
+    def start(self) -> None:
+        """Start the worker on the running loop (called from the app lifespan)"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._work())
+
+    async def _work(self) -> None:
+        while True:
+            # Cleared before the scan, so a task enqueued during it still wakes us
+            self._wakeup.clear()
+            try:
+                await self.run_due()
+                next_due = await run_in_threadpool(self._next_due)
+            except Exception as e:
+                logger.error(f"Outbox worker error: {e}")
+                next_due = None
+            timeout = self.poll_interval if next_due is None else min(max(next_due - time.time(), 0.0), self.poll_interval)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def aclose(self) -> None:
+        if self._task is not None and self._loop is asyncio.get_running_loop():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._loop = None
+
+    async def backlog(self) -> dict:
+        """Pending and dead-lettered task counts from the table"""
+        return await run_in_threadpool(self._counts)
+
+    def stats(self) -> dict:
+        return {
+            "completed": self.completed,
+            "retries": self.retries,
+            "dead_lettered": self.dead,
+        }
+
+
+outbox = Outbox()
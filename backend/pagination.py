@@ -0,0 +1,85 @@
+import base64
+import heapq
+import json
+from typing import Any, Callable, Optional
+
+from file_records import timestamp_ms
+
+SORT_FIELDS = ("date", "name", "size")
+SORT_ORDERS = ("asc", "desc")
+MAX_PAGE_SIZE = 1000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _sort_value(sort: str) -> Callable[[dict], Any]:
+    if sort == "name":
+        return lambda f: str(f.get('name') or '').lower()
+    if sort == "size":
+        return lambda f: int(f.get('size') or 0)
+    return lambda f: timestamp_ms(f.get('created_at'))
+
+
+def sort_key(sort: str) -> Callable[[dict], tuple]:
+    """Total ordering key: typed sort value, then id for stability"""
+    value = _sort_value(sort)
+    return lambda f: (value(f), str(f.get('id')))
+
+
+def encode_cursor(sort: str, order: str, key: tuple) -> str:
+    raw = json.dumps([sort, order, list(key)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: str, order: str) -> tuple:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, cursor_order, key = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise InvalidCursor("Malformed cursor")
+    if cursor_sort != sort or cursor_order != order:
+        raise InvalidCursor("Cursor was issued for a different sort order")
+    # The key is compared against sort_key() tuples, so it must have their shape
+    value_type = str if sort == "name" else int
+    if not (
+        isinstance(key, list) and len(key) == 2
+        and isinstance(key[0], value_type) and not isinstance(key[0], bool)
+        and isinstance(key[1], str)
+    ):
+        raise InvalidCursor("Malformed cursor")
+    return tuple(key)
+
+
+def sort_files(files: list, sort: str = "date", order: str = "desc") -> list:
+    return sorted(files, key=sort_key(sort), reverse=(order == "desc"))
+
+
+def paginate(
+    files: list,
+    limit: int,
+    cursor: Optional[str] = None,
+    sort: str = "date",
+    order: str = "desc",
+) -> tuple:
+    """One page of `files` plus the cursor for the next page (None at the end).
+
+    Selects the page with a bounded heap (O(n log limit)) instead of sorting
+    the whole listing on every request.
+    """
+    key = sort_key(sort)
+    descending = order == "desc"
+    candidates = files
+    if cursor:
+        after = decode_cursor(cursor, sort, order)
+        if descending:
+            candidates = (f for f in files if key(f) < after)
+        else:
+            candidates = (f for f in files if key(f) > after)
+
+    select = heapq.nlargest if descending else heapq.nsmallest
+    window = select(limit + 1, candidates, key=key)
+    page = window[:limit]
+    next_cursor = encode_cursor(sort, order, key(page[-1])) if len(window) > limit else None
+    return page, next_cursor
@@ -0,0 +1,90 @@
+import asyncio
+import io
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+
+import qrcode
+import qrcode.image.svg
+
+from bounded_cache import BoundedCache
+from tracing import span
+
+QR_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+QR_RENDER_WORKERS = int(os.getenv('QR_RENDER_WORKERS', '2'))
+# "thread" keeps rendering off the event loop; "process" also sidesteps the GIL
+QR_RENDER_POOL = os.getenv('QR_RENDER_POOL', 'thread')
+QR_CACHE_MAX_ENTRIES = int(os.getenv('QR_CACHE_MAX_ENTRIES', '2048'))
+
+
+def render_qr(data: str, fmt: str = "png") -> bytes:
+    """Render a QR code for `data` as PNG or SVG bytes"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    buffer = io.BytesIO()
+    if fmt == "svg":
+        img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+        img.save(buffer)
+    else:
+        img = qr.make_image(fill_color="black", back_color="white")
+        img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class QRRenderer:
+    """Renders QR codes in a worker pool and caches them by (link, format)"""
+
+    def __init__(self, workers: int = QR_RENDER_WORKERS, pool: str = QR_RENDER_POOL, max_entries: int = QR_CACHE_MAX_ENTRIES):
+        self.workers = workers
+        self.pool = pool
+        self._executor: Optional[Executor] = None
+        self._cache = BoundedCache(max_entries)
+        self._pending: dict = {}
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.pool == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="qr")
+        return self._executor
+
+    async def render(self, data: str, fmt: str = "png") -> bytes:
+        key = (data, fmt)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        # Concurrent requests for the same link share one render
+        pending = self._pending.get(key)
+        if pending is None:
+            loop = asyncio.get_running_loop()
+            pending = asyncio.ensure_future(loop.run_in_executor(self._get_executor(), render_qr, data, fmt))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        with span("qr.render"):
+            image = await asyncio.shield(pending)
+
+        self._cache.set(key, image)
+        return image
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+qr_renderer = QRRenderer()
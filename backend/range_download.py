@@ -0,0 +1,159 @@
+import logging
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, AsyncIterator, Optional
+from urllib.parse import quote
+
+from botocore.exceptions import ClientError
+
+from metrics import downloaded_bytes
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_STREAM_CHUNK_SIZE = int(os.getenv('DOWNLOAD_STREAM_CHUNK_SIZE', str(256 * 1024)))
+
+# One byte range: "bytes=0-499", "bytes=500-" or "bytes=-500"
+RANGE_PATTERN = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$', re.IGNORECASE)
+
+
+class NotModified(Exception):
+    """If-None-Match matched the current ETag"""
+
+    def __init__(self, etag: Optional[str]):
+        super().__init__("Not modified")
+        self.etag = etag
+
+
+class RangeNotSatisfiable(Exception):
+    """The requested range starts past the end of the object"""
+
+    def __init__(self, size: Optional[int]):
+        super().__init__("Range not satisfiable")
+        self.size = size
+
+
+def parse_range(value: Optional[str]) -> Optional[str]:
+    """Normalized single byte range for S3, or None to send the whole object.
+
+    Multi-range and malformed headers are ignored, as RFC 9110 allows.
+    """
+    if not value:
+        return None
+    match = RANGE_PATTERN.match(value)
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if start and end and int(end) < int(start):
+        return None
+    if not start and int(end) == 0:
+        return None
+    return f"bytes={start}-{end}"
+
+
+def if_range_conditions(if_range: Optional[str]) -> dict:
+    """get_object conditions under which the Range still applies"""
+    if not if_range:
+        return {}
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return {"IfMatch": if_range}
+    if if_range.startswith('W/'):
+        # Weak validators never satisfy If-Range; the range always fails
+        return {"IfMatch": '"-"'}
+    try:
+        return {"IfUnmodifiedSince": parsedate_to_datetime(if_range)}
+    except (TypeError, ValueError):
+        return {"IfMatch": '"-"'}
+
+
+def _error_code(error: ClientError) -> str:
+    return str(error.response.get('Error', {}).get('Code', ''))
+
+
+async def open_object(
+    storage: Any,
+    key: str,
+    range_header: Optional[str] = None,
+    if_range: Optional[str] = None,
+    if_none_match: Optional[str] = None,
+) -> dict:
+    """get_object honouring Range, If-Range and If-None-Match in one round trip.
+
+    A failed If-Range precondition falls back to the whole object, and an
+    unsatisfiable range raises RangeNotSatisfiable with the object size.
+    """
+    params = {"Key": key}
+    if if_none_match:
+        params["IfNoneMatch"] = if_none_match
+    byte_range = parse_range(range_header)
+    if byte_range:
+        try:
+            return await storage.get_object(**params, Range=byte_range, **if_range_conditions(if_range))
+        except ClientError as e:
+            code = _error_code(e)
+            if code == 'InvalidRange':
+                head = await storage.head_object(Key=key)
+                raise RangeNotSatisfiable(head.get('ContentLength'))
+            if code not in ('PreconditionFailed', '412'):
+                _raise_not_modified(e)
+                raise
+            # The object changed since the client's copy: send all of it
+    try:
+        return await storage.get_object(**params)
+    except ClientError as e:
+        _raise_not_modified(e)
+        raise
+
+
+def _raise_not_modified(error: ClientError) -> None:
+    if _error_code(error) in ('304', 'NotModified'):
+        headers = error.response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+        raise NotModified(headers.get('etag'))
+
+
+def response_headers(obj: dict) -> dict:
+    """Length, range and validator headers for a get_object result"""
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(obj.get('ContentLength', 0)),
+    }
+    if obj.get('ContentRange'):
+        headers["Content-Range"] = obj['ContentRange']
+    if obj.get('ETag'):
+        headers["ETag"] = obj['ETag']
+    if obj.get('LastModified'):
+        headers["Last-Modified"] = formatdate(obj['LastModified'].timestamp(), usegmt=True)
+    return headers
+
+
+def content_disposition(disposition: str, filename: str) -> str:
+    """Content-Disposition with an ASCII filename and the exact one per RFC 5987.
+
+    Header values go out as latin-1, so the plain parameter only carries a
+    fallback; clients that understand filename* use the UTF-8 name.
+    """
+    fallback = filename.encode('ascii', 'replace').decode('ascii').replace('"', '').replace('\\', '')
+    value = f'{disposition}; filename="{fallback}"'
+    if fallback != filename:
+        value += f"; filename*=UTF-8''{quote(filename, safe='')}"
+    return value
+
+
+async def iter_body(storage: Any, body: Any, chunk_size: int = DOWNLOAD_STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Read a botocore StreamingBody in fixed chunks off the event loop.
+
+    The body is closed however iteration ends, so a client that disconnects
+    mid-download releases the upstream S3 connection straight away.
+    """
+    try:
+        while True:
+            chunk = await storage.run(body.read, chunk_size)
+            if not chunk:
+                break
+            downloaded_bytes.inc(len(chunk))
+            yield chunk
+    finally:
+        body.close()
@@ -0,0 +1,365 @@
+import asyncio
+import logging
+import os
+import secrets
+import time
+import weakref
+from typing import Any, AsyncIterator, Optional
+
+from botocore.exceptions import ClientError
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import BigInteger, Column, Float, Integer, String, update
+
+from database import Base, SessionLocal, init_db
+from direct_upload import part_size_for
+from metrics import uploaded_bytes
+
+logger = logging.getLogger(__name__)
+
+# Sessions untouched for this long are dropped and their multipart uploads aborted
+RESUMABLE_UPLOAD_TTL = float(os.getenv('RESUMABLE_UPLOAD_TTL', str(24 * 3600)))
+RESUMABLE_JANITOR_INTERVAL = float(os.getenv('RESUMABLE_JANITOR_INTERVAL', '900'))
+# Also abort multipart uploads no session knows about (crashed workers, abandoned direct uploads)
+RESUMABLE_SWEEP_ORPHANS = os.getenv('RESUMABLE_SWEEP_ORPHANS', 'true').lower() in ('1', 'true', 'yes')
+
+UPLOADING, STORED, REGISTERED = "uploading", "stored", "registered"
+
+
+class UploadSession(Base):
+    """A resumable upload backed by one S3 multipart upload"""
+
+    __tablename__ = "upload_sessions"
+
+    upload_id = Column(String(64), primary_key=True)
+    owner = Column(String(255), nullable=False, index=True)
+    s3_key = Column(String(1024), nullable=False)
+    filename = Column(String(1024), nullable=False)
+    content_type = Column(String(255), nullable=False)
+    length = Column(BigInteger, nullable=False)
+    part_size = Column(BigInteger, nullable=False)
+    # Bytes durably stored in S3 parts; always a multiple of part_size until the end
+    offset = Column(BigInteger, nullable=False, default=0)
+    multipart_id = Column(String(1024), nullable=False)
+    status = Column(String(16), nullable=False, default=UPLOADING)
+    file_id = Column(String(128))
+    created_at = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False, index=True)
+
+    @property
+    def complete(self) -> bool:
+        return self.status != UPLOADING
+
+
+class UploadPart(Base):
+    __tablename__ = "upload_parts"
+
+    upload_id = Column(String(64), primary_key=True)
+    part_number = Column(Integer, primary_key=True)
+    etag = Column(String(255), nullable=False)
+    size = Column(BigInteger, nullable=False)
+
+
+class UploadNotFound(Exception):
+    """No upload session with that id for this user"""
+
+
+class OffsetMismatch(Exception):
+    """The client's Upload-Offset is not where the server is"""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+class UploadOverflow(Exception):
+    """The client sent more bytes than the declared length"""
+
+
+class UnalignedChunk(Exception):
+    """A PATCH that doesn't end the upload left part of a part unstored"""
+
+    def __init__(self, offset: int, part_size: int, dropped: int):
+        super().__init__(
+            f"PATCH bodies must be a multiple of {part_size} bytes unless they end the upload; "
+            f"the last {dropped} bytes were not stored, resume from offset {offset}"
+        )
+        self.offset = offset
+        self.part_size = part_size
+
+
+class ResumableUploads:
+    """Resumable uploads that keep completed parts across dropped connections.
+
+    Each PATCH streams its body into S3 parts of the session's part size,
+    committing the offset after every part. If the connection drops, the
+    bytes of the unfinished part are discarded and the client resumes from
+    the last committed offset, so completed parts are never resent. A body
+    that ends cleanly mid-part is refused rather than silently truncated.
+    """
+
+    def __init__(self, session_factory=SessionLocal, ttl: float = RESUMABLE_UPLOAD_TTL, sweep_orphans: bool = RESUMABLE_SWEEP_ORPHANS):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.sweep_orphans = sweep_orphans
+        self.part_size: Optional[int] = None  # override the computed part size (tests)
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.parts_uploaded = 0
+        self.completed = 0
+        self.aborted = 0
+
+    def _lock(self, upload_id: str) -> asyncio.Lock:
+        lock = self._locks.get(upload_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[upload_id] = lock
+        return lock
+
+    def expires_at(self, session: UploadSession) -> float:
+        return session.updated_at + self.ttl
+
+    def _insert(self, session: UploadSession) -> None:
+        init_db()
+        with self.session_factory() as db:
+            db.add(session)
+            db.commit()
+
+    def _get(self, upload_id: str, owner: str) -> UploadSession:
+        init_db()
+        with self.session_factory() as db:
+            session = db.get(UploadSession, upload_id)
+            if session is None or session.owner != owner:
+                raise UploadNotFound(upload_id)
+            return session
+
+    def _commit_part(self, upload_id: str, start: int, part_number: int, etag: str, size: int) -> None:
+        """Record a part and advance the offset, unless another request moved it first"""
+        with self.session_factory() as db:
+            result = db.execute(
+                update(UploadSession)
+                .where(UploadSession.upload_id == upload_id, UploadSession.offset == start)
+                .values(offset=start + size, updated_at=time.time())
+            )
+            if result.rowcount == 0:
+                db.rollback()
+                current = db.get(UploadSession, upload_id)
+                if current is None:
+                    raise UploadNotFound(upload_id)
+                raise OffsetMismatch(current.offset)
+            db.merge(UploadPart(upload_id=upload_id, part_number=part_number, etag=etag, size=size))
+            db.commit()
+
+    def _parts(self, upload_id: str) -> list:
+        with self.session_factory() as db:
+            rows = (
+                db.query(UploadPart.part_number, UploadPart.etag)
+                .filter(UploadPart.upload_id == upload_id)
+                .order_by(UploadPart.part_number)
+                .all()
+            )
+            return [{"PartNumber": number, "ETag": etag} for number, etag in rows]
+
+    def _set_status(self, upload_id: str, status: str, file_id: Optional[str] = None) -> UploadSession:
+        with self.session_factory() as db:
+            session = db.get(UploadSession, upload_id)
+            if session is None:
+                raise UploadNotFound(upload_id)
+            session.status = status
+            session.updated_at = time.time()
+            if file_id is not None:
+                session.file_id = file_id
+            if status != UPLOADING:
+                db.query(UploadPart).filter(UploadPart.upload_id == upload_id).delete()
+            db.commit()
+            return session
+
+    def _delete(self, upload_ids: list) -> None:
+        with self.session_factory() as db:
+            db.query(UploadPart).filter(UploadPart.upload_id.in_(upload_ids)).delete()
+            db.query(UploadSession).filter(UploadSession.upload_id.in_(upload_ids)).delete()
+            db.commit()
+
+    def _expired(self, cutoff: float) -> list:
+        init_db()
+        with self.session_factory() as db:
+            return db.query(UploadSession).filter(UploadSession.updated_at < cutoff).all()
+
+    def _live_multipart_ids(self) -> set:
+        with self.session_factory() as db:
+            rows = db.query(UploadSession.multipart_id).filter(UploadSession.status == UPLOADING).all()
+            return {multipart_id for multipart_id, in rows}
+
+    async def create(self, storage: Any, owner: str, s3_key: str, filename: str, content_type: str, length: int) -> UploadSession:
+        """Open an S3 multipart upload and a session tracking it"""
+        created = await storage.create_multipart_upload(Key=s3_key, ContentType=content_type)
+        now = time.time()
+        session = UploadSession(
+            upload_id=secrets.token_urlsafe(16),
+            owner=owner,
+            s3_key=s3_key,
+            filename=filename,
+            content_type=content_type,
+            length=length,
+            part_size=self.part_size or part_size_for(length),
+            offset=0,
+            multipart_id=created['UploadId'],
+            status=UPLOADING,
+            created_at=now,
+            updated_at=now,
+        )
+        try:
+            await run_in_threadpool(self._insert, session)
+        except Exception:
+            await self._abort_multipart(storage, s3_key, session.multipart_id)
+            raise
+        return session
+
+    async def get(self, upload_id: str, owner: str) -> UploadSession:
+        return await run_in_threadpool(self._get, upload_id, owner)
+
+    async def append(self, storage: Any, upload_id: str, owner: str, offset: int, chunks: AsyncIterator[bytes]) -> UploadSession:
+        """Write a PATCH body starting at `offset`; completes the object once all bytes are in.
+
+        One part uploads while the next is read from the client. On any error,
+        including a disconnect, the part already in flight is still committed.
+        Raises UnalignedChunk when a non-final body isn't a whole number of
+        parts; the whole parts before its tail are kept.
+        """
+        async with self._lock(upload_id):
+            session = await run_in_threadpool(self._get, upload_id, owner)
+            if session.complete:
+                if offset != session.length:
+                    raise OffsetMismatch(session.length)
+                return session
+            if offset != session.offset:
+                raise OffsetMismatch(session.offset)
+
+            part_size = session.part_size
+            base = session.offset  # where `buffer` starts in the file
+            buffer = bytearray()
+            pending: Optional[asyncio.Future] = None
+
+            async def send(body: bytes) -> None:
+                nonlocal pending, base
+                if pending is not None:
+                    await pending
+                pending = asyncio.ensure_future(self._send_part(storage, session, base, bytes(body)))
+                base += len(body)
+
+            try:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    if base + len(buffer) + len(chunk) > session.length:
+                        raise UploadOverflow(f"Body runs past the declared length of {session.length} bytes")
+                    buffer.extend(chunk)
+                    while len(buffer) >= part_size:
+                        await send(buffer[:part_size])
+                        del buffer[:part_size]
+                if buffer and base + len(buffer) == session.length:
+                    await send(buffer)
+                    buffer.clear()
+                if pending is not None:
+                    await pending
+            except BaseException:
+                if pending is not None:
+                    await asyncio.gather(pending, return_exceptions=True)
+                raise
+
+            if base == session.length:
+                return await self._complete(storage, session)
+            if buffer:
+                raise UnalignedChunk(base, part_size, len(buffer))
+            return await run_in_threadpool(self._get, upload_id, owner)
+
+    async def _send_part(self, storage: Any, session: UploadSession, start: int, body: bytes) -> None:
+        part_number = start // session.part_size + 1
+        result = await storage.upload_part(
+            Key=session.s3_key,
+            UploadId=session.multipart_id,
+            PartNumber=part_number,
+            Body=body,
+        )
+        uploaded_bytes.inc(len(body))
+        await run_in_threadpool(self._commit_part, session.upload_id, start, part_number, result['ETag'], len(body))
+        self.parts_uploaded += 1
+
+    async def _complete(self, storage: Any, session: UploadSession) -> UploadSession:
+        parts = await run_in_threadpool(self._parts, session.upload_id)
+        await storage.complete_multipart_upload(
+            Key=session.s3_key,
+            UploadId=session.multipart_id,
+            MultipartUpload={"Parts": parts},
+        )
+        self.completed += 1
+        logger.info(f"Resumable upload complete for {session.s3_key}: {len(parts)} parts, {session.length} bytes")
+        return await run_in_threadpool(self._set_status, session.upload_id, STORED)
+
+    async def mark_registered(self, upload_id: str, file_id: str) -> UploadSession:
+        """Remember the MantaHQ id so a retried final PATCH gets the same answer"""
+        return await run_in_threadpool(self._set_status, upload_id, REGISTERED, file_id)
+
+    async def abort(self, storage: Any, upload_id: str, owner: str) -> None:
+        """Cancel an upload, discarding its stored parts"""
+        async with self._lock(upload_id):
+            session = await run_in_threadpool(self._get, upload_id, owner)
+            if not session.complete:
+                await self._abort_multipart(storage, session.s3_key, session.multipart_id)
+            await run_in_threadpool(self._delete, [upload_id])
+
+    async def _abort_multipart(self, storage: Any, s3_key: str, multipart_id: str) -> bool:
+        try:
+            await storage.abort_multipart_upload(Key=s3_key, UploadId=multipart_id)
+            self.aborted += 1
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'NoSuchUpload':
+                return False
+            raise
+
+    async def sweep(self, storage: Any, now: Optional[float] = None) -> dict:
+        """Drop stale sessions and abort multipart uploads nobody will finish"""
+        cutoff = (now or time.time()) - self.ttl
+        expired = await run_in_threadpool(self._expired, cutoff)
+        targets = {s.multipart_id: s.s3_key for s in expired if not s.complete}
+
+        if self.sweep_orphans:
+            live = await run_in_threadpool(self._live_multipart_ids)
+            for upload in await storage.list_multipart_uploads():
+                initiated = upload.get('Initiated')
+                if upload['UploadId'] not in live and initiated is not None and initiated.timestamp() < cutoff:
+                    targets.setdefault(upload['UploadId'], upload['Key'])
+
+        outcomes = await asyncio.gather(
+            *(self._abort_multipart(storage, key, multipart_id) for multipart_id, key in targets.items()),
+            return_exceptions=True,
+        )
+        for (multipart_id, key), outcome in zip(targets.items(), outcomes):
+            if isinstance(outcome, BaseException):
+                logger.error(f"Failed to abort multipart upload {multipart_id} for {key}: {outcome}")
+        if expired:
+            await run_in_threadpool(self._delete, [s.upload_id for s in expired])
+        aborted = sum(1 for outcome in outcomes if outcome is True)
+        if expired or aborted:
+            logger.info(f"Upload janitor removed {len(expired)} sessions and aborted {aborted} multipart uploads")
+        return {"sessions": len(expired), "aborted": aborted}
+
+    async def run_janitor(self, storage: Any, interval: float = RESUMABLE_JANITOR_INTERVAL) -> None:
+        """Sweep forever (cancel to stop)"""
+        while True:
+            await asyncio.sleep(interval)
+            if not storage.available:
+                continue
+            try:
+                await self.sweep(storage)
+            except Exception as e:
+                logger.error(f"Upload janitor sweep failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "parts_uploaded": self.parts_uploaded,
+            "completed": self.completed,
+            "aborted": self.aborted,
+        }
+
+
+resumable_uploads = ResumableUploads()
@@ -0,0 +1,217 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+from metrics import s3_latency
+from tracing import record
+
+logger = logging.getLogger(__name__)
+
+AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
+S3_BUCKET_NAME = os.getenv('S3_BUCKET_NAME', 'mantadrive-users')
+# Point at a local S3 stand-in (moto server, minio) for testing
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL') or None
+
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS', '50'))
+S3_EXECUTOR_WORKERS = int(os.getenv('S3_EXECUTOR_WORKERS', str(S3_MAX_POOL_CONNECTIONS)))
+S3_MAX_ATTEMPTS = int(os.getenv('S3_MAX_ATTEMPTS', '5'))
+S3_CONNECT_TIMEOUT = float(os.getenv('S3_CONNECT_TIMEOUT', '5'))
+S3_READ_TIMEOUT = float(os.getenv('S3_READ_TIMEOUT', '60'))
+# DeleteObjects accepts at most 1000 keys per request
+DELETE_OBJECTS_BATCH_SIZE = 1000
+
+# Settings for managed downloads (thumbnail source reads)
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=int(os.getenv('S3_MULTIPART_THRESHOLD', str(8 * 1024 * 1024))),
+    multipart_chunksize=int(os.getenv('S3_MULTIPART_CHUNKSIZE', str(8 * 1024 * 1024))),
+    max_concurrency=int(os.getenv('S3_TRANSFER_CONCURRENCY', '4')),
+    use_threads=True,
+)
+
+
+def client_config() -> Config:
+    """botocore settings shared by every S3 client we create"""
+    return Config(
+        region_name=AWS_REGION,
+        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+        retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": "adaptive"},
+        connect_timeout=S3_CONNECT_TIMEOUT,
+        read_timeout=S3_READ_TIMEOUT,
+    )
+
+
+def create_s3_client(
+    access_key: Optional[str] = None,
+    secret_key: Optional[str] = None,
+    region: Optional[str] = None,
+    endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+):
+    """Create a tuned boto3 S3 client (credentials default to the environment)"""
+    return boto3.client(
+        's3',
+        aws_access_key_id=access_key or os.getenv('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=secret_key or os.getenv('AWS_SECRET_ACCESS_KEY'),
+        region_name=region or AWS_REGION,
+        endpoint_url=endpoint_url,
+        config=client_config(),
+    )
+
+
+class S3Storage:
+    """Async facade over a boto3 client that runs calls in a bounded thread pool"""
+
+    def __init__(self, client: Any = None, bucket: str = S3_BUCKET_NAME, max_workers: int = S3_EXECUTOR_WORKERS):
+        self.client = client
+        self.bucket = bucket
+        self.region = AWS_REGION
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None
+
+    def configure(self, client: Any, bucket: Optional[str] = None, region: Optional[str] = None) -> None:
+        """Swap in a new client (e.g. from /configure-s3)"""
+        self.client = client
+        if bucket:
+            self.bucket = bucket
+        if region:
+            self.region = region
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="s3")
+        return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a blocking call in the S3 thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(fn, *args, **kwargs))
+
+    async def timed(self, operation: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """run(), recording the latency under `operation` in the S3 histogram and request trace"""
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await self.run(fn, *args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            s3_latency.labels(operation, outcome).observe(elapsed)
+            record(f"s3.{operation}", start, elapsed)
+
+    async def call(self, operation: str, **params: Any) -> Any:
+        """Invoke a bucket-scoped client operation off the event loop"""
+        params.setdefault('Bucket', self.bucket)
+        return await self.timed(operation, getattr(self.client, operation), **params)
+
+    async def head_bucket(self) -> Any:
+        return await self.call('head_bucket')
+
+    async def put_object(self, **params: Any) -> Any:
+        return await self.call('put_object', **params)
+
+    async def get_object(self, **params: Any) -> Any:
+        return await self.call('get_object', **params)
+
+    async def head_object(self, **params: Any) -> Any:
+        return await self.call('head_object', **params)
+
+    async def delete_object(self, **params: Any) -> Any:
+        return await self.call('delete_object', **params)
+
+    async def delete_objects(self, keys: list) -> dict:
+        """Delete keys with DeleteObjects (1000 per call); returns {key: error} for failures"""
+        async def delete_chunk(chunk: list) -> list:
+            response = await self.call(
+                'delete_objects',
+                Delete={'Objects': [{'Key': key} for key in chunk], 'Quiet': True},
+            )
+            return response.get('Errors', [])
+
+        chunks = [keys[i:i + DELETE_OBJECTS_BATCH_SIZE] for i in range(0, len(keys), DELETE_OBJECTS_BATCH_SIZE)]
+        failed = {}
+        for chunk, outcome in zip(chunks, await asyncio.gather(*(delete_chunk(c) for c in chunks), return_exceptions=True)):
+            if isinstance(outcome, BaseException):
+                failed.update({key: str(outcome) for key in chunk})
+            else:
+                failed.update({error['Key']: error.get('Message') or error.get('Code', 'Unknown') for error in outcome})
+        return failed
+
+    async def create_multipart_upload(self, **params: Any) -> Any:
+        return await self.call('create_multipart_upload', **params)
+
+    async def upload_part(self, **params: Any) -> Any:
+        return await self.call('upload_part', **params)
+
+    async def complete_multipart_upload(self, **params: Any) -> Any:
+        return await self.call('complete_multipart_upload', **params)
+
+    async def abort_multipart_upload(self, **params: Any) -> Any:
+        return await self.call('abort_multipart_upload', **params)
+
+    async def list_multipart_uploads(self, prefix: str = '') -> list:
+        """Every in-progress multipart upload under prefix, following pagination"""
+        def list_all():
+            uploads = []
+            params = {'Bucket': self.bucket, 'Prefix': prefix}
+            while True:
+                response = self.client.list_multipart_uploads(**params)
+                uploads.extend(response.get('Uploads', []))
+                if not response.get('IsTruncated'):
+                    return uploads
+                params['KeyMarker'] = response.get('NextKeyMarker')
+                params['UploadIdMarker'] = response.get('NextUploadIdMarker')
+        return await self.timed('list_multipart_uploads', list_all)
+
+    async def download_fileobj(self, key: str, fileobj: Any) -> None:
+        """Managed (parallel ranged) download using the shared TransferConfig"""
+        await self.timed('download_fileobj', self.client.download_fileobj, self.bucket, key, fileobj, Config=TRANSFER_CONFIG)
+
+    async def generate_presigned_url(self, operation: str, expires_in: int = 3600, **params: Any) -> str:
+        params.setdefault('Bucket', self.bucket)
+        return await self.run(self.client.generate_presigned_url, operation, Params=params, ExpiresIn=expires_in)
+
+    async def generate_presigned_post(self, key: str, conditions: Optional[list] = None, fields: Optional[dict] = None, expires_in: int = 3600) -> dict:
+        return await self.run(
+            self.client.generate_presigned_post,
+            self.bucket,
+            key,
+            Fields=fields,
+            Conditions=conditions,
+            ExpiresIn=expires_in,
+        )
+
+    async def presign_parts(self, key: str, upload_id: str, part_count: int, expires_in: int = 3600) -> list:
+        """Presigned upload_part URLs for parts 1..part_count, signed in one pool hop"""
+        def sign_all():
+            return [
+                self.client.generate_presigned_url(
+                    'upload_part',
+                    Params={'Bucket': self.bucket, 'Key': key, 'UploadId': upload_id, 'PartNumber': number},
+                    ExpiresIn=expires_in,
+                )
+                for number in range(1, part_count + 1)
+            ]
+        return await self.run(sign_all)
+
+    def object_url(self, key: str) -> str:
+        """Public-style URL recorded with MantaHQ for an object"""
+        if S3_ENDPOINT_URL:
+            return f"{S3_ENDPOINT_URL.rstrip('/')}/{self.bucket}/{key}"
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{key}"
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
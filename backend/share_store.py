@@ -0,0 +1,200 @@
+import logging
+import re
+import secrets
+import time
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from passlib.hash import pbkdf2_sha256
+from sqlalchemy import BigInteger, Column, Float, Integer, String, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from database import Base, SessionLocal, init_db
+
+logger = logging.getLogger(__name__)
+
+# Accepts "7d", "24h", "30m" or a bare number of hours
+EXPIRY_PATTERN = re.compile(r'^\s*(\d+)\s*([dhm]?)\s*$')
+EXPIRY_UNITS = {'d': 86400, 'h': 3600, 'm': 60, '': 3600}
+# Longer expiries are refused; leave it empty for a share that never expires
+MAX_EXPIRY_SECONDS = 10 * 365 * 86400
+# Access ids are short, so a collision is unlikely but not impossible
+ACCESS_ID_ATTEMPTS = 5
+
+
+class Share(Base):
+    __tablename__ = "shares"
+
+    access_id = Column(String(32), primary_key=True)
+    kind = Column(String(16), nullable=False, default="anonymous")
+    file_id = Column(String(128), nullable=False)
+    owner = Column(String(255), index=True)
+    s3_key = Column(String(1024), nullable=False)
+    filename = Column(String(1024))
+    size = Column(BigInteger, default=0)
+    content_type = Column(String(255))
+    access_key_hash = Column(String(255))
+    password_hash = Column(String(255))
+    expires_at = Column(Float, index=True)
+    max_downloads = Column(Integer)
+    download_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(Float, nullable=False)
+
+    @property
+    def requires_key(self) -> bool:
+        return self.access_key_hash is not None
+
+    @property
+    def requires_password(self) -> bool:
+        return self.password_hash is not None
+
+
+class ShareNotFound(Exception):
+    """No share with that access id"""
+
+
+class ShareSecretRequired(Exception):
+    """The share is protected and the caller supplied no secret"""
+
+    def __init__(self, share: Share):
+        super().__init__("Access key or password required")
+        self.share = share
+
+
+class ShareForbidden(Exception):
+    """The supplied access key or password is wrong"""
+
+
+class ShareGone(Exception):
+    """The share expired or used up its downloads"""
+
+
+def parse_expiry(expires_in) -> Optional[int]:
+    """Seconds until expiry for "7d" / "24h" / "30m" / hours as a number; None never expires"""
+    if expires_in is None or expires_in == "":
+        return None
+    if isinstance(expires_in, (int, float)):
+        seconds = int(expires_in * 3600) if expires_in > 0 else None
+    else:
+        match = EXPIRY_PATTERN.match(str(expires_in))
+        if not match:
+            raise ValueError(f"Invalid expiry: {expires_in}")
+        amount, unit = match.groups()
+        seconds = int(amount) * EXPIRY_UNITS[unit] or None
+    if seconds is not None and seconds > MAX_EXPIRY_SECONDS:
+        raise ValueError(f"Expiry is too far in the future: {expires_in}")
+    return seconds
+
+
+def _hash(secret: Optional[str]) -> Optional[str]:
+    return pbkdf2_sha256.hash(secret) if secret else None
+
+
+def _verify(secret: Optional[str], hashed: Optional[str]) -> bool:
+    if hashed is None:
+        return True
+    return bool(secret) and pbkdf2_sha256.verify(secret, hashed)
+
+
+class ShareStore:
+    """Share links persisted with SQLAlchemy; blocking work runs in the threadpool"""
+
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+
+    def _create(self, **fields) -> Share:
+        init_db()
+        fields.update(
+            access_key_hash=_hash(fields.pop('access_key', None)),
+            password_hash=_hash(fields.pop('password', None)),
+            download_count=0,
+            created_at=time.time(),
+        )
+        for attempt in range(1, ACCESS_ID_ATTEMPTS + 1):
+            share = Share(access_id=secrets.token_urlsafe(6), **fields)
+            with self.session_factory() as session:
+                session.add(share)
+                try:
+                    session.commit()
+                except IntegrityError:
+                    session.rollback()
+                    if attempt == ACCESS_ID_ATTEMPTS:
+                        raise
+                    logger.warning(f"Share access id {share.access_id} already taken; drawing another")
+                    continue
+            return share
+
+    def _open(self, access_id: str, access_key: Optional[str], password: Optional[str]) -> Share:
+        init_db()
+        with self.session_factory() as session:
+            share = session.get(Share, access_id)
+            if share is None:
+                raise ShareNotFound(access_id)
+            if (share.requires_key and not access_key) or (share.requires_password and not password):
+                raise ShareSecretRequired(share)
+            if not (_verify(access_key, share.access_key_hash) and _verify(password, share.password_hash)):
+                raise ShareForbidden(access_id)
+
+            # Count the download only while the share is still live, in one statement
+            now = time.time()
+            result = session.execute(
+                update(Share)
+                .where(
+                    Share.access_id == access_id,
+                    or_(Share.max_downloads.is_(None), Share.download_count < Share.max_downloads),
+                    or_(Share.expires_at.is_(None), Share.expires_at > now),
+                )
+                .values(download_count=Share.download_count + 1)
+            )
+            session.commit()
+            if result.rowcount == 0:
+                raise ShareGone(access_id)
+            return share
+
+    def _delete_for_files(self, owner: str, file_ids: list) -> int:
+        init_db()
+        with self.session_factory() as session:
+            deleted = session.query(Share).filter(Share.owner == owner, Share.file_id.in_(file_ids)).delete(synchronize_session=False)
+            session.commit()
+            return deleted
+
+    async def create(
+        self,
+        kind: str,
+        file_id: str,
+        owner: Optional[str],
+        file_data: dict,
+        access_key: Optional[str] = None,
+        password: Optional[str] = None,
+        expires_in_seconds: Optional[int] = None,
+        max_downloads: Optional[int] = None,
+    ) -> Share:
+        """Persist a share for a resolved MantaHQ file record"""
+        s3_key = file_data.get('s3_key')
+        return await run_in_threadpool(
+            self._create,
+            kind=kind,
+            file_id=str(file_id),
+            owner=owner,
+            s3_key=s3_key,
+            filename=file_data.get('filename') or s3_key.split('/')[-1],
+            size=file_data.get('size', 0),
+            content_type=file_data.get('content_type', 'application/octet-stream'),
+            access_key=access_key,
+            password=password,
+            expires_at=time.time() + expires_in_seconds if expires_in_seconds else None,
+            max_downloads=max_downloads,
+        )
+
+    async def open(self, access_id: str, access_key: Optional[str] = None, password: Optional[str] = None) -> Share:
+        """Check secrets and count one download; raises ShareNotFound/SecretRequired/Forbidden/Gone"""
+        return await run_in_threadpool(self._open, access_id, access_key, password)
+
+    async def delete_for_files(self, owner: str, file_ids: list) -> int:
+        """Drop shares pointing at deleted files"""
+        if not file_ids:
+            return 0
+        return await run_in_threadpool(self._delete_for_files, owner, [str(f) for f in file_ids])
+
+
+share_store = ShareStore()
@@ -0,0 +1,80 @@
+import httpx
+from fastapi.testclient import TestClient
+
+from aggregates import AggregatesStore, UserAggregates
+from conftest import make_token
+from main import app
+
+client = TestClient(app)
+HEADERS = {"Authorization": f"Bearer {make_token('alice')}"}
+
+# 2024-01-02 (a Tuesday) 14:00 UTC and 2024-01-03 09:00 UTC, in milliseconds
+TUESDAY_2PM = "1704204000000"
+WEDNESDAY_9AM = "1704272400000"
+
+
+def record(file_id, size, category="documents", created_at=TUESDAY_2PM):
+    return {"id": file_id, "name": f"{file_id}.bin", "size": size, "category": category, "created_at": created_at}
+
+
+def test_add_and_remove_keep_totals_exact():
+    stats = UserAggregates()
+    stats.add(record("1", 50))
+    stats.add(record("2", 5 * 1024 * 1024, "videos", WEDNESDAY_9AM))
+    stats.add(record("3", 2 * 1024 * 1024 * 1024, "videos"))
+    stats.remove("2")
+
+    summary = stats.snapshot(top_n=2)
+    assert summary["total_files"] == 2
+    assert summary["bytes_by_category"] == {"documents": 50, "videos": 2 * 1024 * 1024 * 1024}
+    assert summary["size_histogram"]["<100KB"] == 1 and summary["size_histogram"]["1MB-10MB"] == 0
+    assert [f["id"] for f in summary["largest_files"]] == ["3", "1"]
+    assert summary["peak_upload_hour"] == 14
+    assert summary["most_active_day"] == "Tuesday"
+
+
+def test_readding_a_file_replaces_it():
+    stats = UserAggregates()
+    stats.add(record("1", 10))
+    stats.add(record("1", 30))
+    assert stats.snapshot()["total_bytes"] == 30
+
+
+def test_updates_are_ignored_until_rebuilt():
+    store = AggregatesStore()
+    store.add("alice", record("1", 10))
+    assert store.get("alice") is None
+    store.rebuild("alice", [record("1", 10)])
+    store.add("alice", record("2", 20))
+    assert store.get("alice").snapshot()["total_bytes"] == 30
+
+
+def test_insights_rebuild_once_then_follow_deletes(manta_stub, monkeypatch):
+    import main
+
+    class NullStorage:
+        available = True
+
+        async def delete_object(self, **params):
+            return {}
+
+    monkeypatch.setattr(main, "storage", NullStorage())
+    listing = {"data": [
+        {"id": "1", "s3_key": "user-alice/images/a.png", "size": 100, "created_at": TUESDAY_2PM},
+        {"id": "2", "s3_key": "user-alice/videos/b.mp4", "size": 900, "created_at": TUESDAY_2PM},
+    ]}
+    manta_stub.route("GET", "/filemanagement", httpx.Response(200, json=listing))
+    manta_stub.route("GET", "/filemanagement/2", httpx.Response(200, json=listing["data"][1]))
+    manta_stub.route("DELETE", "/filemanagement/2", httpx.Response(200, json={}))
+
+    first = client.post("/ai/smart-insights", headers=HEADERS).json()["insights"]
+    assert first["total_bytes"] == 1000
+    assert first["storage_optimization"]["large_files"] == ["b.mp4", "a.png"]
+
+    client.delete("/files/2", headers=HEADERS)
+    main.file_cache.clear()
+    second = client.post("/ai/smart-insights", headers=HEADERS).json()["insights"]
+
+    assert second["total_bytes"] == 100
+    assert second["usage_patterns"]["file_type_distribution"] == {"images": 100}
+    assert manta_stub.count("GET", "/filemanagement") == 1
@@ -0,0 +1,62 @@
+import time
+
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+
+import auth
+from auth import ClaimsCache, authenticate, claims_cache
+from conftest import make_token
+from main import app
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    claims_cache.clear()
+    yield
+    claims_cache.clear()
+
+
+def test_claims_are_decoded_once_per_token(monkeypatch):
+    decodes = []
+    real_decode = auth.decode_claims
+    monkeypatch.setattr(auth, "decode_claims", lambda token: decodes.append(token) or real_decode(token))
+    token = make_token("alice")
+
+    for _ in range(3):
+        assert authenticate(token).username == "alice"
+
+    assert len(decodes) == 1
+
+
+def test_cached_claims_do_not_outlive_exp():
+    cache = ClaimsCache(ttl=300)
+    cache.put("t", {"username": "alice", "exp": time.time() - 1})
+    assert cache.get("t") is None
+
+
+def test_cache_is_bounded():
+    cache = ClaimsCache(max_entries=2)
+    for token in ("a", "b", "c"):
+        cache.put(token, {"username": token})
+    assert cache.get("a") is None
+    assert cache.get("c") == {"username": "c"}
+
+
+def test_missing_expired_and_garbage_tokens_are_401():
+    expired = jwt.encode({"username": "alice", "exp": int(time.time()) - 10}, "test-secret", algorithm="HS256")
+
+    assert client.get("/download/1").json()["detail"] == "Authorization header required"
+    assert client.get("/download/1", headers={"Authorization": f"Bearer {expired}"}).json()["detail"] == "Token has expired"
+    assert client.get("/download/1", headers={"Authorization": "Bearer not-a-jwt"}).status_code == 401
+
+
+def test_signature_is_checked_when_secret_configured(monkeypatch):
+    monkeypatch.setattr(auth, "JWT_SECRET", "test-secret")
+    assert authenticate(make_token("alice")).username == "alice"
+
+    forged = jwt.encode({"username": "mallory"}, "other-secret", algorithm="HS256")
+    with pytest.raises(jwt.exceptions.InvalidSignatureError):
+        authenticate(forged)
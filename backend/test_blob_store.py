@@ -0,0 +1,97 @@
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import BUCKET, drain_outbox, make_token
+from main import app
+
+client = TestClient(app)
+HEADERS = {"Authorization": f"Bearer {make_token('alice')}"}
+
+
+def stored_keys(s3):
+    return [o["Key"] for o in s3.list_objects_v2(Bucket=BUCKET).get("Contents", [])]
+
+
+@pytest.fixture
+def registry(manta_stub):
+    records = {}
+
+    def register(request):
+        body = json.loads(request.content)
+        file_id = str(len(records) + 1)
+        records[file_id] = {**body, "id": file_id}
+        manta_stub.route("GET", f"/filemanagement/{file_id}", httpx.Response(200, json=records[file_id]))
+        manta_stub.route("DELETE", f"/filemanagement/{file_id}", httpx.Response(200, json={}))
+        return httpx.Response(200, json={"id": file_id})
+
+    manta_stub.route("POST", "/filemanagement", register)
+    manta_stub.route("GET", "/filemanagement", lambda request: httpx.Response(200, json={"data": list(records.values())}))
+    return records
+
+
+def upload(name, content):
+    return client.post("/upload", files={"file": (name, content, "text/plain")}, headers=HEADERS).json()
+
+
+def test_identical_uploads_share_one_blob(s3, registry):
+    first = upload("a.txt", b"same bytes")
+    second = upload("copy-of-a.txt", b"same bytes")
+
+    assert first["deduplicated"] is False and second["deduplicated"] is True
+    assert len(stored_keys(s3)) == 1
+    # MantaHQ keeps the logical names
+    assert {r["s3_key"] for r in registry.values()} == {"user-alice/others/a.txt", "user-alice/others/copy-of-a.txt"}
+
+    insights = client.post("/ai/smart-insights", headers=HEADERS).json()["insights"]["storage_optimization"]
+    assert insights["duplicate_files"] == 1
+    assert insights["bytes_saved"] == len(b"same bytes")
+
+
+def test_blob_outlives_all_but_last_reference(s3, registry):
+    upload("a.txt", b"shared")
+    upload("b.txt", b"shared")
+    blob_key, = stored_keys(s3)
+
+    download = client.get("/download/2", headers=HEADERS).json()
+    assert blob_key in download["download_url"]
+
+    assert client.delete("/files/1", headers=HEADERS).status_code == 200
+    drain_outbox()
+    assert stored_keys(s3) == [blob_key]
+    assert client.delete("/files/2", headers=HEADERS).status_code == 200
+    drain_outbox()
+    assert stored_keys(s3) == []
+
+
+def test_reupload_with_new_content_releases_old_blob(s3, registry):
+    upload("a.txt", b"version one")
+    upload("a.txt", b"version two")
+    drain_outbox()
+
+    keys = stored_keys(s3)
+    assert len(keys) == 1
+    assert s3.get_object(Bucket=BUCKET, Key=keys[0])["Body"].read() == b"version two"
+
+
+def test_released_blob_referenced_again_before_cleanup_is_kept(s3, registry):
+    upload("a.txt", b"version one")
+    upload("a.txt", b"version two")
+    # The old content comes back under another name before the outbox runs
+    upload("b.txt", b"version one")
+    drain_outbox()
+
+    assert len(stored_keys(s3)) == 2
+    assert client.get("/download/3", headers=HEADERS).status_code == 200
+
+
+def test_bucket_scope_does_not_report_deduplication(s3, registry, monkeypatch):
+    from main import blob_store
+    monkeypatch.setattr(blob_store, "scope", "bucket")
+
+    assert "deduplicated" not in upload("a.txt", b"anyone's bytes")
+    batch = client.post("/upload/batch", files=[("files", ("b.txt", b"anyone's bytes", "text/plain"))], headers=HEADERS).json()
+    result, = batch["results"]
+    assert result["success"] and "deduplicated" not in result
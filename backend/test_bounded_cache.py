@@ -0,0 +1,47 @@
+from bounded_cache import BoundedCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_entry_is_evicted():
+    discarded = []
+    cache = BoundedCache(max_entries=2, on_discard=discarded.append)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.peek("b") is None and discarded == ["b"]
+    assert cache.evictions == 1 and len(cache) == 2
+
+
+def test_entries_expire_by_ttl_or_explicit_deadline():
+    clock = Clock()
+    discarded = []
+    cache = BoundedCache(max_entries=10, ttl=30, clock=clock, on_discard=discarded.append)
+    cache.set("ttl", "x")
+    cache.set("deadline", "y", expires_at=clock.now + 5)
+
+    clock.now += 10
+    assert cache.get("deadline") is None and cache.get("ttl") == "x"
+    clock.now += 30
+    assert cache.get("ttl") is None
+    assert discarded == ["deadline", "ttl"]
+
+
+def test_stats_count_lookups():
+    cache = BoundedCache(max_entries=10)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("missing")
+    cache.peek("a")
+    cache.count(False)
+
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 2, "hit_ratio": 0.3333}
+    assert cache.pop("a") == 1 and cache.pop("a") is None
@@ -0,0 +1,67 @@
+import httpx
+from fastapi.testclient import TestClient
+
+import main
+from conftest import BUCKET, drain_outbox, make_token
+from main import app
+
+client = TestClient(app)
+
+
+def test_delete_objects_chunks_over_1000_keys(s3):
+    import asyncio
+
+    keys = [f"user-alice/others/{i}.txt" for i in range(1005)]
+    for key in keys:
+        s3.put_object(Bucket=BUCKET, Key=key, Body=b"x")
+    failed = asyncio.run(main.storage.delete_objects(keys))
+    assert failed == {}
+    assert s3.list_objects_v2(Bucket=BUCKET).get("KeyCount") == 0
+
+
+def test_batch_delete_reports_each_id(s3, manta_stub):
+    listing = {"data": [
+        {"id": "1", "s3_key": "user-alice/documents/a.pdf"},
+        {"id": "2", "s3_key": "user-alice/images/b.png"},
+        {"id": "3", "s3_key": "user-bob/images/c.png"},
+    ]}
+    for record in listing["data"]:
+        s3.put_object(Bucket=BUCKET, Key=record["s3_key"], Body=b"x")
+    manta_stub.route("GET", "/filemanagement", httpx.Response(200, json=listing))
+    manta_stub.route("DELETE", "/filemanagement/1", httpx.Response(200, json={}))
+    manta_stub.route("DELETE", "/filemanagement/2", httpx.Response(500, json={}))
+
+    response = client.post(
+        "/files/delete-batch",
+        json={"file_ids": ["1", "2", "3", "missing"]},
+        headers={"Authorization": f"Bearer {make_token('alice')}"},
+    ).json()
+
+    statuses = {r["file_id"]: r["status"] for r in response["results"]}
+    # A MantaHQ 500 is retried from the outbox, so that delete is committed too
+    assert statuses == {"1": "deleted", "2": "queued", "3": "not_found", "missing": "not_found"}
+    assert response["deleted"] == 2 and response["queued"] == 1
+    drain_outbox()
+    remaining = [o["Key"] for o in s3.list_objects_v2(Bucket=BUCKET)["Contents"]]
+    assert remaining == ["user-bob/images/c.png"]
+    # One listing fetch resolves every id
+    assert manta_stub.count("GET", "/filemanagement") == 1
+
+
+def test_complete_but_stale_index_looks_up_misses(s3, manta_stub):
+    headers = {"Authorization": f"Bearer {make_token('alice')}"}
+    manta_stub.route("GET", "/filemanagement", httpx.Response(200, json={"data": [
+        {"id": "1", "s3_key": "user-alice/documents/a.pdf"},
+    ]}))
+    client.get("/files", params={"username": "alice"}, headers=headers)
+    # Registered through another worker after the listing was indexed
+    s3.put_object(Bucket=BUCKET, Key="user-alice/images/new.png", Body=b"x")
+    manta_stub.route("GET", "/filemanagement/2", httpx.Response(200, json={"id": "2", "s3_key": "user-alice/images/new.png"}))
+    manta_stub.route("GET", "/filemanagement/3", httpx.Response(200, json={"id": "3", "s3_key": "user-bob/images/c.png"}))
+    manta_stub.route("DELETE", "/filemanagement/2", httpx.Response(200, json={}))
+
+    response = client.post("/files/delete-batch", json={"file_ids": ["2", "3", "missing"]}, headers=headers).json()
+
+    statuses = {r["file_id"]: r["status"] for r in response["results"]}
+    assert statuses == {"2": "deleted", "3": "not_found", "missing": "not_found"}
+    assert manta_stub.count("GET", "/filemanagement") == 1
@@ -0,0 +1,91 @@
+import os
+
+import httpx
+from fastapi.testclient import TestClient
+
+from conftest import BUCKET, drain_outbox, make_token
+from main import app
+from multipart_upload import S3_UPLOAD_PART_SIZE
+
+client = TestClient(app)
+
+
+def test_single_part_direct_upload(s3, manta_stub):
+    manta_stub.route("POST", "/filemanagement", httpx.Response(200, json={"id": "f1"}))
+    headers = {"Authorization": f"Bearer {make_token('alice')}"}
+
+    plan = client.post("/upload/initiate", json={"filename": "cat.png", "content_type": "image/png", "size": 3}, headers=headers).json()
+    assert plan["mode"] == "single" and plan["s3_key"] == "user-alice/images/cat.png"
+
+    # Stand-in for the browser PUT to the presigned URL
+    s3.put_object(Bucket=BUCKET, Key=plan["s3_key"], Body=b"abc", ContentType="image/png")
+    done = client.post("/upload/complete", json={"s3_key": plan["s3_key"]}, headers=headers)
+
+    assert done.status_code == 200
+    assert done.json()["file_id"] == "f1" and done.json()["size"] == 3
+
+
+def test_multipart_direct_upload(s3, manta_stub):
+    manta_stub.route("POST", "/filemanagement", httpx.Response(200, json={"id": "f2"}))
+    headers = {"Authorization": f"Bearer {make_token('alice')}"}
+    size = S3_UPLOAD_PART_SIZE + 1024
+
+    plan = client.post(
+        "/upload/initiate",
+        json={"filename": "clip.mp4", "content_type": "video/mp4", "size": size, "multipart": True},
+        headers=headers,
+    ).json()
+    assert plan["mode"] == "multipart" and len(plan["parts"]) == 2
+
+    data = os.urandom(size)
+    parts = []
+    for part in plan["parts"]:
+        start = (part["part_number"] - 1) * plan["part_size"]
+        body = data[start:start + plan["part_size"]]
+        etag = s3.upload_part(Bucket=BUCKET, Key=plan["s3_key"], UploadId=plan["upload_id"],
+                              PartNumber=part["part_number"], Body=body)["ETag"]
+        parts.append({"part_number": part["part_number"], "etag": etag})
+
+    done = client.post("/upload/complete", json={"s3_key": plan["s3_key"], "upload_id": plan["upload_id"], "parts": parts}, headers=headers)
+    assert done.status_code == 200
+    assert done.json()["size"] == size
+
+
+def test_complete_rejects_missing_or_foreign_objects(s3, manta_stub):
+    headers = {"Authorization": f"Bearer {make_token('alice')}"}
+    assert client.post("/upload/complete", json={"s3_key": "user-bob/images/x.png"}, headers=headers).status_code == 403
+    assert client.post("/upload/complete", json={"s3_key": "user-alice/images/none.png"}, headers=headers).status_code == 404
+    assert manta_stub.calls == []
+
+
+def test_failed_registration_discards_the_upload(s3, manta_stub):
+    manta_stub.route("POST", "/filemanagement", httpx.Response(503, text="unavailable"))
+    headers = {"Authorization": f"Bearer {make_token('alice')}"}
+
+    plan = client.post("/upload/initiate", json={"filename": "cat.png", "content_type": "image/png", "size": 3}, headers=headers).json()
+    s3.put_object(Bucket=BUCKET, Key=plan["s3_key"], Body=b"abc", ContentType="image/png")
+    assert client.post("/upload/complete", json={"s3_key": plan["s3_key"]}, headers=headers).status_code == 503
+
+    drain_outbox()
+    assert s3.list_objects_v2(Bucket=BUCKET).get("KeyCount") == 0
+
+
+def test_direct_upload_replaces_an_earlier_deduplicated_upload(s3, manta_stub):
+    ids = iter(["f1", "f2"])
+    manta_stub.route("POST", "/filemanagement", lambda request: httpx.Response(200, json={"id": next(ids)}))
+    manta_stub.route("DELETE", "/filemanagement/f2", httpx.Response(200, json={}))
+    headers = {"Authorization": f"Bearer {make_token('alice')}"}
+
+    client.post("/upload", files={"file": ("notes.txt", b"OLD", "text/plain")}, headers=headers)
+    plan = client.post("/upload/initiate", json={"filename": "notes.txt", "content_type": "text/plain", "size": 3}, headers=headers).json()
+    s3.put_object(Bucket=BUCKET, Key=plan["s3_key"], Body=b"NEW", ContentType="text/plain")
+    assert client.post("/upload/complete", json={"s3_key": plan["s3_key"]}, headers=headers).status_code == 200
+
+    assert client.get("/download/f2/stream", headers=headers).content == b"NEW"
+    assert "/blobs/" not in client.get("/download/f2", headers=headers).json()["download_url"]
+    drain_outbox()
+    assert [o["Key"] for o in s3.list_objects_v2(Bucket=BUCKET)["Contents"]] == [plan["s3_key"]]
+
+    client.delete("/files/f2", headers=headers)
+    drain_outbox()
+    assert s3.list_objects_v2(Bucket=BUCKET).get("KeyCount") == 0
@@ -0,0 +1,87 @@
+import httpx
+import jwt
+from fastapi.testclient import TestClient
+
+from conftest import make_token
+from file_cache import FileListCache
+from main import app
+
+client = TestClient(app)
+
+LISTING = {"data": [
+    {"id": "1", "s3_key": "user-alice/images/cat.png", "size": 10, "content_type": "image/png", "created_at": "1700000000000"},
+    {"id": "2", "s3_key": "user-alice/documents/cv.pdf", "size": 20, "content_type": "application/pdf", "created_at": "1700000001000"},
+    {"id": "3", "s3_key": "user-bob/images/dog.png", "size": 30, "content_type": "image/png", "created_at": "1700000002000"},
+]}
+
+
+def test_cache_expires_and_evicts():
+    cache = FileListCache(max_users=1, ttl=60)
+    cache.set("alice", [{"id": "1"}])
+    assert cache.get("alice") == [{"id": "1"}]
+    cache.set("bob", [])
+    assert cache.get("alice") is None
+    assert cache.stats()["evictions"] == 1
+
+    expired = FileListCache(ttl=0)
+    expired.set("alice", [])
+    assert expired.get("alice") is None
+
+
+def test_repeat_listing_and_category_switch_hit_cache(manta_stub):
+    manta_stub.route("GET", "/filemanagement", httpx.Response(200, json=LISTING))
+    headers = {"Authorization": f"Bearer {make_token()}"}
+
+    first = client.get("/files", params={"username": "alice"}, headers=headers).json()
+    images = client.get("/files", params={"username": "alice", "category": "images"}, headers=headers).json()
+
+    assert [f["id"] for f in first] == ["2", "1"]
+    assert [f["id"] for f in images] == ["1"]
+    assert manta_stub.count("GET", "/filemanagement") == 1
+
+
+def test_cannot_read_another_users_cached_listing(manta_stub):
+    manta_stub.route("GET", "/filemanagement", httpx.Response(200, json=LISTING))
+    client.get("/files", params={"username": "alice"}, headers={"Authorization": f"Bearer {make_token()}"})
+
+    mallory = {"Authorization": f"Bearer {make_token('mallory')}"}
+    assert client.get("/files", params={"username": "alice"}, headers=mallory).status_code == 403
+    assert client.get("/files", params={"username": "alice", "format": "ndjson"}, headers=mallory).status_code == 403
+
+
+def test_forged_token_is_not_served_the_cached_listing(manta_stub):
+    real = make_token()
+    forged = jwt.encode({"username": "alice", "id": "alice"}, "other-secret", algorithm="HS256")
+    # MantaHQ checks signatures; this process does not without JWT_SECRET
+    manta_stub.route("GET", "/filemanagement", lambda request: httpx.Response(
+        200 if request.headers["Authorization"] == f"Bearer {real}" else 401, json=LISTING))
+    client.get("/files", params={"username": "alice"}, headers={"Authorization": f"Bearer {real}"})
+    assert client.post("/ai/smart-insights", headers={"Authorization": f"Bearer {real}"}).json()["success"] is True
+
+    forged_headers = {"Authorization": f"Bearer {forged}"}
+    assert client.get("/files", params={"username": "alice"}, headers=forged_headers).json() == []
+    assert client.post("/ai/smart-insights", headers=forged_headers).json()["success"] is False
+    assert manta_stub.count("GET", "/filemanagement") == 3
+
+
+def test_delete_patches_cached_listing(manta_stub, monkeypatch):
+    import main
+
+    class NullStorage:
+        available = True
+
+        async def delete_object(self, **params):
+            return {}
+
+    monkeypatch.setattr(main, "storage", NullStorage())
+    manta_stub.route("GET", "/filemanagement", httpx.Response(200, json=LISTING))
+    manta_stub.route("GET", "/filemanagement/1", httpx.Response(200, json=LISTING["data"][0]))
+    manta_stub.route("DELETE", "/filemanagement/1", httpx.Response(200, json={}))
+    headers = {"Authorization": f"Bearer {make_token()}"}
+
+    client.get("/files", params={"username": "alice"}, headers=headers)
+    assert client.delete("/files/1", headers=headers).status_code == 200
+    remaining = client.get("/files", params={"username": "alice"}, headers=headers).json()
+
+    assert [f["id"] for f in remaining] == ["2"]
+    assert manta_stub.count("GET", "/filemanagement") == 1
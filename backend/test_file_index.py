@@ -0,0 +1,78 @@
+import httpx
+import jwt
+from fastapi.testclient import TestClient
+
+import main
+from conftest import make_token
+from file_index import MetadataIndex
+from main import app
+
+client = TestClient(app)
+
+LISTING = {"data": [
+    {"id": "1", "s3_key": "user-alice/images/cat.png", "filename": "cat.png", "size": 10, "content_type": "image/png"},
+    {"id": "2", "s3_key": "user-bob/images/dog.png", "size": 30, "content_type": "image/png"},
+]}
+
+
+class PresignOnlyStorage:
+    available = True
+
+    async def generate_presigned_url(self, operation, expires_in=3600, **params):
+        return f"https://s3.test/{params['Key']}"
+
+
+def test_index_is_per_user_and_keyed_by_id_and_key():
+    index = MetadataIndex()
+    index.fill("alice", LISTING["data"])
+    assert index.get("alice", "1")["filename"] == "cat.png"
+    assert index.get_by_key("alice", "user-alice/images/cat.png")["id"] == "1"
+    assert index.get("alice", "2") is None
+    assert index.is_complete("alice")
+    index.remove("alice", "1")
+    assert index.get_by_key("alice", "user-alice/images/cat.png") is None
+
+
+def test_download_after_listing_needs_no_metadata_call(manta_stub, monkeypatch):
+    monkeypatch.setattr(main, "storage", PresignOnlyStorage())
+    manta_stub.route("GET", "/filemanagement", httpx.Response(200, json=LISTING))
+    headers = {"Authorization": f"Bearer {make_token('alice')}"}
+
+    client.get("/files", params={"username": "alice"}, headers=headers)
+    response = client.get("/download/1", headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["download_url"] == "https://s3.test/user-alice/images/cat.png"
+    assert manta_stub.calls == [("GET", "/filemanagement")]
+
+
+def test_fallback_reads_data_list_once(manta_stub, monkeypatch):
+    monkeypatch.setattr(main, "storage", PresignOnlyStorage())
+    manta_stub.route("GET", "/filemanagement", httpx.Response(200, json=LISTING))
+    headers = {"Authorization": f"Bearer {make_token('alice')}"}
+
+    assert client.get("/download/1", headers=headers).status_code == 200
+    assert client.get("/download/404", headers=headers).status_code == 404
+    # The second miss is answered by the fresh index, not another listing fetch
+    assert manta_stub.count("GET", "/filemanagement") == 1
+
+
+def test_forged_token_gets_nothing_from_the_index(manta_stub, monkeypatch):
+    monkeypatch.setattr(main, "storage", PresignOnlyStorage())
+    real = make_token("alice")
+    forged = jwt.encode({"username": "alice", "id": "alice"}, "other-secret", algorithm="HS256")
+
+    def checked(payload):
+        return lambda request: httpx.Response(200, json=payload) if request.headers["Authorization"] == f"Bearer {real}" \
+            else httpx.Response(401, json={})
+
+    manta_stub.route("GET", "/filemanagement", checked(LISTING))
+    manta_stub.route("GET", "/filemanagement/1", checked(LISTING["data"][0]))
+    assert client.get("/download/1", headers={"Authorization": f"Bearer {real}"}).status_code == 200
+
+    calls = manta_stub.count("GET", "/filemanagement/1")
+
+    forged_headers = {"Authorization": f"Bearer {forged}"}
+    for path in ("/download/1", "/download/1/stream", "/files/1/thumbnail"):
+        assert client.get(path, headers=forged_headers).status_code == 401
+    assert manta_stub.count("GET", "/filemanagement/1") == calls + 3
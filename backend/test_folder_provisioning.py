@@ -0,0 +1,45 @@
+import asyncio
+
+import httpx
+from fastapi.testclient import TestClient
+
+import main
+from conftest import BUCKET, make_token
+from folder_provisioning import ProvisioningQueue, folder_marker_keys
+from main import app
+
+
+def test_queue_retries_and_coalesces():
+    attempts = []
+
+    async def flaky(user_id):
+        attempts.append(user_id)
+        if len(attempts) < 3:
+            raise RuntimeError("S3 hiccup")
+
+    async def run():
+        queue = ProvisioningQueue(flaky, workers=1, max_attempts=5, retry_delay=0)
+        assert queue.enqueue("alice") is True
+        assert queue.enqueue("alice") is False
+        await queue.join()
+        await queue.aclose()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert attempts == ["alice"] * 3
+    assert stats == {"queued": 0, "completed": 1, "retries": 2, "failed": 0}
+
+
+def test_signup_returns_before_folders_are_created(s3, manta_stub):
+    token = make_token("carol")
+    manta_stub.route("POST", "/userauthflow/signup", httpx.Response(200, json={"token": token}))
+
+    with TestClient(app) as client:
+        response = client.post("/signup", json={
+            "firstName": "Carol", "lastName": "C", "username": "carol", "password": "pw",
+        })
+        assert response.json() == {"token": token}
+        client.portal.call(main.folder_queue.join)
+
+    keys = {o["Key"] for o in s3.list_objects_v2(Bucket=BUCKET)["Contents"]}
+    assert keys == set(folder_marker_keys("carol"))
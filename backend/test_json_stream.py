@@ -0,0 +1,92 @@
+import asyncio
+import json
+import tracemalloc
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import make_token
+from json_stream import iter_json_array, ndjson_chunks
+from main import app
+
+client = TestClient(app)
+
+
+async def chunked(text, size):
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+def collect(text, size=1, key="data"):
+    async def run():
+        return [item async for item in iter_json_array(chunked(text, size), key)]
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("size", [1, 3, 1000])
+def test_envelope_is_parsed_across_chunk_boundaries(size):
+    text = json.dumps({"status": "ok", "meta": {"n": [1, 2]}, "data": [{"id": 1, "name": "a,]b"}, 12345, None], "x": 1})
+    assert collect(text, size) == [{"id": 1, "name": "a,]b"}, 12345, None]
+
+
+def test_top_level_array_and_missing_key():
+    assert collect(' [ {"id": 1} , {"id": 2} ] ', 2) == [{"id": 1}, {"id": 2}]
+    assert collect('{"message": "nothing here"}') == []
+    assert collect('[]') == []
+
+
+def test_truncated_input_raises():
+    with pytest.raises(ValueError):
+        collect('{"data": [{"id": 1}, {"id": ', 4)
+
+
+def test_memory_stays_flat_for_large_arrays():
+    async def upstream(count):
+        yield '{"data": ['
+        for i in range(count):
+            yield ("," if i else "") + json.dumps({"id": i, "s3_key": f"user-a/others/{i}.txt", "pad": "x" * 200})
+        yield ']}'
+
+    async def drain(count):
+        seen = 0
+        async for _ in iter_json_array(upstream(count)):
+            seen += 1
+        return seen
+
+    tracemalloc.start()
+    assert asyncio.run(drain(20000)) == 20000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < 1024 * 1024
+
+
+def test_ndjson_first_line_is_not_batched():
+    async def records():
+        for i in range(3):
+            yield {"id": i}
+
+    async def run():
+        return [chunk async for chunk in ndjson_chunks(records(), flush_bytes=1 << 20)]
+
+    assert asyncio.run(run()) == [b'{"id":0}\n', b'{"id":1}\n{"id":2}\n']
+
+
+def test_files_ndjson_streams_filtered_records(manta_stub):
+    listing = {"data": [
+        {"id": "1", "s3_key": "user-alice/images/a.png", "size": 1},
+        {"id": "2", "s3_key": "user-bob/images/b.png", "size": 2},
+        {"id": "3", "s3_key": "user-alice/documents/c.pdf", "size": 3},
+    ]}
+    manta_stub.route("GET", "/filemanagement", httpx.Response(200, json=listing))
+    headers = {"Authorization": f"Bearer {make_token('alice')}"}
+
+    response = client.get("/files", params={"username": "alice", "format": "ndjson"}, headers=headers)
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == ["1", "3"]
+
+    images = client.get("/files", params={"username": "alice", "format": "ndjson", "category": "images"}, headers=headers)
+    assert [json.loads(line)["id"] for line in images.text.splitlines()] == ["1"]
+
+    assert client.get("/files", params={"username": "alice", "format": "ndjson", "limit": 5}, headers=headers).status_code == 400
+    assert client.get("/files", params={"username": "alice", "format": "xml"}, headers=headers).status_code == 400
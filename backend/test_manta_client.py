@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+import httpx
+
+from manta_client import MantaClient
+
+
+def test_request_adds_bearer_token_and_base_url():
+    seen = {}
+
+    def handler(request):
+        seen["url"] = str(request.url)
+        seen["auth"] = request.headers.get("Authorization")
+        return httpx.Response(200, json={"ok": True})
+
+    async def run():
+        client = MantaClient(base_url="https://manta.test/api", transport=httpx.MockTransport(handler))
+        response = await client.get("/filemanagement/42", token="abc")
+        await client.aclose()
+        return response
+
+    response = asyncio.run(run())
+    assert response.json() == {"ok": True}
+    assert seen["url"] == "https://manta.test/api/filemanagement/42"
+    assert seen["auth"] == "Bearer abc"
+
+
+def test_slow_calls_do_not_serialize():
+    async def handler(request):
+        await asyncio.sleep(0.2)
+        return httpx.Response(200, json={})
+
+    async def run():
+        client = MantaClient(base_url="https://manta.test", transport=httpx.MockTransport(handler))
+        start = time.perf_counter()
+        await asyncio.gather(*(client.get("/filemanagement") for _ in range(10)))
+        elapsed = time.perf_counter() - start
+        await client.aclose()
+        return elapsed
+
+    # Ten concurrent 200ms calls should overlap rather than take ~2s
+    assert asyncio.run(run()) < 1.0
@@ -0,0 +1,85 @@
+import re
+
+import httpx
+from fastapi.testclient import TestClient
+
+from conftest import BUCKET, make_token
+from main import app
+from metrics import Registry, path_template
+
+client = TestClient(app)
+HEADERS = {"Authorization": f"Bearer {make_token('alice')}"}
+
+
+def sample(text: str, name: str, **labels) -> float:
+    """Value of one series in a scrape, or 0 if it isn't there yet"""
+    for line in text.splitlines():
+        series, _, value = line.rpartition(' ')
+        if series.split('{')[0] != name:
+            continue
+        found = dict(re.findall(r'(\w+)="([^"]*)"', series))
+        if found == labels:
+            return float(value)
+    return 0.0
+
+
+def scrape() -> str:
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    return response.text
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    latency = registry.histogram("op_seconds", "Op latency", ("op",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        latency.labels('get "x"').observe(value)
+    registry.counter("ops_total", "Ops").inc(2)
+
+    text = registry.render()
+    assert '# TYPE mantadrive_op_seconds histogram' in text
+    assert 'mantadrive_op_seconds_bucket{op="get \\"x\\"",le="0.1"} 1' in text
+    assert 'mantadrive_op_seconds_bucket{op="get \\"x\\"",le="1"} 3' in text
+    assert 'mantadrive_op_seconds_bucket{op="get \\"x\\"",le="+Inf"} 4' in text
+    assert 'mantadrive_op_seconds_count{op="get \\"x\\""} 4' in text
+    assert 'mantadrive_ops_total 2' in text
+
+
+def test_path_template_collapses_ids():
+    assert path_template("/filemanagement/123?x=1") == "/filemanagement/{id}"
+    assert path_template("/userauthflow/user-reset") == "/userauthflow/user-reset"
+
+
+def test_routes_and_manta_calls_are_labelled_by_template(manta_stub):
+    manta_stub.route("GET", "/filemanagement", httpx.Response(200, json=[]))
+    before = scrape()
+
+    for _ in range(2):
+        assert client.get("/files", params={"username": "alice"}, headers=HEADERS).status_code == 200
+    client.get("/no-such-page")
+
+    after = scrape()
+    route = dict(method="GET", route="/files", status="200")
+    assert sample(after, "mantadrive_http_requests_total", **route) - sample(before, "mantadrive_http_requests_total", **route) == 2
+    assert sample(after, "mantadrive_http_requests_total", method="GET", route="unmatched", status="404") >= 1
+    assert sample(after, "mantadrive_http_requests_in_flight", method="GET") == 1  # the scrape itself
+    # The second listing is served from the cache
+    manta = dict(method="GET", path="/filemanagement", status="200")
+    assert sample(after, "mantadrive_manta_request_duration_seconds_count", **manta) - sample(before, "mantadrive_manta_request_duration_seconds_count", **manta) == 1
+    assert sample(after, "mantadrive_cache_hits_total", cache="file_list") >= 1
+    assert 'mantadrive_cache_hit_ratio{cache="presigned_url"}' in after
+
+
+def test_s3_operations_and_downloaded_bytes(s3, manta_stub):
+    s3.put_object(Bucket=BUCKET, Key="user-alice/others/a.bin", Body=b"x" * 1000)
+    manta_stub.route("GET", "/filemanagement/f1", httpx.Response(200, json={
+        "id": "f1", "s3_key": "user-alice/others/a.bin", "username": "alice",
+    }))
+    before = scrape()
+    assert client.get("/download/f1/stream", headers=HEADERS).status_code == 200
+
+    after = scrape()
+    assert sample(after, "mantadrive_downloaded_bytes_total") - sample(before, "mantadrive_downloaded_bytes_total") == 1000
+    get = dict(operation="get_object", outcome="ok")
+    assert sample(after, "mantadrive_s3_operation_duration_seconds_count", **get) > sample(before, "mantadrive_s3_operation_duration_seconds_count", **get)
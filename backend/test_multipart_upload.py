@@ -0,0 +1,53 @@
+import asyncio
+import io
+import os
+
+import pytest
+from fastapi import UploadFile
+
+from conftest import BUCKET
+from multipart_upload import MIN_PART_SIZE, stream_upload
+from s3_storage import S3Storage
+
+
+
+
+def make_upload(data: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename="clip.mp4")
+
+
+def test_small_file_uses_single_put(s3):
+    size = asyncio.run(stream_upload(S3Storage(s3, BUCKET), "user-a/others/a.txt", make_upload(b"hello"), "text/plain"))
+    assert size == 5
+    assert s3.get_object(Bucket=BUCKET, Key="user-a/others/a.txt")["Body"].read() == b"hello"
+
+
+def test_large_file_is_sent_in_parts(s3):
+    data = os.urandom(MIN_PART_SIZE * 2 + 1234)
+    size = asyncio.run(stream_upload(
+        S3Storage(s3, BUCKET), "user-a/videos/clip.mp4", make_upload(data), "video/mp4",
+        part_size=MIN_PART_SIZE, concurrency=2,
+    ))
+    assert size == len(data)
+    obj = s3.get_object(Bucket=BUCKET, Key="user-a/videos/clip.mp4")
+    assert obj["Body"].read() == data
+    assert obj["ContentType"] == "video/mp4"
+
+
+def test_failed_part_aborts_multipart_upload(s3):
+    class FailingClient:
+        def __getattr__(self, name):
+            return getattr(s3, name)
+
+        def upload_part(self, **kwargs):
+            if kwargs["PartNumber"] == 2:
+                raise RuntimeError("network down")
+            return s3.upload_part(**kwargs)
+
+    data = os.urandom(MIN_PART_SIZE * 3)
+    with pytest.raises(RuntimeError):
+        asyncio.run(stream_upload(
+            S3Storage(FailingClient(), BUCKET), "user-a/videos/broken.mp4", make_upload(data), "video/mp4",
+            part_size=MIN_PART_SIZE, concurrency=2,
+        ))
+    assert "Uploads" not in s3.list_multipart_uploads(Bucket=BUCKET)
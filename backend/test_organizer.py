@@ -0,0 +1,78 @@
+import httpx
+from fastapi.testclient import TestClient
+
+from conftest import make_token
+from main import app
+from organizer import FileOrganizer, RuleSet
+
+client = TestClient(app)
+
+
+def test_default_rules_match_previous_classification():
+    rules = FileOrganizer().rules
+    assert rules.classify("my_resume.pdf", "application/pdf") == "Work Documents"
+    assert rules.classify("beach_photo.jpg", "image/jpeg") == "Personal Photos"
+    assert rules.classify("diagram.png", "image/png") == "Others"
+    assert rules.classify("holiday.mp4", "video/mp4") == "Videos"
+    assert rules.classify("backup.tar.gz", "application/gzip") == "Archives"
+    # Extensions match anywhere in the name, like the old substring check
+    assert rules.classify("logs.tar.gz.part", "") == "Archives"
+    assert rules.classify("site.zipped.bak", "") == "Archives"
+    # Earlier rules win, as with the old if/elif chain
+    assert rules.classify("invoice_scan.zip", "application/zip") == "Work Documents"
+    # "cv" hides inside "vacation", which a leftmost regex match would skip
+    assert rules.classify("epicvacation.jpg", "image/jpeg") == "Work Documents"
+
+
+def test_custom_rules_share_overlapping_terms():
+    rules = RuleSet([
+        {"category": "Music", "extensions": [".mp3", ".flac"], "mime_prefixes": ["audio/"]},
+        {"category": "Mixes", "keywords": ["mix"], "extensions": [".mp3"], "match": "all"},
+    ])
+    assert rules.classify("song.mp3", "") == "Music"
+    assert rules.classify("track.ogg", "audio/ogg") == "Music"
+    assert rules.classify("notes.txt", "text/plain") == "Others"
+
+
+def test_nested_keywords_all_count():
+    rules = RuleSet([
+        {"category": "A", "keywords": ["ab"], "extensions": [".x"], "match": "all"},
+        {"category": "B", "keywords": ["abc"]},
+    ])
+    assert rules.classify("abc.x", "") == "A"
+    assert rules.classify("abc.y", "") == "B"
+
+
+def test_classification_is_cached_per_file_id():
+    organizer = FileOrganizer()
+    records = [{"id": str(i), "s3_key": f"user-a/others/report{i}.pdf", "type": "application/pdf"} for i in range(3)]
+
+    organizer.organize(records)
+    groups = organizer.organize(records + [{"id": "9", "s3_key": "user-a/videos/v.mp4", "type": "video/mp4"}])
+
+    assert organizer.stats()["misses"] == 4 and organizer.stats()["hits"] == 3
+    assert groups["Work Documents"]["count"] == 3 and groups["Videos"]["count"] == 1
+
+
+def test_renamed_file_is_reclassified():
+    organizer = FileOrganizer()
+    assert organizer.classify({"id": "1", "s3_key": "user-a/others/cv.pdf"}) == "Work Documents"
+    assert organizer.classify({"id": "1", "s3_key": "user-a/others/notes.pdf"}) == "Others"
+
+
+def test_organize_endpoint_reuses_cached_listing(manta_stub):
+    listing = {"data": [
+        {"id": "1", "s3_key": "user-alice/documents/contract.pdf", "content_type": "application/pdf"},
+        {"id": "2", "s3_key": "user-alice/videos/clip.mp4", "content_type": "video/mp4"},
+        {"id": "3", "s3_key": "user-bob/documents/report.pdf", "content_type": "application/pdf"},
+    ]}
+    manta_stub.route("GET", "/filemanagement", httpx.Response(200, json=listing))
+    headers = {"Authorization": f"Bearer {make_token('alice')}"}
+
+    first = client.post("/ai/organize", headers=headers).json()
+    second = client.post("/ai/organize", headers=headers).json()
+
+    assert first == second
+    assert first["total_files"] == 2
+    assert {s["category"]: s["count"] for s in first["suggestions"]} == {"Work Documents": 1, "Videos": 1}
+    assert manta_stub.count("GET", "/filemanagement") == 1
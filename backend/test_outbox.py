@@ -0,0 +1,140 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from blob_store import blob_store
+from conftest import BUCKET, drain_outbox, make_token
+from main import app
+from outbox import Outbox, PermanentFailure, outbox
+
+client = TestClient(app)
+HEADERS = {"Authorization": f"Bearer {make_token('alice')}"}
+
+
+def flaky_outbox(failures: int, error: Exception = RuntimeError("boom")):
+    box = Outbox(retry_delay=0, max_attempts=3)
+    seen = []
+
+    @box.handler("job")
+    async def job(task):
+        seen.append(task.attempt)
+        if len(seen) <= failures:
+            raise error
+
+    return box, seen
+
+
+def test_retries_until_success():
+    box, seen = flaky_outbox(failures=2)
+
+    async def scenario():
+        await box.enqueue("job", {"n": 1})
+        for _ in range(3):
+            await box.run_due()
+        return await box.backlog()
+
+    assert asyncio.run(scenario()) == {"pending": 0, "dead": 0}
+    assert seen == [1, 2, 3]
+    assert box.stats() == {"completed": 1, "retries": 2, "dead_lettered": 0}
+
+
+def test_dead_letters_after_max_attempts_or_permanent_failure():
+    box, seen = flaky_outbox(failures=10)
+    permanent, _ = flaky_outbox(failures=10, error=PermanentFailure("no"))
+
+    async def scenario(target):
+        await target.enqueue("job", {})
+        for _ in range(5):
+            await target.run_due()
+        return await target.backlog()
+
+    assert asyncio.run(scenario(box)) == {"pending": 0, "dead": 1}
+    assert seen == [1, 2, 3]
+    # Both outboxes share the table, so there are two dead tasks now
+    assert asyncio.run(scenario(permanent)) == {"pending": 0, "dead": 2}
+    assert permanent.stats() == {"completed": 0, "retries": 0, "dead_lettered": 1}
+
+
+def test_claim_is_a_lease():
+    box, seen = flaky_outbox(failures=0)
+
+    async def scenario():
+        task_id = await box.enqueue("job", {})
+        assert await asyncio.to_thread(box._claim, task_id) is not None
+        # Held by someone else until the lease runs out
+        return await box.run(task_id)
+
+    assert asyncio.run(scenario()) is False and seen == []
+
+
+def test_unknown_kind_is_rejected():
+    with pytest.raises(ValueError):
+        asyncio.run(Outbox().enqueue("nope", {}))
+
+
+def test_failed_metadata_delete_is_retried(manta_stub, monkeypatch):
+    class Storage:
+        available = True
+        deleted = []
+
+        async def delete_object(self, Key):
+            self.deleted.append(Key)
+
+    monkeypatch.setattr(main, "storage", Storage())
+    manta_stub.route("GET", "/filemanagement/1", httpx.Response(200, json={"id": "1", "s3_key": "user-alice/others/a.txt"}))
+    manta_stub.route("DELETE", "/filemanagement/1", httpx.Response(503, json={}))
+
+    response = client.delete("/files/1", headers=HEADERS)
+    assert response.status_code == 200 and response.json()["metadata_pending"] is True
+
+    manta_stub.route("DELETE", "/filemanagement/1", httpx.Response(200, json={}))
+    assert drain_outbox() == 2
+    assert manta_stub.count("DELETE", "/filemanagement/1") == 2
+    assert main.storage.deleted == ["user-alice/others/a.txt"]
+    assert asyncio.run(outbox.backlog()) == {"pending": 0, "dead": 0}
+
+
+def test_refused_metadata_delete_keeps_the_file(manta_stub, monkeypatch):
+    monkeypatch.setattr(main, "storage", type("Storage", (), {"available": True})())
+    manta_stub.route("GET", "/filemanagement/1", httpx.Response(200, json={"id": "1", "s3_key": "user-alice/others/a.txt"}))
+    manta_stub.route("DELETE", "/filemanagement/1", httpx.Response(403, json={}))
+
+    assert client.delete("/files/1", headers=HEADERS).status_code == 403
+    assert asyncio.run(outbox.backlog()) == {"pending": 0, "dead": 0}
+
+
+def test_dead_lettered_metadata_delete_forgets_the_token(manta_stub, monkeypatch):
+    from database import SessionLocal
+    from outbox import OutboxEntry
+
+    monkeypatch.setattr(main, "storage", type("Storage", (), {"available": True})())
+    monkeypatch.setattr(main, "discard_uploads", lambda keys: asyncio.sleep(0))
+    manta_stub.route("GET", "/filemanagement/1", httpx.Response(200, json={"id": "1", "s3_key": "user-alice/others/a.txt"}))
+    manta_stub.route("DELETE", "/filemanagement/1", httpx.Response(503, json={}))
+    assert client.delete("/files/1", headers=HEADERS).json()["metadata_pending"] is True
+
+    def payloads():
+        with SessionLocal() as session:
+            return [row.payload for row in session.query(OutboxEntry).filter(OutboxEntry.kind == "delete_metadata")]
+    assert "token" in payloads()[0]
+
+    # The token has expired by the time of the retry
+    manta_stub.route("DELETE", "/filemanagement/1", httpx.Response(401, json={}))
+    drain_outbox()
+    assert asyncio.run(outbox.backlog()) == {"pending": 0, "dead": 1}
+    assert payloads() == ['{"file_id": "1"}']
+
+
+def test_retried_delete_spares_rewritten_objects(s3):
+    for key in ("old.txt", "new.txt"):
+        s3.put_object(Bucket=BUCKET, Key=key, Body=b"x")
+
+    queued_at = time.time() + 60  # "old.txt" was written before the delete was queued
+    assert asyncio.run(blob_store.delete_unreferenced(main.storage, ["old.txt"], modified_before=queued_at)) == {}
+    assert asyncio.run(blob_store.delete_unreferenced(main.storage, ["new.txt"], modified_before=queued_at - 3600)) == {}
+    remaining = [o["Key"] for o in s3.list_objects_v2(Bucket=BUCKET)["Contents"]]
+    assert remaining == ["new.txt"]
@@ -0,0 +1,69 @@
+import base64
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import make_token
+from main import app
+from pagination import InvalidCursor, paginate, sort_files
+
+client = TestClient(app)
+
+FILES = [
+    {"id": str(i), "name": f"file{i:02d}.txt", "size": (i * 7) % 10, "created_at": str(1700000000000 + (i % 5) * 1000)}
+    for i in range(23)
+]
+
+
+def walk(limit, sort, order):
+    seen, cursor = [], None
+    while True:
+        page, cursor = paginate(FILES, limit, cursor, sort, order)
+        seen.extend(page)
+        if cursor is None:
+            return seen
+
+
+def test_pages_cover_sorted_listing_without_gaps():
+    for sort in ("date", "name", "size"):
+        for order in ("asc", "desc"):
+            assert walk(5, sort, order) == sort_files(FILES, sort, order)
+
+
+def raw_cursor(sort, order, key):
+    return base64.urlsafe_b64encode(json.dumps([sort, order, key]).encode()).decode()
+
+
+def test_cursor_key_must_match_the_sort_field():
+    for sort, key in (("size", ["big", "1"]), ("name", [3, "1"]), ("date", [1, 2]), ("date", [True, "1"]), ("date", None), ("size", [1])):
+        with pytest.raises(InvalidCursor):
+            paginate(FILES, 5, raw_cursor(sort, "asc", key), sort, "asc")
+
+
+def test_date_sort_is_numeric_not_lexicographic():
+    files = [{"id": "a", "created_at": "999"}, {"id": "b", "created_at": "1000"}]
+    assert [f["id"] for f in sort_files(files, "date", "desc")] == ["b", "a"]
+
+
+def test_files_endpoint_paginates(manta_stub):
+    listing = {"data": [
+        {"id": str(i), "s3_key": f"user-alice/documents/f{i}.pdf", "created_at": str(1700000000000 + i)}
+        for i in range(5)
+    ]}
+    manta_stub.route("GET", "/filemanagement", httpx.Response(200, json=listing))
+    headers = {"Authorization": f"Bearer {make_token()}"}
+
+    first = client.get("/files", params={"username": "alice", "limit": 2}, headers=headers).json()
+    second = client.get(
+        "/files", params={"username": "alice", "limit": 2, "cursor": first["next_cursor"]}, headers=headers
+    ).json()
+
+    assert first["total"] == 5
+    assert [f["id"] for f in first["files"]] == ["4", "3"]
+    assert [f["id"] for f in second["files"]] == ["2", "1"]
+    bad = client.get("/files", params={"username": "alice", "limit": 2, "cursor": "nope"}, headers=headers)
+    assert bad.status_code == 400
+    mistyped = raw_cursor("date", "desc", ["yesterday", "1"])
+    assert client.get("/files", params={"username": "alice", "limit": 2, "cursor": mistyped}, headers=headers).status_code == 400
@@ -0,0 +1,74 @@
+import asyncio
+import base64
+import time
+
+import httpx
+from fastapi.testclient import TestClient
+
+from conftest import make_token
+from main import app
+from qr_codes import QRRenderer
+
+client = TestClient(app)
+
+
+def test_renderer_caches_by_link_and_format():
+    renderer = QRRenderer(workers=1)
+
+    async def run():
+        png = await renderer.render("https://x", "png")
+        again = await renderer.render("https://x", "png")
+        svg = await renderer.render("https://x", "svg")
+        return png, again, svg
+
+    png, again, svg = asyncio.run(run())
+    renderer.shutdown()
+    assert png is again and png.startswith(b"\x89PNG")
+    assert b"<svg" in svg
+    assert renderer.stats()["hits"] == 1
+
+
+def test_share_and_metadata_calls_run_concurrently(manta_stub):
+    async def slow_share(request):
+        await asyncio.sleep(0.3)
+        return httpx.Response(200, json={"share_link": "https://mantadrive.app/s/abc"})
+
+    async def slow_metadata(request):
+        await asyncio.sleep(0.3)
+        return httpx.Response(200, json={"id": "1", "s3_key": "user-alice/images/cat.png", "size": 3})
+
+    manta_stub.route("POST", "/filemanagement/share", slow_share)
+    manta_stub.route("GET", "/filemanagement/1", slow_metadata)
+
+    start = time.perf_counter()
+    response = client.post("/qrcode", json={"file_id": "1", "manta_token": make_token()})
+    elapsed = time.perf_counter() - start
+
+    assert response.status_code == 200
+    assert response.json()["filename"] == "cat.png"
+    assert elapsed < 0.55
+
+
+def test_raw_png_and_svg_responses(manta_stub):
+    manta_stub.route("POST", "/filemanagement/share", httpx.Response(200, json={"share_link": "https://mantadrive.app/s/abc"}))
+    body = {"file_id": "1", "manta_token": make_token()}
+
+    png = client.post("/qrcode", params={"raw": "true"}, json=body)
+    svg = client.post("/qrcode", json={**body, "format": "svg"})
+
+    assert png.headers["content-type"] == "image/png" and png.content.startswith(b"\x89PNG")
+    assert b"<svg" in base64.b64decode(svg.json()["qr_code"])
+
+
+def test_batch_reports_per_file_results(manta_stub):
+    def share(request):
+        if b'"bad"' in request.content:
+            return httpx.Response(403, json={"error": "forbidden"})
+        return httpx.Response(200, json={"share_link": "https://mantadrive.app/s/abc"})
+
+    manta_stub.route("POST", "/filemanagement/share", share)
+    response = client.post("/qrcode/batch", json={"file_ids": ["1", "bad", "2"], "manta_token": make_token()}).json()
+
+    assert response["succeeded"] == 2 and response["failed"] == 1
+    assert [r["success"] for r in response["results"]] == [True, False, True]
+    assert response["results"][1]["status"] == 403
@@ -0,0 +1,108 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from conftest import BUCKET, make_token
+from main import app
+from range_download import content_disposition, iter_body, parse_range
+
+client = TestClient(app)
+HEADERS = {"Authorization": f"Bearer {make_token('alice')}"}
+KEY = "user-alice/videos/clip.mp4"
+DATA = bytes(range(256)) * 4096  # 1 MiB
+
+
+@pytest.fixture
+def s3(s3, manta_stub):
+    """The shared bucket, holding one video registered as file v1"""
+    s3.put_object(Bucket=BUCKET, Key=KEY, Body=DATA, ContentType="video/mp4")
+    manta_stub.route("GET", "/filemanagement/v1", httpx.Response(200, json={
+        "id": "v1", "s3_key": KEY, "username": "alice", "content_type": "video/mp4", "size": len(DATA),
+    }))
+    return s3
+
+
+def stream(**headers) -> httpx.Response:
+    return client.get("/download/v1/stream", headers={**HEADERS, **headers})
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-499") == "bytes=0-499"
+    assert parse_range("bytes=500-") == "bytes=500-"
+    assert parse_range("bytes=-500") == "bytes=-500"
+    # Multi-range, reversed and malformed headers fall back to the whole body
+    assert parse_range("bytes=0-1,5-6") is None
+    assert parse_range("bytes=9-3") is None
+    assert parse_range("items=0-1") is None
+
+
+def test_content_disposition():
+    assert content_disposition("inline", "clip.mp4") == 'inline; filename="clip.mp4"'
+    assert content_disposition("attachment", 'say "hi".txt') == 'attachment; filename="say hi.txt"; filename*=UTF-8\'\'say%20%22hi%22.txt'
+
+
+def test_non_ascii_filename(s3, manta_stub):
+    manta_stub.route("GET", "/filemanagement/v2", httpx.Response(200, json={
+        "id": "v2", "s3_key": KEY, "filename": "文件.pdf", "content_type": "application/pdf",
+    }))
+
+    response = client.get("/download/v2/stream", params={"download": True}, headers=HEADERS)
+
+    assert response.status_code == 200 and response.content == DATA
+    assert response.headers["content-disposition"] == \
+        "attachment; filename=\"??.pdf\"; filename*=UTF-8''%E6%96%87%E4%BB%B6.pdf"
+
+
+def test_full_and_partial_content(s3):
+    full = stream()
+    assert full.status_code == 200 and full.content == DATA
+    assert full.headers["content-length"] == str(len(DATA)) and full.headers["accept-ranges"] == "bytes"
+    assert full.headers["content-type"] == "video/mp4" and full.headers["etag"]
+
+    part = stream(Range="bytes=1000-1999")
+    assert part.status_code == 206 and part.content == DATA[1000:2000]
+    assert part.headers["content-range"] == f"bytes 1000-1999/{len(DATA)}"
+    assert part.headers["content-length"] == "1000"
+
+    tail = stream(Range="bytes=-10")
+    assert tail.status_code == 206 and tail.content == DATA[-10:]
+
+
+def test_unsatisfiable_range(s3):
+    response = stream(Range=f"bytes={len(DATA) + 5}-")
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(DATA)}"
+
+
+def test_validators(s3):
+    etag = stream().headers["etag"]
+
+    assert stream(**{"If-None-Match": etag}).status_code == 304
+    matching = stream(Range="bytes=0-9", **{"If-Range": etag})
+    assert matching.status_code == 206 and matching.content == DATA[:10]
+    # A stale validator gets the whole, current object instead of a range
+    stale = stream(Range="bytes=0-9", **{"If-Range": '"outdated"'})
+    assert stale.status_code == 200 and stale.content == DATA
+
+
+def test_body_closed_when_client_stops_reading(s3):
+    class Body:
+        closed = False
+
+        def read(self, size):
+            return b"x" * size
+
+        def close(self):
+            self.closed = True
+
+    async def read_one(body):
+        chunks = iter_body(main.storage, body, 4)
+        assert await chunks.__anext__() == b"xxxx"
+        await chunks.aclose()
+
+    body = Body()
+    asyncio.run(read_one(body))
+    assert body.closed
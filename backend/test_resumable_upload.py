@@ -0,0 +1,126 @@
+import asyncio
+import os
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+
+import main
+from conftest import BUCKET, make_token
+from main import app
+from multipart_upload import MIN_PART_SIZE
+from resumable_upload import resumable_uploads
+
+client = TestClient(app)
+HEADERS = {"Authorization": f"Bearer {make_token('alice')}"}
+
+
+@pytest.fixture
+def s3(s3, monkeypatch):
+    """The shared bucket, with sessions cut into the smallest S3 parts"""
+    monkeypatch.setattr(resumable_uploads, "part_size", MIN_PART_SIZE)
+    return s3
+
+
+def create(size: int, filename: str = "clip.mp4") -> dict:
+    response = client.post(
+        "/upload/resumable",
+        json={"filename": filename, "content_type": "video/mp4", "size": size},
+        headers=HEADERS,
+    )
+    assert response.status_code == 201
+    assert response.headers["Location"] == f"/upload/resumable/{response.json()['upload_id']}"
+    return response.json()
+
+
+def patch(upload_id: str, offset: int, body: bytes) -> httpx.Response:
+    return client.patch(
+        f"/upload/resumable/{upload_id}",
+        content=body,
+        headers={**HEADERS, "Upload-Offset": str(offset), "Content-Type": "application/offset+octet-stream"},
+    )
+
+
+def test_resumes_from_last_stored_part(s3, manta_stub):
+    manta_stub.route("POST", "/filemanagement", httpx.Response(200, json={"id": "f1"}))
+    data = os.urandom(MIN_PART_SIZE * 2 + 1000)
+    upload = create(len(data))
+    assert upload["s3_key"] == "user-alice/videos/clip.mp4" and upload["part_size"] == MIN_PART_SIZE
+
+    first = patch(upload["upload_id"], 0, data[:MIN_PART_SIZE])
+    assert first.status_code == 200 and first.json()["complete"] is False
+    assert first.headers["Upload-Offset"] == str(MIN_PART_SIZE)
+
+    head = client.head(f"/upload/resumable/{upload['upload_id']}", headers=HEADERS)
+    assert head.status_code == 200 and head.headers["Upload-Offset"] == str(MIN_PART_SIZE)
+
+    done = patch(upload["upload_id"], MIN_PART_SIZE, data[MIN_PART_SIZE:])
+    assert done.status_code == 200
+    assert done.json()["file_id"] == "f1" and done.json()["size"] == len(data)
+    assert s3.get_object(Bucket=BUCKET, Key=upload["s3_key"])["Body"].read() == data
+
+    # A retried final PATCH (lost response) answers again without re-registering
+    again = patch(upload["upload_id"], len(data), b"")
+    assert again.status_code == 200 and again.json()["file_id"] == "f1"
+    assert manta_stub.count("POST", "/filemanagement") == 1
+
+
+def test_rejects_wrong_offset_and_overflow(s3, manta_stub):
+    upload = create(10)
+
+    conflict = patch(upload["upload_id"], 4, b"abc")
+    assert conflict.status_code == 409 and conflict.headers["Upload-Offset"] == "0"
+    assert patch(upload["upload_id"], 0, b"x" * 11).status_code == 400
+    assert client.head("/upload/resumable/missing", headers=HEADERS).status_code == 404
+
+    other = {"Authorization": f"Bearer {make_token('bob')}"}
+    assert client.head(f"/upload/resumable/{upload['upload_id']}", headers=other).status_code == 404
+
+
+def test_short_chunk_is_refused_not_dropped(s3):
+    data = os.urandom(MIN_PART_SIZE * 3)
+    upload = create(len(data))
+
+    # The whole part is kept; the 500-byte tail is refused, never acknowledged
+    short = patch(upload["upload_id"], 0, data[:MIN_PART_SIZE + 500])
+    assert short.status_code == 400 and str(MIN_PART_SIZE) in short.json()["detail"]
+    assert short.headers["Upload-Offset"] == str(MIN_PART_SIZE)
+
+    head = client.head(f"/upload/resumable/{upload['upload_id']}", headers=HEADERS)
+    assert head.headers["Upload-Offset"] == str(MIN_PART_SIZE)
+
+    tiny = patch(upload["upload_id"], MIN_PART_SIZE, b"x" * 10)
+    assert tiny.status_code == 400 and tiny.headers["Upload-Offset"] == str(MIN_PART_SIZE)
+
+
+def test_disconnect_keeps_completed_parts(s3):
+    data = os.urandom(MIN_PART_SIZE + 100)
+
+    async def scenario():
+        session = await resumable_uploads.create(main.storage, "alice", "user-alice/videos/v.mp4", "v.mp4", "video/mp4", len(data) * 2)
+
+        async def flaky_body():
+            yield data[:MIN_PART_SIZE // 2]
+            yield data[MIN_PART_SIZE // 2:]
+            raise ClientDisconnect()
+
+        with pytest.raises(ClientDisconnect):
+            await resumable_uploads.append(main.storage, session.upload_id, "alice", 0, flaky_body())
+        return await resumable_uploads.get(session.upload_id, "alice")
+
+    assert asyncio.run(scenario()).offset == MIN_PART_SIZE
+
+
+def test_janitor_aborts_stale_and_orphaned_uploads(s3, manta_stub):
+    upload = create(MIN_PART_SIZE * 2)
+    s3.create_multipart_upload(Bucket=BUCKET, Key="user-alice/videos/orphan.mp4")
+
+    # moto dates every multipart upload to 2010: the orphan is stale, the live session's upload is kept
+    assert asyncio.run(resumable_uploads.sweep(main.storage)) == {"sessions": 0, "aborted": 1}
+    later = time.time() + resumable_uploads.ttl + 1
+    assert asyncio.run(resumable_uploads.sweep(main.storage, now=later)) == {"sessions": 1, "aborted": 1}
+
+    assert client.head(f"/upload/resumable/{upload['upload_id']}", headers=HEADERS).status_code == 404
+    assert not s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads")
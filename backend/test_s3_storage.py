@@ -0,0 +1,46 @@
+import asyncio
+import os
+
+import pytest
+
+from s3_storage import S3Storage, create_s3_client
+
+moto = pytest.importorskip("moto")
+
+BUCKET = "test-bucket"
+
+
+@pytest.fixture
+def storage():
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        client = create_s3_client(endpoint_url=None)
+        client.create_bucket(Bucket=BUCKET)
+        storage = S3Storage(client, BUCKET, max_workers=4)
+        yield storage
+        storage.shutdown()
+
+
+def test_client_uses_tuned_config(storage):
+    config = storage.client.meta.config
+    assert config.retries["mode"] == "adaptive"
+    assert config.max_pool_connections >= 1
+
+
+def test_calls_default_to_configured_bucket(storage):
+    async def run():
+        await storage.head_bucket()
+        await storage.put_object(Key="user-a/documents/a.txt", Body=b"abc")
+        head = await storage.head_object(Key="user-a/documents/a.txt")
+        url = await storage.generate_presigned_url("get_object", Key="user-a/documents/a.txt", expires_in=60)
+        await storage.delete_object(Key="user-a/documents/a.txt")
+        return head, url
+
+    head, url = asyncio.run(run())
+    assert head["ContentLength"] == 3
+    assert BUCKET in url and "user-a/documents/a.txt" in url
+
+
+def test_object_url_uses_bucket_and_region(storage):
+    assert storage.object_url("user-a/images/x.png") == f"https://{BUCKET}.s3.us-east-1.amazonaws.com/user-a/images/x.png"
@@ -0,0 +1,162 @@
+import asyncio
+
+import httpx
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import make_token
+from main import app
+from share_store import ShareGone, parse_expiry, share_store
+
+client = TestClient(app)
+RECORD = {"id": "7", "s3_key": "user-alice/documents/report.pdf", "filename": "report.pdf",
+          "size": 2048, "content_type": "application/pdf"}
+
+
+def create_share(manta_stub, **body):
+    manta_stub.route("GET", "/filemanagement/7", httpx.Response(200, json=RECORD))
+    response = client.post(
+        "/share/anonymous",
+        json={"file_id": "7", **body},
+        headers={"Authorization": f"Bearer {make_token('alice')}"},
+    )
+    assert response.status_code == 200
+    return response.json()["access_id"]
+
+
+def test_parse_expiry():
+    assert parse_expiry("7d") == 7 * 86400
+    assert parse_expiry("24h") == 86400
+    assert parse_expiry(2) == 7200
+    assert parse_expiry(None) is None
+    with pytest.raises(ValueError):
+        parse_expiry("soon")
+    with pytest.raises(ValueError):
+        parse_expiry(10 ** 400)
+
+
+def test_share_resolves_without_manta(s3, manta_stub):
+    access_id = create_share(manta_stub)
+    calls = len(manta_stub.calls)
+
+    response = client.get(f"/s/{access_id}")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["filename"] == "report.pdf"
+    assert body["size"] == 2048
+    assert "report.pdf" in body["download_url"]
+    assert len(manta_stub.calls) == calls
+
+
+def test_share_secrets_are_hashed_and_checked(s3, manta_stub):
+    access_id = create_share(manta_stub, access_key="k3y", password="pw")
+
+    assert client.get(f"/s/{access_id}").json() == {
+        "requiresKey": True,
+        "requiresPassword": True,
+        "message": "Access key or password required to view this file",
+    }
+    assert client.get(f"/s/{access_id}", params={"access_key": "k3y", "password": "bad"}).status_code == 403
+    assert client.get(f"/s/{access_id}", params={"access_key": "k3y", "password": "pw"}).status_code == 200
+
+    def stored():
+        from database import SessionLocal
+        from share_store import Share
+        with SessionLocal() as session:
+            return session.get(Share, access_id)
+    share = stored()
+    assert share.access_key_hash != "k3y" and share.password_hash != "pw"
+    assert share.download_count == 1
+
+
+def test_download_limit_is_enforced(s3, manta_stub):
+    access_id = create_share(manta_stub, max_downloads=2)
+
+    codes = [client.get(f"/s/{access_id}").status_code for _ in range(3)]
+
+    assert codes == [200, 200, 410]
+
+
+def test_concurrent_opens_never_exceed_limit(s3, manta_stub):
+    access_id = create_share(manta_stub, max_downloads=3)
+
+    async def attempt():
+        try:
+            await share_store.open(access_id)
+            return True
+        except ShareGone:
+            return False
+
+    async def run():
+        return await asyncio.gather(*(attempt() for _ in range(10)))
+
+    assert sum(asyncio.run(run())) == 3
+
+
+def test_only_the_owner_can_share(s3, manta_stub):
+    manta_stub.route("GET", "/filemanagement/7", httpx.Response(200, json=RECORD))
+    bob = {"Authorization": f"Bearer {make_token('bob')}"}
+
+    assert client.post("/share/anonymous", json={"file_id": "7"}, headers=bob).status_code == 403
+    assert client.post("/share/protected", json={"file_id": "7", "access_key": "k"}, headers=bob).status_code == 403
+
+
+def test_bad_expiry_is_400(s3, manta_stub):
+    manta_stub.route("GET", "/filemanagement/7", httpx.Response(200, json=RECORD))
+    alice = {"Authorization": f"Bearer {make_token('alice')}"}
+
+    assert client.post("/share/anonymous", json={"file_id": "7", "expires_in": 10 ** 400}, headers=alice).status_code == 400
+    assert client.post("/share/protected", json={"file_id": "7", "expires_in": "soon"}, headers=alice).status_code == 400
+
+
+def test_forged_token_cannot_share_an_indexed_file(s3, manta_stub):
+    real = make_token("alice")
+    forged = jwt.encode({"username": "alice", "id": "alice"}, "other-secret", algorithm="HS256")
+    # Alice's own share leaves the file in the metadata index
+    create_share(manta_stub)
+    manta_stub.route("GET", "/filemanagement/7", lambda request: httpx.Response(200, json=RECORD)
+                     if request.headers["Authorization"] == f"Bearer {real}" else httpx.Response(401, json={}))
+    forged_headers = {"Authorization": f"Bearer {forged}"}
+
+    assert client.post("/share/anonymous", json={"file_id": "7"}, headers=forged_headers).status_code == 401
+    assert client.post("/share/protected", json={"file_id": "7"}, headers=forged_headers).status_code == 401
+
+
+def test_deleting_the_file_drops_its_shares(s3, manta_stub):
+    access_id = create_share(manta_stub)
+    manta_stub.route("DELETE", "/filemanagement/7", httpx.Response(200, json={}))
+
+    deleted = client.delete("/files/7", headers={"Authorization": f"Bearer {make_token('alice')}"})
+
+    assert deleted.status_code == 200
+    assert client.get(f"/s/{access_id}").status_code == 404
+
+
+def test_access_id_collision_draws_again(s3, manta_stub, monkeypatch):
+    import share_store as module
+    drawn = iter(["taken123", "taken123", "fresh123"])
+    monkeypatch.setattr(module.secrets, "token_urlsafe", lambda n: next(drawn))
+
+    assert create_share(manta_stub) == "taken123"
+    assert create_share(manta_stub) == "fresh123"
+
+
+def test_unknown_share_is_404(s3):
+    assert client.get("/s/nope1234").status_code == 404
+
+
+def test_protected_share_round_trip(s3, manta_stub):
+    manta_stub.route("GET", "/filemanagement/7", httpx.Response(200, json=RECORD))
+    created = client.post(
+        "/share/protected",
+        json={"file_id": "7", "access_key": "open-sesame", "expires_in": "7d"},
+        headers={"Authorization": f"Bearer {make_token('alice')}"},
+    ).json()
+
+    share_id = created["shareId"]
+    assert client.get(f"/s/{share_id}").json()["requiresKey"] is True
+    body = client.get(f"/s/{share_id}", params={"access_key": "open-sesame"}).json()
+    assert body["file"]["name"] == "report.pdf"
+    assert body["downloadUrl"] == body["download_url"]
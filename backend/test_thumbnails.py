@@ -0,0 +1,94 @@
+import asyncio
+import io
+import json
+import os
+
+import httpx
+import pytest
+from boto3.s3.transfer import TransferConfig
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import main
+import s3_storage
+from conftest import BUCKET, drain_outbox, make_token
+from main import app
+from thumbnails import ThumbnailUnavailable, render_renditions, thumbnails
+
+client = TestClient(app)
+HEADERS = {"Authorization": f"Bearer {make_token('alice')}"}
+
+
+def image_bytes(size=(800, 600), mode="RGB", fmt="JPEG") -> bytes:
+    buffer = io.BytesIO()
+    Image.new(mode, size, (200, 30, 30, 128) if mode == "RGBA" else (200, 30, 30)).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def registry(manta_stub):
+    def register(request):
+        record = {**json.loads(request.content), "id": "img1"}
+        manta_stub.route("GET", "/filemanagement/img1", httpx.Response(200, json=record))
+        manta_stub.route("DELETE", "/filemanagement/img1", httpx.Response(200, json={}))
+        return httpx.Response(200, json={"id": "img1"})
+
+    manta_stub.route("POST", "/filemanagement", register)
+    return manta_stub
+
+
+def preview_keys(s3) -> list:
+    listing = s3.list_objects_v2(Bucket=BUCKET, Prefix="user-alice/previews/")
+    return sorted(obj["Key"] for obj in listing.get("Contents", []))
+
+
+def test_render_never_upscales_and_flattens_alpha():
+    small = render_renditions(image_bytes((100, 50), "RGBA", "PNG"), [(256, "jpeg"), (64, "webp")])
+    jpeg, webp = (Image.open(io.BytesIO(content)) for content in small)
+    assert jpeg.size == (100, 50) and jpeg.mode == "RGB"
+    assert webp.size == (64, 32) and webp.format == "WEBP"
+
+
+def test_upload_renders_eager_thumbnails_once(s3, registry):
+    response = client.post("/upload", files={"file": ("cat.jpg", image_bytes(), "image/jpeg")}, headers=HEADERS)
+    assert response.status_code == 200
+    # Both formats of the eager width, rendered after the response from one decode
+    assert len(preview_keys(s3)) == 2 * len(thumbnails.eager_widths)
+    renders = thumbnails.renders
+
+    served = client.get("/files/img1/thumbnail?w=200&format=webp", headers=HEADERS)
+    assert served.status_code == 200 and served.headers["content-type"] == "image/webp"
+    assert Image.open(io.BytesIO(served.content)).size == (256, 192)
+    assert thumbnails.renders == renders
+
+    # Other widths are rendered on first request and indexed
+    lazy = client.get("/files/img1/thumbnail?w=100", headers={**HEADERS, "Accept": "image/webp,*/*"})
+    assert lazy.headers["x-thumbnail-width"] == "128" and lazy.headers["content-type"] == "image/webp"
+    client.get("/files/img1/thumbnail?w=100", headers={**HEADERS, "Accept": "image/webp,*/*"})
+    assert thumbnails.renders == renders + 1
+
+    client.delete("/files/img1", headers=HEADERS)
+    drain_outbox()
+    assert preview_keys(s3) == []
+
+
+def test_thumbnail_rejects_non_images(s3, registry):
+    client.post("/upload", files={"file": ("notes.txt", b"hello", "text/plain")}, headers=HEADERS)
+    assert client.get("/files/img1/thumbnail", headers=HEADERS).status_code == 415
+    assert client.get("/files/img1/thumbnail?format=gif", headers=HEADERS).status_code == 400
+    assert preview_keys(s3) == []
+
+
+def test_large_sources_are_read_in_ranged_parts(s3, monkeypatch):
+    source = os.urandom(300 * 1024)
+    s3.put_object(Bucket=BUCKET, Key="user-alice/images/big.png", Body=source)
+    monkeypatch.setattr(s3_storage, "TRANSFER_CONFIG", TransferConfig(multipart_threshold=64 * 1024, multipart_chunksize=64 * 1024))
+    gets = []
+    s3.meta.events.register("provide-client-params.s3.GetObject", lambda params, **kwargs: gets.append(params.get("Range")))
+
+    assert asyncio.run(thumbnails._read_source(main.storage, "user-alice/images/big.png")) == source
+    assert len(gets) == 5 and all(gets)
+
+    monkeypatch.setattr("thumbnails.THUMBNAIL_MAX_SOURCE_BYTES", 1024)
+    with pytest.raises(ThumbnailUnavailable):
+        asyncio.run(thumbnails._read_source(main.storage, "user-alice/images/big.png"))
@@ -0,0 +1,64 @@
+import json
+import logging
+import re
+
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from conftest import make_token
+from main import app
+from tracing import TracingMiddleware, span
+
+client = TestClient(app)
+
+
+def timings(response: httpx.Response) -> dict:
+    """Server-Timing entries as {name: (milliseconds, description)}"""
+    entries = {}
+    for entry in response.headers["server-timing"].split(", "):
+        name, _, params = entry.partition(";")
+        duration = float(re.search(r'dur=([\d.]+)', params).group(1))
+        desc = re.search(r'desc="([^"]*)"', params)
+        entries[name] = (duration, desc.group(1) if desc else None)
+    return entries
+
+
+def test_qrcode_reports_upstream_and_render_spans(manta_stub):
+    manta_stub.route("POST", "/filemanagement/share", httpx.Response(200, json={"share_link": "https://mantadrive.app/s/t1"}))
+    manta_stub.route("GET", "/filemanagement/1", httpx.Response(200, json={"id": "1", "s3_key": "user-alice/images/cat.png"}))
+
+    response = client.post("/qrcode", json={"file_id": "1", "manta_token": make_token()})
+    assert response.status_code == 200
+
+    spans = timings(response)
+    assert spans["manta"][1] == "2 calls"
+    assert "qr.render" in spans
+    assert spans["total"][0] >= spans["qr.render"][0]
+
+
+def test_sampled_requests_are_logged_as_json(caplog):
+    traced = FastAPI()
+    traced.add_middleware(TracingMiddleware, sample_rate=1.0)
+
+    @traced.get("/work/{item}")
+    async def work(item: str):
+        with span("step", "first"):
+            pass
+        with span("step"):
+            pass
+        return {"item": item}
+
+    with caplog.at_level(logging.INFO, logger="tracing"):
+        response = TestClient(traced).get("/work/secret-value")
+
+    assert timings(response)["step"][1] == "2 calls"
+    line = json.loads(caplog.records[-1].getMessage())
+    assert line["route"] == "/work/{item}" and line["status"] == 200
+    assert [s["name"] for s in line["spans"]] == ["step", "step"] and line["spans"][0]["detail"] == "first"
+    assert "secret-value" not in caplog.text
+
+
+def test_spans_outside_a_request_are_ignored():
+    with span("idle"):
+        pass
@@ -0,0 +1,89 @@
+import hashlib
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+
+import main
+from blob_store import blob_key_for
+from conftest import drain_outbox, make_token
+from main import app
+
+client = TestClient(app)
+
+
+class MemoryStorage:
+    available = True
+
+    def __init__(self, fail_keys=()):
+        self.objects = {}
+        self.fail_keys = set(fail_keys)
+
+    async def put_object(self, Key, Body, ContentType):
+        if Key in self.fail_keys:
+            raise RuntimeError("S3 unavailable")
+        self.objects[Key] = Body
+
+    async def delete_object(self, Key):
+        self.objects.pop(Key, None)
+
+    def object_url(self, key):
+        return f"https://s3.test/{key}"
+
+
+def blob_key(content: bytes) -> str:
+    return blob_key_for(hashlib.sha256(content).hexdigest(), "alice")
+
+
+def test_batch_upload_reports_partial_failures(manta_stub, monkeypatch):
+    storage = MemoryStorage(fail_keys={blob_key(b"xx")})
+    monkeypatch.setattr(main, "storage", storage)
+
+    def register(request):
+        body = json.loads(request.content)
+        if body["s3_key"].endswith("rejected.txt"):
+            return httpx.Response(400, json={"error": "bad record"})
+        return httpx.Response(200, json={"id": body["s3_key"].split("/")[-1]})
+
+    manta_stub.route("POST", "/filemanagement", register)
+    files = [
+        ("files", ("cat.png", b"png-bytes", "image/png")),
+        ("files", ("broken.bin", b"xx", "application/octet-stream")),
+        ("files", ("rejected.txt", b"text", "text/plain")),
+        ("files", ("cv.pdf", b"pdf", "application/pdf")),
+    ]
+    response = client.post("/upload/batch", files=files, headers={"Authorization": f"Bearer {make_token('alice')}"})
+    body = response.json()
+
+    assert response.status_code == 200
+    assert body["succeeded"] == 2 and body["failed"] == 2
+    by_name = {r["filename"]: r for r in body["results"]}
+    assert by_name["cat.png"]["file_id"] == "cat.png" and by_name["cat.png"]["category"] == "images"
+    assert by_name["broken.bin"]["stage"] == "storage"
+    assert by_name["rejected.txt"]["stage"] == "metadata"
+    # Objects whose registration failed are cleaned up by the outbox
+    drain_outbox()
+    assert set(storage.objects) == {blob_key(b"png-bytes"), blob_key(b"pdf")}
+    assert manta_stub.count("POST", "/filemanagement") == 3
+
+
+def test_unreadable_registration_response_fails_only_that_file(manta_stub, monkeypatch):
+    monkeypatch.setattr(main, "storage", MemoryStorage())
+
+    def register(request):
+        body = json.loads(request.content)
+        if body["s3_key"].endswith("garbled.txt"):
+            return httpx.Response(200, content=b"<html>oops</html>")
+        return httpx.Response(200, json={"id": "ok"})
+
+    manta_stub.route("POST", "/filemanagement", register)
+    files = [
+        ("files", ("garbled.txt", b"one", "text/plain")),
+        ("files", ("fine.txt", b"two", "text/plain")),
+    ]
+    response = client.post("/upload/batch", files=files, headers={"Authorization": f"Bearer {make_token('alice')}"})
+
+    assert response.status_code == 200
+    by_name = {r["filename"]: r for r in response.json()["results"]}
+    assert by_name["garbled.txt"]["success"] is False and by_name["garbled.txt"]["stage"] == "metadata"
+    assert by_name["fine.txt"]["success"] is True
@@ -0,0 +1,61 @@
+import httpx
+from fastapi.testclient import TestClient
+
+import main
+from conftest import make_token
+from main import app
+from url_cache import PresignedUrlCache
+
+client = TestClient(app)
+
+
+class CountingStorage:
+    available = True
+
+    def __init__(self):
+        self.signed = 0
+
+    async def generate_presigned_url(self, operation, expires_in=3600, **params):
+        self.signed += 1
+        return f"https://s3.test/{params['Key']}?sig={self.signed}"
+
+    async def delete_object(self, **params):
+        return {}
+
+
+def test_entries_near_expiry_are_not_served():
+    cache = PresignedUrlCache(max_entries=2, min_remaining=100)
+    cache.put("alice", "1", None, {"download_url": "u"}, expires_in=50)
+    assert cache.get("alice", "1") is None
+    cache.put("alice", "1", None, {"download_url": "u"}, expires_in=3600)
+    assert cache.get("alice", "1") == {"download_url": "u"}
+
+
+def test_lru_eviction_and_file_invalidation():
+    cache = PresignedUrlCache(max_entries=2, min_remaining=0)
+    cache.put("alice", "1", None, {}, 3600)
+    cache.put("alice", "1", "copy.txt", {}, 3600)
+    cache.put("alice", "2", None, {}, 3600)
+    assert cache.get("alice", "1") is None
+    cache.invalidate_file("1")
+    assert cache.get("alice", "1", "copy.txt") is None
+    assert cache.get("alice", "2") == {}
+
+
+def test_repeat_download_reuses_url_until_delete(manta_stub, monkeypatch):
+    storage = CountingStorage()
+    monkeypatch.setattr(main, "storage", storage)
+    record = {"id": "1", "s3_key": "user-alice/documents/a.pdf", "filename": "a.pdf"}
+    manta_stub.route("GET", "/filemanagement/1", httpx.Response(200, json=record))
+    manta_stub.route("DELETE", "/filemanagement/1", httpx.Response(200, json={}))
+    headers = {"Authorization": f"Bearer {make_token('alice')}"}
+
+    first = client.get("/download/1", headers=headers).json()
+    second = client.get("/download/1", headers=headers).json()
+    assert first == second and storage.signed == 1
+    assert manta_stub.count("GET", "/filemanagement/1") == 1
+
+    client.delete("/files/1", headers=headers)
+    manta_stub.route("GET", "/filemanagement/1", httpx.Response(404, json={}))
+    manta_stub.route("GET", "/filemanagement", httpx.Response(200, json={"data": []}))
+    assert client.get("/download/1", headers=headers).status_code == 404
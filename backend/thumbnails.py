@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import io
+import logging
+import math
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from botocore.exceptions import ClientError
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image, ImageOps
+from sqlalchemy import BigInteger, Column, Float, Integer, String
+
+from database import Base, SessionLocal, init_db
+from file_records import user_prefix
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+def _int_list(value: str) -> list:
+    return sorted({int(v) for v in value.split(',') if v.strip()})
+
+
+# Requested widths are rounded up to one of these, so each file has a bounded set of renditions
+THUMBNAIL_WIDTHS = _int_list(os.getenv('THUMBNAIL_WIDTHS', '64,128,256,512,1024'))
+# Rendered right after upload; other widths are rendered on first request
+THUMBNAIL_EAGER_WIDTHS = _int_list(os.getenv('THUMBNAIL_EAGER_WIDTHS', '256'))
+THUMBNAIL_FORMATS = {"webp": "image/webp", "jpeg": "image/jpeg"}
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', '80'))
+THUMBNAIL_MAX_SOURCE_BYTES = int(os.getenv('THUMBNAIL_MAX_SOURCE_BYTES', str(40 * 1024 * 1024)))
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', '2'))
+# Resizing is CPU-bound, so it runs in worker processes by default
+THUMBNAIL_POOL = os.getenv('THUMBNAIL_POOL', 'process')
+THUMBNAIL_SOURCE_TYPES = ("image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp", "image/tiff")
+
+
+def render_renditions(source: bytes, specs: list, quality: int = THUMBNAIL_QUALITY) -> list:
+    """Resize one image to every (width, format) in specs, decoding it once.
+
+    Images are never upscaled, EXIF rotation is applied, and transparency is
+    flattened onto white for JPEG.
+    """
+    image = Image.open(io.BytesIO(source))
+    widest = max(width for width, _ in specs)
+    # Orientations 5-8 are rotated a quarter turn, so the stored height is the shown width
+    shown_width = image.height if image.getexif().get(0x0112, 1) in (5, 6, 7, 8) else image.width
+    if shown_width > widest:
+        # Lets the JPEG decoder skip detail the largest rendition can't show
+        scale = widest / shown_width
+        image.draft("RGB", (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+
+    outputs = {}
+    current = image
+    for width in sorted({width for width, _ in specs}, reverse=True):
+        if width < current.width:
+            height = max(round(current.height * width / current.width), 1)
+            # Each size is reduced from the previous one, which is cheaper than from the original
+            current = current.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+        outputs[width] = current
+
+    rendered = []
+    for width, fmt in specs:
+        resized = outputs[width]
+        buffer = io.BytesIO()
+        if fmt == "jpeg":
+            if resized.mode == "RGBA":
+                flat = Image.new("RGB", resized.size, (255, 255, 255))
+                flat.paste(resized, mask=resized.getchannel("A"))
+                resized = flat
+            resized.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+        else:
+            resized.save(buffer, format="WEBP", quality=quality, method=4)
+        rendered.append(buffer.getvalue())
+    return rendered
+
+
+class Rendition(Base):
+    """A stored thumbnail of a file at one width and format"""
+
+    __tablename__ = "renditions"
+
+    s3_key = Column(String(1024), primary_key=True)
+    width = Column(Integer, primary_key=True)
+    fmt = Column(String(8), primary_key=True)
+    preview_key = Column(String(1024), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    created_at = Column(Float, nullable=False)
+
+
+class ThumbnailUnavailable(Exception):
+    """The file can't be turned into a thumbnail"""
+
+
+@dataclass(frozen=True)
+class Thumbnail:
+    content: bytes
+    content_type: str
+    width: int
+
+
+def preview_key_for(owner: str, s3_key: str, width: int, fmt: str) -> str:
+    digest = hashlib.sha256(s3_key.encode()).hexdigest()[:24]
+    return f"{user_prefix(owner)}previews/{digest}/w{width}.{fmt}"
+
+
+class ThumbnailPipeline:
+    """Renders thumbnails in a worker pool and keeps an index of what exists.
+
+    The index (SQLite) records every rendition stored in S3, so each width
+    and format of a file is rendered once; concurrent requests for the same
+    rendition share one render.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        widths: list = THUMBNAIL_WIDTHS,
+        eager_widths: list = THUMBNAIL_EAGER_WIDTHS,
+        workers: int = THUMBNAIL_WORKERS,
+        pool: str = THUMBNAIL_POOL,
+    ):
+        self.session_factory = session_factory
+        self.widths = widths
+        self.eager_widths = [w for w in eager_widths if w in widths]
+        self.workers = workers
+        self.pool = pool
+        self._executor: Optional[Executor] = None
+        self._pending: dict = {}
+        self.hits = 0
+        self.renders = 0
+        self.failures = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.pool == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="thumbnail")
+        return self._executor
+
+    @staticmethod
+    def supports(content_type: Optional[str]) -> bool:
+        return (content_type or "").lower() in THUMBNAIL_SOURCE_TYPES
+
+    def pick_width(self, requested: int) -> int:
+        """Smallest allowed width at least as wide as requested (or the widest)"""
+        for width in self.widths:
+            if width >= requested:
+                return width
+        return self.widths[-1]
+
+    def _lookup(self, s3_key: str, width: int, fmt: str) -> Optional[str]:
+        init_db()
+        with self.session_factory() as db:
+            row = db.get(Rendition, (s3_key, width, fmt))
+            return row.preview_key if row else None
+
+    def _existing(self, s3_key: str) -> set:
+        init_db()
+        with self.session_factory() as db:
+            rows = db.query(Rendition.width, Rendition.fmt).filter(Rendition.s3_key == s3_key).all()
+            return {(width, fmt) for width, fmt in rows}
+
+    def _record(self, rows: list) -> None:
+        with self.session_factory() as db:
+            for row in rows:
+                db.merge(row)
+            db.commit()
+
+    def _remove(self, s3_keys: list) -> list:
+        """Drop index rows; returns the preview keys they pointed at"""
+        init_db()
+        with self.session_factory() as db:
+            rows = db.query(Rendition).filter(Rendition.s3_key.in_(s3_keys)).all()
+            keys = [row.preview_key for row in rows]
+            for row in rows:
+                db.delete(row)
+            db.commit()
+            return keys
+
+    async def _read_source(self, storage: Any, source_key: str) -> bytes:
+        head = await storage.head_object(Key=source_key)
+        if head.get('ContentLength', 0) > THUMBNAIL_MAX_SOURCE_BYTES:
+            raise ThumbnailUnavailable("Image is too large to preview")
+        # A managed download fetches large originals as parallel ranged GETs
+        buffer = io.BytesIO()
+        await storage.download_fileobj(source_key, buffer)
+        return buffer.getvalue()
+
+    async def _render(self, storage: Any, owner: str, s3_key: str, source_key: str, specs: list) -> dict:
+        """Render specs from the source object and store them; returns {(width, fmt): bytes}"""
+        source = await self._read_source(storage, source_key)
+        loop = asyncio.get_running_loop()
+        try:
+            with span("thumbnail.render", f"{len(specs)} renditions"):
+                images = await loop.run_in_executor(self._get_executor(), render_renditions, source, specs)
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Could not render thumbnails for {s3_key}: {e}")
+            raise ThumbnailUnavailable("File could not be read as an image") from e
+        self.renders += len(specs)
+
+        now = time.time()
+        rows = []
+        for (width, fmt), content in zip(specs, images):
+            rows.append(Rendition(
+                s3_key=s3_key, width=width, fmt=fmt, size=len(content), created_at=now,
+                preview_key=preview_key_for(owner, s3_key, width, fmt),
+            ))
+        await asyncio.gather(*(
+            storage.put_object(
+                Key=row.preview_key,
+                Body=content,
+                ContentType=THUMBNAIL_FORMATS[row.fmt],
+                CacheControl="private, max-age=31536000, immutable",
+            )
+            for row, content in zip(rows, images)
+        ))
+        await run_in_threadpool(self._record, rows)
+        return dict(zip(specs, images))
+
+    async def get(self, storage: Any, owner: str, s3_key: str, source_key: str, width: int, fmt: str) -> Thumbnail:
+        """A file's thumbnail at an allowed width, rendering it on first request"""
+        width = self.pick_width(width)
+        preview_key = await run_in_threadpool(self._lookup, s3_key, width, fmt)
+        if preview_key is not None:
+            try:
+                obj = await storage.get_object(Key=preview_key)
+                try:
+                    content = await storage.run(obj['Body'].read)
+                finally:
+                    obj['Body'].close()
+                self.hits += 1
+                return Thumbnail(content, THUMBNAIL_FORMATS[fmt], width)
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+                    raise
+                logger.info(f"Rendition {preview_key} is indexed but missing; rendering again")
+
+        spec = (width, fmt)
+        key = (s3_key, spec)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._render(storage, owner, s3_key, source_key, [spec]))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        rendered = await asyncio.shield(pending)
+        return Thumbnail(rendered[spec], THUMBNAIL_FORMATS[fmt], width)
+
+    async def generate(self, storage: Any, owner: str, s3_key: str, source_key: str) -> int:
+        """Render the eager widths in every format from one decode; returns how many were made"""
+        existing = await run_in_threadpool(self._existing, s3_key)
+        specs = [(width, fmt) for width in self.eager_widths for fmt in THUMBNAIL_FORMATS if (width, fmt) not in existing]
+        if not specs:
+            return 0
+        await self._render(storage, owner, s3_key, source_key, specs)
+        return len(specs)
+
+    async def invalidate(self, s3_key: str) -> None:
+        """Forget renditions of a file whose content was replaced"""
+        await run_in_threadpool(self._remove, [s3_key])
+
+    async def forget(self, s3_keys: list) -> list:
+        """Unindex the renditions of deleted files; returns the preview keys to delete"""
+        return await run_in_threadpool(self._remove, list(s3_keys)) if s3_keys else []
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "renders": self.renders,
+            "failures": self.failures,
+            "in_flight": len(self._pending),
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+thumbnails = ThumbnailPipeline()
@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Send per-step timings to clients (browser devtools show them) in a Server-Timing header
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'true').lower() in ('1', 'true', 'yes')
+# Share of requests written to the log as one JSON trace line
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))
+# Requests slower than this (seconds) are always logged; 0 turns it off
+TRACE_SLOW_THRESHOLD = float(os.getenv('TRACE_SLOW_THRESHOLD', '0'))
+# Bounds the work and memory a request with thousands of upstream calls can cost
+TRACE_MAX_SPANS = int(os.getenv('TRACE_MAX_SPANS', '256'))
+
+
+class Trace:
+    """The spans recorded while handling one request"""
+
+    __slots__ = ("trace_id", "started", "spans", "dropped")
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.spans: list = []
+        self.dropped = 0
+
+    def add(self, name: str, start: float, duration: float, detail: Optional[str] = None) -> None:
+        if len(self.spans) >= TRACE_MAX_SPANS:
+            self.dropped += 1
+            return
+        self.spans.append((name, start, duration, detail))
+
+    def totals(self) -> dict:
+        """{name: (total seconds, count)}, in order of first appearance"""
+        totals: dict = {}
+        for name, _, duration, _ in list(self.spans):
+            total, count = totals.get(name, (0.0, 0))
+            totals[name] = (total + duration, count + 1)
+        return totals
+
+    def server_timing(self, total: float) -> str:
+        entries = []
+        for name, (duration, count) in self.totals().items():
+            entry = f"{name};dur={duration * 1000:.1f}"
+            if count > 1:
+                entry += f';desc="{count} calls"'
+            entries.append(entry)
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "spans": [
+                {
+                    "name": name,
+                    "start_ms": round((start - self.started) * 1000, 2),
+                    "duration_ms": round(duration * 1000, 2),
+                    **({"detail": detail} if detail else {}),
+                }
+                for name, start, duration, detail in list(self.spans)
+            ],
+            **({"dropped_spans": self.dropped} if self.dropped else {}),
+        }
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def record(name: str, start: float, duration: float, detail: Optional[str] = None) -> None:
+    """Add a span timed by the caller (start is a perf_counter reading); no-op outside a request"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, start, duration, detail)
+
+
+@contextmanager
+def span(name: str, detail: Optional[str] = None) -> Iterator[None]:
+    """Time the enclosed block as one span of the current request.
+
+    Works around awaits too; threads started with run_in_threadpool see the
+    request's trace because anyio copies the context.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter() - start, detail)
+
+
+class TracingMiddleware:
+    """ASGI middleware that opens a trace per request.
+
+    Spans finished before the response starts go into its Server-Timing
+    header; a streamed body's later spans only appear in the trace log line.
+    """
+
+    def __init__(self, app, sample_rate: float = TRACE_SAMPLE_RATE, slow_threshold: float = TRACE_SLOW_THRESHOLD, server_timing: bool = SERVER_TIMING):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        token = _current.set(trace)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    timing = trace.server_timing(time.perf_counter() - trace.started)
+                    message["headers"] = [*message.get("headers", []), (b"server-timing", timing.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            elapsed = time.perf_counter() - trace.started
+            slow = self.slow_threshold and elapsed >= self.slow_threshold
+            if slow or (self.sample_rate and random.random() < self.sample_rate):
+                route = scope.get("route")
+                logger.info(json.dumps({
+                    "method": scope["method"],
+                    "route": getattr(route, "path", None),
+                    "status": status,
+                    "duration_ms": round(elapsed * 1000, 2),
+                    **trace.to_dict(),
+                }))
@@ -0,0 +1,54 @@
+import os
+import time
+from typing import Optional
+
+from bounded_cache import BoundedCache
+
+URL_CACHE_MAX_ENTRIES = int(os.getenv('URL_CACHE_MAX_ENTRIES', '10000'))
+# Only hand out a cached URL if it stays valid at least this long
+URL_CACHE_MIN_REMAINING = float(os.getenv('URL_CACHE_MIN_REMAINING', '600'))
+
+
+class PresignedUrlCache:
+    """LRU cache of download payloads holding a still-valid presigned URL"""
+
+    def __init__(self, max_entries: int = URL_CACHE_MAX_ENTRIES, min_remaining: float = URL_CACHE_MIN_REMAINING):
+        self.min_remaining = min_remaining
+        # Wall clock, since presigned URLs expire by it
+        self._entries = BoundedCache(max_entries, clock=time.time, on_discard=self._unindex)
+        self._by_file: dict = {}
+
+    def get(self, username: str, file_id: str, filename: Optional[str] = None) -> Optional[dict]:
+        return self._entries.get((username, file_id, filename))
+
+    def put(self, username: str, file_id: str, filename: Optional[str], payload: dict, expires_in: float) -> None:
+        key = (username, file_id, filename)
+        # The entry lapses while the URL still has min_remaining seconds to run
+        self._by_file.setdefault(file_id, set()).add(key)
+        self._entries.set(key, payload, expires_at=time.time() + expires_in - self.min_remaining)
+
+    def _discard(self, key: tuple) -> None:
+        self._entries.pop(key)
+        self._unindex(key)
+
+    def _unindex(self, key: tuple) -> None:
+        keys = self._by_file.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_file[key[1]]
+
+    def invalidate_file(self, file_id: str) -> None:
+        """Forget every cached URL for a file (e.g. after it is deleted)"""
+        for key in list(self._by_file.get(file_id, ())):
+            self._discard(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._by_file.clear()
+
+    def stats(self) -> dict:
+        return self._entries.stats()
+
+
+url_cache = PresignedUrlCache()